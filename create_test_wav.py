@@ -4,8 +4,8 @@ Create a proper WAV file for testing Dify integration
 """
 
 import wave
-import struct
-import math
+
+import numpy as np
 
 def create_test_wav():
     """Create a simple sine wave WAV file"""
@@ -18,12 +18,10 @@ def create_test_wav():
         wav_file.setsampwidth(2)  # 16-bit
         wav_file.setframerate(sample_rate)
         
-        frames = []
-        for i in range(int(duration * sample_rate)):
-            value = int(32767 * 0.3 * math.sin(2 * math.pi * frequency * i / sample_rate))
-            frames.append(struct.pack('<h', value))
+        t = np.arange(int(duration * sample_rate)) / sample_rate
+        frames = (32767 * 0.3 * np.sin(2 * np.pi * frequency * t)).astype('<i2')
         
-        wav_file.writeframes(b''.join(frames))
+        wav_file.writeframes(frames.tobytes())
 
     print('✅ Created proper WAV file: proper_test.wav')
 
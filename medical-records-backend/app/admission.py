@@ -0,0 +1,279 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+
+class AdmissionRejected(Exception):
+    """
+    流量制限・過負荷のため処理を受け付けなかった場合の例外
+    reason は rate_limited（クライアント毎の上限超過）・queue_full（待ち行列が満杯）・queue_timeout（待ち時間の上限超過）
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request rejected ({reason}), retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    同時処理数の上限・待ち行列・クライアント毎のトークンバケットで処理の受け付けを制御する
+    上限に達している間は最大 queue_size 件を到着順に queue_timeout 秒まで待たせ、それを超える分は即座に断る
+    クライアント毎の上限は rate_per_minute（client_rates で個別に上書き可）で補充され、最大 burst 件まで連続で受け付ける
+    内部で複数件を並行処理するリクエストは cost に並行数を指定し、その数の枠を確保する（max_concurrency が上限）
+    max_concurrency・rate_per_minute が0以下の場合はそれぞれの制限を行わない
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        queue_size: int = 32,
+        queue_timeout: float = 30.0,
+        rate_per_minute: float = 0.0,
+        burst: int = 10,
+        client_rates: Optional[Dict[str, float]] = None,
+        max_clients: int = 10000
+    ):
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.client_rates = client_rates or {}
+        self.max_clients = max_clients
+        self.active = 0
+        self.total_admitted = 0
+        self.total_rejected = {"rate_limited": 0, "queue_full": 0, "queue_timeout": 0}
+        self._waiters: deque = deque()
+        # クライアント毎の [残りトークン, 最終更新時刻]
+        self._buckets: Dict[str, list] = {}
+        # 1件あたりの処理時間の指数移動平均（Retry-After の見積もりに使う）
+        self._hold_time = 1.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, client: str, cost: int = 1) -> float:
+        """
+        cost 件分の処理枠を確保して確保した時刻を返す（受け付けられない場合は AdmissionRejected）
+        """
+        cost = self._cost(cost)
+        self._take_token(client)
+        if self.max_concurrency <= 0 or (self.active + cost <= self.max_concurrency and not self._waiters):
+            self.active += cost
+            return self._admitted()
+        if len(self._waiters) >= self.queue_size:
+            self._refund_token(client)
+            raise self._reject("queue_full", self._estimated_wait(len(self._waiters)))
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (waiter, cost)
+        self._waiters.append(entry)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # 期限と同時に枠を譲られた場合は、その枠を次の待ち手に回す
+                self.release(None, cost)
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                # 先頭で枠が空くのを待っていた場合は、後ろの待ち手が入れるようになる
+                self._wake_waiters()
+            self._refund_token(client)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise self._reject("queue_timeout", self._estimated_wait(len(self._waiters)))
+        return self._admitted()
+
+    def release(self, admitted_at: Optional[float], cost: int = 1) -> None:
+        """
+        cost 件分の処理枠を解放し、待ち行列の先頭から入れるだけ譲る（admitted_at は acquire の戻り値で、処理時間の見積もりに使う）
+        """
+        if admitted_at is not None:
+            self._hold_time = 0.8 * self._hold_time + 0.2 * (time.monotonic() - admitted_at)
+        self.active = max(0, self.active - self._cost(cost))
+        self._wake_waiters()
+
+    def _cost(self, cost: int) -> int:
+        # 上限を超える枠は確保できないため、並行数の上限までに抑える
+        return max(1, min(cost, self.max_concurrency)) if self.max_concurrency > 0 else 1
+
+    def _wake_waiters(self) -> None:
+        while self._waiters:
+            waiter, cost = self._waiters[0]
+            if waiter.done():
+                self._waiters.popleft()
+                continue
+            if self.active + cost > self.max_concurrency > 0:
+                return
+            self._waiters.popleft()
+            self.active += cost
+            waiter.set_result(None)
+
+    def _admitted(self) -> float:
+        self.total_admitted += 1
+        return time.monotonic()
+
+    def _reject(self, reason: str, retry_after: float) -> AdmissionRejected:
+        self.total_rejected[reason] += 1
+        return AdmissionRejected(reason, retry_after)
+
+    def _estimated_wait(self, ahead: int) -> float:
+        """
+        待ち行列の ahead 件が処理されるまでのおおよその時間
+        """
+        return self._hold_time * (ahead + 1) / max(1, self.max_concurrency)
+
+    def _take_token(self, client: str) -> None:
+        rate = self.client_rates.get(client, self.rate_per_minute) / 60
+        if rate <= 0:
+            return
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                self._prune(now)
+            bucket = self._buckets[client] = [float(self.burst), now]
+        bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            raise self._reject("rate_limited", (1 - bucket[0]) / rate)
+        bucket[0] -= 1
+
+    def _refund_token(self, client: str) -> None:
+        bucket = self._buckets.get(client)
+        if bucket is not None:
+            bucket[0] = min(float(self.burst), bucket[0] + 1)
+
+    def _prune(self, now: float) -> None:
+        """
+        補充済み（満タン）のバケットを削除し、それでも上限を超える場合は古い順に削除
+        """
+        for client, (tokens, updated_at) in list(self._buckets.items()):
+            rate = self.client_rates.get(client, self.rate_per_minute) / 60
+            if tokens + (now - updated_at) * rate >= self.burst:
+                del self._buckets[client]
+        while len(self._buckets) >= self.max_clients:
+            del self._buckets[next(iter(self._buckets))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "queue_size": self.queue_size,
+            "total_admitted": self.total_admitted,
+            "total_rejected": dict(self.total_rejected),
+            "tracked_clients": len(self._buckets),
+            "estimated_hold_time": round(self._hold_time, 3),
+        }
+
+def client_key(headers: Headers, client: Optional[tuple], header_names: Iterable[str]) -> str:
+    """
+    流量制限の単位となるクライアント（APIキー・クリニックIDのヘッダー、なければ接続元IP）
+    """
+    for name in header_names:
+        value = headers.get(name)
+        if value:
+            return f"{name.lower()}:{value}"
+    return f"ip:{client[0]}" if client else "anonymous"
+
+# 断った理由毎のステータスコードとメッセージ
+REJECTION_RESPONSES = {
+    "rate_limited": (429, "リクエストが多すぎます。しばらくしてから再試行してください"),
+    "queue_full": (503, "処理が混み合っています。しばらくしてから再試行してください"),
+    "queue_timeout": (503, "処理が混み合っています。しばらくしてから再試行してください"),
+}
+
+def retry_after_seconds(error: AdmissionRejected) -> int:
+    """
+    Retry-After に返す再試行までの秒数（1秒以上の整数）
+    """
+    return max(1, math.ceil(error.retry_after))
+
+class AdmissionMiddleware:
+    """
+    指定したパスへのPOSTを AdmissionController で受け付け、処理が終わる（ストリーミング応答の送信完了）まで枠を保持する
+    本文の受信・パースより前に判定するため、断るリクエストの音声をメモリや一時ファイルに読み込まない
+    costs にはパス毎に確保する枠の数（内部の並行数）を指定する（指定がなければ1）
+    断った場合は 429・503 と Retry-After を返す
+    """
+
+    def __init__(
+        self,
+        app,
+        controller: AdmissionController,
+        paths: Iterable[str],
+        header_names: Iterable[str] = (),
+        on_decision: Optional[Callable[[str], None]] = None,
+        costs: Optional[Dict[str, int]] = None
+    ):
+        self.app = app
+        self.controller = controller
+        self.paths = frozenset(paths)
+        self.header_names = tuple(header_names)
+        self.on_decision = on_decision
+        self.costs = costs or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        client = client_key(Headers(scope=scope), scope.get("client"), self.header_names)
+        cost = self.costs.get(scope["path"], 1)
+        try:
+            admitted_at = await self.controller.acquire(client, cost)
+        except AdmissionRejected as e:
+            if self.on_decision is not None:
+                self.on_decision(e.reason)
+            status_code, detail = REJECTION_RESPONSES[e.reason]
+            response = JSONResponse({"detail": detail}, status_code=status_code, headers={"Retry-After": str(retry_after_seconds(e))})
+            await response(scope, receive, send)
+            return
+        if self.on_decision is not None:
+            self.on_decision("admitted")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(admitted_at, cost)
+
+class BodySizeLimitMiddleware:
+    """
+    指定したパスへのリクエスト本文の大きさを制限する（limits はパス毎の上限バイト数で、リクエスト毎に参照する）
+    Content-Length が上限を超える場合は本文を受信する前に413を返し、Content-Length がない場合も受信量が上限を超えた時点で打ち切る
+    フォームのパース（一時ファイルへの書き出し）より前に判定するため、上限を超えるアップロードをディスクに書き切らない
+    """
+
+    def __init__(self, app, limits: Dict[str, int], detail: str):
+        self.app = app
+        self.limits = limits
+        self.detail = detail
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+            await JSONResponse({"detail": self.detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # フォームのパース中に送出され、FastAPIの例外ハンドラで413の応答になる
+                    raise HTTPException(status_code=413, detail=self.detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
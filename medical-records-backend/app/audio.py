@@ -0,0 +1,377 @@
+import io
+import os
+import wave
+from typing import Optional
+
+import numpy as np
+
+from .wav import FORMAT_EXTENSIONS
+
+# 音声認識に十分な品質（16kHz・モノラル・16bit）
+TARGET_SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.02
+# 前処理・分割は録音全体を読み込まず、このフレーム数ずつ処理する（44.1kHzで約1.5秒）
+BLOCK_FRAMES = 1 << 16
+
+def decode_pcm(raw: bytes, sample_width: int, channels: int) -> np.ndarray:
+    """
+    PCMのバイト列を float32 の[-1, 1]配列（サンプル×チャンネル）に変換
+    """
+    if sample_width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif sample_width == 3:
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = packed[:, 0] | (packed[:, 1] << 8) | (packed[:, 2] << 16)
+        values = np.where(values >= 1 << 23, values - (1 << 24), values)
+        samples = values.astype(np.float32) / float(1 << 23)
+    elif sample_width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / float(1 << 31)
+    else:
+        raise ValueError(f"unsupported sample width: {sample_width}")
+    return samples.reshape(-1, channels)
+
+def read_wav(path: str) -> tuple:
+    """
+    PCM WAVを読み込み、（float32の[-1, 1]配列（サンプル×チャンネル）, サンプルレート）を返す
+    """
+    with wave.open(path, "rb") as wav_file:
+        channels = wav_file.getnchannels()
+        sample_width = wav_file.getsampwidth()
+        sample_rate = wav_file.getframerate()
+        raw = wav_file.readframes(wav_file.getnframes())
+    return decode_pcm(raw, sample_width, channels), sample_rate
+
+def iter_wav_blocks(wav_file: wave.Wave_read, block_frames: int = BLOCK_FRAMES):
+    """
+    開いたWAVを block_frames ずつ読み込み、モノラル化した float32 配列を順に返す
+    """
+    channels = wav_file.getnchannels()
+    sample_width = wav_file.getsampwidth()
+    while True:
+        raw = wav_file.readframes(block_frames)
+        if not raw:
+            return
+        yield downmix(decode_pcm(raw, sample_width, channels))
+
+def downmix(samples: np.ndarray) -> np.ndarray:
+    """
+    全チャンネルの平均でモノラル化
+    """
+    return samples.mean(axis=1, dtype=np.float32) if samples.shape[1] > 1 else samples[:, 0]
+
+def lowpass_taps(cutoff: float, num_taps: int = 63) -> np.ndarray:
+    """
+    Hann窓付きsincのローパスFIR係数（cutoffはナイキスト周波数に対する比）
+    """
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = cutoff * np.sinc(cutoff * n) * np.hanning(num_taps)
+    return (taps / taps.sum()).astype(np.float32)
+
+class StreamingResampler:
+    """
+    ブロック単位のリサンプリング（エイリアシング防止のローパス後に線形補間）
+    ローパスFIRの重なり分と補間位置をブロック間で持ち越すため、全ブロックの出力を連結すると一括処理と同じ結果になる
+    """
+
+    def __init__(self, source_rate: int, target_rate: int = TARGET_SAMPLE_RATE):
+        self.source_rate = source_rate
+        self.target_rate = target_rate
+        self.step = source_rate / target_rate
+        self.taps = lowpass_taps(0.9 * target_rate / source_rate) if target_rate < source_rate else None
+        # mode="same" の畳み込みと一致させるため、先頭に係数の半分のゼロを置く
+        self.pad = (len(self.taps) - 1) // 2 if self.taps is not None else 0
+        self.history = np.zeros(self.pad, dtype=np.float32)
+        # 補間に使うフィルタ済みサンプル（先頭のサンプル番号は self.offset）
+        self.filtered = np.zeros(0, dtype=np.float32)
+        self.offset = 0
+        self.input_length = 0
+        self.output_length = 0
+
+    def _filter(self, samples: np.ndarray) -> np.ndarray:
+        if self.taps is None:
+            return samples
+        data = np.concatenate([self.history, samples])
+        if len(data) < len(self.taps):
+            self.history = data
+            return data[:0]
+        self.history = data[len(data) - len(self.taps) + 1:]
+        return np.convolve(data, self.taps, mode="valid")
+
+    def _interpolate(self, end: int) -> np.ndarray:
+        # 出力 [output_length, end) を補間し、以降の補間に不要になったサンプルを捨てる
+        positions = np.arange(self.output_length, end, dtype=np.float64) * self.step - self.offset
+        output = np.interp(positions, np.arange(len(self.filtered)), self.filtered).astype(np.float32)
+        self.output_length = max(self.output_length, end)
+        drop = min(int(self.output_length * self.step) - self.offset, len(self.filtered) - 1)
+        if drop > 0:
+            self.filtered = self.filtered[drop:]
+            self.offset += drop
+        return output
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        モノラルのブロックを入力し、確定した分の出力を返す
+        """
+        if self.source_rate == self.target_rate:
+            return samples
+        self.input_length += len(samples)
+        self.filtered = np.concatenate([self.filtered, self._filter(samples)])
+        # 全体の長さで決まる出力数を超えないよう、1ステップ分の余裕を残して補間する
+        last = self.offset + len(self.filtered) - 1 - self.step
+        if last < 0:
+            return self.filtered[:0]
+        return self._interpolate(int(last // self.step) + 1)
+
+    def flush(self) -> np.ndarray:
+        """
+        残りの出力を返す（入力の終わりで呼ぶ）
+        """
+        if self.source_rate == self.target_rate or self.input_length == 0:
+            return np.zeros(0, dtype=np.float32)
+        if self.taps is not None:
+            self.filtered = np.concatenate([self.filtered, self._filter(np.zeros(self.pad, dtype=np.float32))])
+        target_length = int(round(self.input_length / self.source_rate * self.target_rate))
+        return self._interpolate(target_length)
+
+def frame_rms(samples: np.ndarray, frame: int) -> np.ndarray:
+    """
+    frameサンプル毎のRMS（末尾の端数は除外）
+    """
+    usable = len(samples) // frame * frame
+    return np.sqrt(np.mean(np.square(samples[:usable].reshape(-1, frame)), axis=1))
+
+def silence_bounds(rms: np.ndarray, frame: int, length: int, sample_rate: int, threshold_db: float = -45.0, padding: float = 0.2) -> tuple:
+    """
+    フレームRMSから先頭・末尾の無音を除いた範囲（開始・終了のサンプル番号、前後にpadding秒を残す）を返す
+    開始位置はフレーム境界に揃える（範囲内のフレームRMSを全体のフレームRMSから切り出せるように）
+    全体がしきい値以下の場合は除去しない（空の音声を送らず、小さな声の録音も失わないように）
+    """
+    if length < frame:
+        return 0, length
+    loud = np.flatnonzero(rms > 10 ** (threshold_db / 20))
+    if len(loud) == 0:
+        return 0, length
+    pad = int(padding * sample_rate)
+    start = max(0, loud[0] * frame - pad) // frame * frame
+    end = min(length, (loud[-1] + 1) * frame + pad)
+    return int(start), int(end)
+
+def find_split_points(samples: np.ndarray, sample_rate: int, segment_seconds: float, threshold_db: float = -45.0, smoothing_seconds: float = 0.3) -> list:
+    """
+    segment_seconds毎の境界の前後25%の範囲で、最も静かな位置（最小値+threshold_db以内）のうち境界に最も近い位置を
+    分割点（サンプル番号）として返す
+    """
+    frame = max(1, int(sample_rate * FRAME_SECONDS))
+    return split_points_from_rms(frame_rms(samples, frame), frame, segment_seconds, threshold_db, smoothing_seconds)
+
+def split_points_from_rms(rms: np.ndarray, frame: int, segment_seconds: float, threshold_db: float = -45.0, smoothing_seconds: float = 0.3) -> list:
+    """
+    find_split_points の探索をフレームRMSから行う（音声全体を読み込まずに分割点を求める）
+    単語途中の短い無音で切らないよう、フレームRMSを smoothing_seconds の移動平均で平滑化してから探索する
+    """
+    frames_per_segment = max(1, int(segment_seconds / FRAME_SECONDS))
+    if len(rms) < frames_per_segment * 1.5:
+        return []
+
+    window = max(1, int(smoothing_seconds / FRAME_SECONDS))
+    energy = np.convolve(rms, np.ones(window, dtype=np.float32) / window, mode="same")
+    search = max(1, frames_per_segment // 4)
+    points = []
+    previous = 0
+    target = frames_per_segment
+    # 最後の区間が短くなりすぎないよう、残りが半区間未満になったら打ち切る
+    while target < len(rms) - frames_per_segment // 2:
+        low = max(previous + 1, target - search)
+        high = min(len(rms), target + search)
+        window_energy = energy[low:high]
+        candidates = low + np.flatnonzero(window_energy <= window_energy.min() + 10 ** (threshold_db / 20))
+        best = int(candidates[np.argmin(np.abs(candidates - target))])
+        points.append(best * frame)
+        previous = best
+        target = best + frames_per_segment
+    return points
+
+def to_pcm16(samples: np.ndarray) -> np.ndarray:
+    return (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2")
+
+def open_encoder(output_path: str, sample_rate: int, audio_format: str = "wav") -> tuple:
+    """
+    モノラル16bit音声をWAV（既定）・FLAC・Opusで書き出すファイルを開き、
+    （PCM16のバイト列を追記する関数, close()を持つファイル, 実際に使用する形式）を返す
+    FLAC・Opusはsoundfileが必要で、利用できない場合はWAVで書き出す
+    """
+    if audio_format in ("flac", "opus"):
+        try:
+            import soundfile
+
+            if audio_format == "flac":
+                sound_file = soundfile.SoundFile(output_path, "w", sample_rate, 1, format="FLAC", subtype="PCM_16")
+            else:
+                sound_file = soundfile.SoundFile(output_path, "w", sample_rate, 1, format="OGG", subtype="OPUS")
+            return (lambda raw: sound_file.write(np.frombuffer(raw, dtype="<i2"))), sound_file, audio_format
+        except (ImportError, RuntimeError, ValueError) as e:
+            print(f"Audio encoder for {audio_format} unavailable ({str(e)}), writing WAV instead")
+
+    wav_file = wave.open(output_path, "wb")
+    wav_file.setnchannels(1)
+    wav_file.setsampwidth(2)
+    wav_file.setframerate(sample_rate)
+    return wav_file.writeframes, wav_file, "wav"
+
+def resample_wav_file(input_path: str, staging_path: str, block_frames: int = BLOCK_FRAMES) -> dict:
+    """
+    WAVを block_frames ずつモノラル化・16kHzリサンプリングし、16bit WAVとして staging_path に書き出す
+    無音除去・分割点の探索に使うフレームRMSも同時に求め、入力の情報とともに返す（メモリ使用量は録音の長さによらない）
+    """
+    frame = max(1, int(TARGET_SAMPLE_RATE * FRAME_SECONDS))
+    with wave.open(input_path, "rb") as source:
+        sample_rate = source.getframerate()
+        channels = source.getnchannels()
+        resampler = StreamingResampler(sample_rate)
+        input_frames = 0
+        output_length = 0
+        rms_blocks = []
+        rest = np.zeros(0, dtype=np.float32)
+        with wave.open(staging_path, "wb") as staged:
+            staged.setnchannels(1)
+            staged.setsampwidth(2)
+            staged.setframerate(TARGET_SAMPLE_RATE)
+
+            def write(block: np.ndarray) -> None:
+                nonlocal output_length, rest
+                # フレームRMSはブロックの境界をまたぐ端数を次のブロックへ持ち越して計算する
+                data = np.concatenate([rest, block])
+                usable = len(data) // frame * frame
+                rms_blocks.append(frame_rms(data[:usable], frame))
+                rest = data[usable:]
+                output_length += len(block)
+                staged.writeframes(to_pcm16(block).tobytes())
+
+            for block in iter_wav_blocks(source, block_frames):
+                input_frames += len(block)
+                write(resampler.process(block))
+            write(resampler.flush())
+
+    return {
+        "input_sample_rate": sample_rate,
+        "input_channels": channels,
+        "input_seconds": input_frames / sample_rate if sample_rate else 0.0,
+        "output_length": output_length,
+        "rms": np.concatenate(rms_blocks),
+    }
+
+def copy_wav_range(staging_path: str, output_path: str, start: int, end: int, audio_format: str = "wav", block_frames: int = BLOCK_FRAMES) -> str:
+    """
+    16bit WAV（staging_path）の start〜end サンプルを block_frames ずつ書き出し、実際に使用した形式を返す
+    """
+    with wave.open(staging_path, "rb") as staged:
+        staged.setpos(start)
+        write, output, used_format = open_encoder(output_path, staged.getframerate(), audio_format)
+        try:
+            remaining = end - start
+            while remaining > 0:
+                raw = staged.readframes(min(block_frames, remaining))
+                if not raw:
+                    break
+                write(raw)
+                remaining -= len(raw) // 2
+        finally:
+            output.close()
+    return used_format
+
+def warm_up_worker() -> int:
+    """
+    プロセスプールのワーカーを起動させる（numpy等の読み込みを録音中に済ませる）
+    """
+    return os.getpid()
+
+def staged_bounds(staged: dict, trim: bool, threshold_db: float) -> tuple:
+    if not trim:
+        return 0, staged["output_length"]
+    frame = max(1, int(TARGET_SAMPLE_RATE * FRAME_SECONDS))
+    return silence_bounds(staged["rms"], frame, staged["output_length"], TARGET_SAMPLE_RATE, threshold_db)
+
+def remove_if_exists(path: str) -> None:
+    if os.path.exists(path):
+        os.unlink(path)
+
+def preprocess_wav_file(input_path: str, output_path: str, audio_format: str = "wav", trim: bool = True, threshold_db: float = -45.0, block_frames: int = BLOCK_FRAMES) -> Optional[dict]:
+    """
+    モノラル化・16kHzリサンプリング・前後の無音除去を行い output_path に書き出す
+    リサンプリング後の16bit音声を一時ファイルに書き、無音除去の範囲を決めてから書き出すため、録音全体をメモリに読み込まない
+    プロセスプールから呼び出す前提。WAVとして読めない場合はNoneを返す
+    """
+    staging_path = output_path + ".staging"
+    try:
+        try:
+            staged = resample_wav_file(input_path, staging_path, block_frames)
+        except (wave.Error, ValueError, EOFError):
+            return None
+
+        start, end = staged_bounds(staged, trim, threshold_db)
+        if (start, end) == (0, staged["output_length"]) and audio_format == "wav":
+            os.replace(staging_path, output_path)
+            used_format = "wav"
+        else:
+            used_format = copy_wav_range(staging_path, output_path, start, end, audio_format, block_frames)
+    finally:
+        remove_if_exists(staging_path)
+    return {
+        "format": used_format,
+        "input_sample_rate": staged["input_sample_rate"],
+        "input_channels": staged["input_channels"],
+        "input_seconds": staged["input_seconds"],
+        "output_seconds": (end - start) / TARGET_SAMPLE_RATE,
+    }
+
+def split_wav_file(input_path: str, output_dir: str, segment_seconds: float, audio_format: str = "wav", trim: bool = True, threshold_db: float = -45.0, block_frames: int = BLOCK_FRAMES) -> list:
+    """
+    前処理（モノラル化・16kHz化・無音除去）後の音声を無音位置で分割し、
+    output_dir に録音順のファイルとして書き出してパスの一覧を返す（プロセスプールから呼び出す前提）
+    分割点はフレームRMSのみから求め、各区間はリサンプリング済みの一時ファイルからブロック単位で書き出す
+    """
+    staging_path = os.path.join(output_dir, "resampled.staging")
+    try:
+        staged = resample_wav_file(input_path, staging_path, block_frames)
+        start, end = staged_bounds(staged, trim, threshold_db)
+        # 開始位置はフレーム境界にあるため、範囲内のフレームRMSは全体のフレームRMSの切り出しと一致する
+        frame = max(1, int(TARGET_SAMPLE_RATE * FRAME_SECONDS))
+        rms = staged["rms"][start // frame:end // frame]
+        points = split_points_from_rms(rms, frame, segment_seconds, threshold_db=threshold_db)
+        boundaries = [start] + [start + point for point in points] + [end]
+        paths = []
+        for index, (segment_start, segment_end) in enumerate(zip(boundaries[:-1], boundaries[1:])):
+            base_path = os.path.join(output_dir, f"segment_{index:03d}")
+            used_format = copy_wav_range(staging_path, base_path, segment_start, segment_end, audio_format, block_frames)
+            path = base_path + FORMAT_EXTENSIONS[used_format]
+            os.replace(base_path, path)
+            paths.append(path)
+    finally:
+        remove_if_exists(staging_path)
+    return paths
+
+def synthesize_wav(seconds: float, sample_rate: int = 44100, channels: int = 1, leading_silence: float = 0.0, trailing_silence: float = 0.0, seed: int = 0) -> bytes:
+    """
+    テスト・ベンチマーク用に発話区間と無音区間を含む16bit WAVをベクトル演算で生成
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate), dtype=np.float32) / sample_rate
+    carrier = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.1 * np.sin(2 * np.pi * 660 * t)
+    envelope = (np.sin(2 * np.pi * 0.25 * t) > -0.3).astype(np.float32)
+    speech = carrier * envelope + 0.005 * rng.standard_normal(len(t)).astype(np.float32)
+    audio = np.concatenate([
+        np.zeros(int(leading_silence * sample_rate), dtype=np.float32),
+        speech,
+        np.zeros(int(trailing_silence * sample_rate), dtype=np.float32),
+    ])
+    pcm = to_pcm16(np.repeat(audio[:, None], channels, axis=1))
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm.tobytes())
+    return buffer.getvalue()
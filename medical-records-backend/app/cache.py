@@ -0,0 +1,201 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from .fileio import run_file_io
+
+class CacheBackend:
+    """
+    キャッシュバックエンドのインターフェース（イベントループを塞がないよう、I/Oを伴う操作は全て非同期）
+    """
+
+    async def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def count(self) -> int:
+        raise NotImplementedError
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    TTLとエントリ数上限付きのLRUインメモリキャッシュ
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    async def count(self) -> int:
+        return len(self._entries)
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    再起動後も保持されるSQLiteファイルのLRUキャッシュ（値はJSONで保存）
+    書き込み競合の待機（busy_timeout）や期限切れ・上限超過分の削除でイベントループを塞がないよう、
+    SQLiteの操作はファイルI/O用スレッドプールで実行する
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # 複数のワーカープロセスで同じファイルを共有した場合の書き込み競合を待つ
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed_at ON cache_entries (accessed_at)")
+
+    async def get(self, key: str) -> Optional[Any]:
+        return await run_file_io(self._get, key)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        await run_file_io(self._set, key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        await run_file_io(self._delete, key)
+
+    async def count(self) -> int:
+        return await run_file_io(self._count)
+
+    def _get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+
+    def _set(self, key: str, value: Any, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + ttl, now)
+            )
+            self._conn.execute("DELETE FROM cache_entries WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                "DELETE FROM cache_entries WHERE key IN ("
+                "SELECT key FROM cache_entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def _delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def _count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Redis互換サーバーに保存するキャッシュ（値はJSON、期限切れはサーバー側のTTLで削除）
+    エントリ数の上限はサーバーの maxmemory-policy（allkeys-lru等）で管理する。redisパッケージ（redis.asyncio）が必要
+    """
+
+    def __init__(self, url: str, prefix: str = "medical-records:cache:"):
+        import redis.asyncio
+
+        self.prefix = prefix
+        self._client = redis.asyncio.Redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = await self._client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        await self._client.set(self.prefix + key, json.dumps(value, ensure_ascii=False), px=max(1, int(ttl * 1000)))
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(self.prefix + key)
+
+    async def count(self) -> int:
+        return len([key async for key in self._client.scan_iter(match=self.prefix + "*", count=1000)])
+
+class AudioResultCache:
+    """
+    音声ハッシュをキーに、DifyのfileIDと変換済み医療記録をキャッシュ
+    """
+
+    def __init__(self, backend: CacheBackend, file_ttl: float = 3600.0, result_ttl: float = 86400.0):
+        self.backend = backend
+        self.file_ttl = file_ttl
+        self.result_ttl = result_ttl
+        self.hits: Dict[str, int] = {"file_id": 0, "record": 0}
+        self.misses: Dict[str, int] = {"file_id": 0, "record": 0}
+
+    @staticmethod
+    def record_key(audio_hash: str, prompt: str) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return f"record:{audio_hash}:{prompt_hash}"
+
+    async def get_file_id(self, audio_hash: str) -> Optional[str]:
+        return await self._get("file_id", f"file_id:{audio_hash}")
+
+    async def set_file_id(self, audio_hash: str, file_id: str) -> None:
+        await self.backend.set(f"file_id:{audio_hash}", file_id, self.file_ttl)
+
+    async def invalidate_file_id(self, audio_hash: str) -> None:
+        await self.backend.delete(f"file_id:{audio_hash}")
+
+    async def get_record(self, audio_hash: str, prompt: str) -> Optional[dict]:
+        return await self._get("record", self.record_key(audio_hash, prompt))
+
+    async def set_record(self, audio_hash: str, prompt: str, record: dict) -> None:
+        await self.backend.set(self.record_key(audio_hash, prompt), record, self.result_ttl)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": await self.backend.count(),
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+        }
+
+    async def _get(self, kind: str, key: str) -> Optional[Any]:
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses[kind] += 1
+        else:
+            self.hits[kind] += 1
+        return value
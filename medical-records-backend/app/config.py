@@ -0,0 +1,32 @@
+import os
+from typing import Dict, Optional
+
+# .env ファイルの値（初回参照時に1度だけ読み込む、os.environ は書き換えない）
+_dotenv: Optional[Dict[str, str]] = None
+
+def dotenv_values_once() -> Dict[str, str]:
+    """
+    .env ファイルの値を取得（ENV_FILE でパスを指定可能、既定はバックエンドの .env）
+    """
+    global _dotenv
+    if _dotenv is None:
+        from dotenv import dotenv_values, find_dotenv
+
+        path = os.environ.get("ENV_FILE") or find_dotenv()
+        _dotenv = {key: value for key, value in dotenv_values(path).items() if value is not None} if path else {}
+    return _dotenv
+
+def getenv(name: str, default: Optional[str] = None) -> Optional[str]:
+    """
+    設定値を取得（環境変数を優先し、なければ .env ファイルの値）
+    """
+    value = os.environ.get(name)
+    if value is None:
+        value = dotenv_values_once().get(name, default)
+    return value
+
+def config_environ() -> Dict[str, str]:
+    """
+    .env ファイルの値を環境変数で上書きした設定全体
+    """
+    return {**dotenv_values_once(), **os.environ}
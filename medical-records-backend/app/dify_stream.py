@@ -0,0 +1,98 @@
+import json
+import re
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+# text_chunk中の完結した "key": "value" ペアを検出
+_PARTIAL_FIELD_PATTERN = re.compile(r'"(subjective|objective|assessment|plan)"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+async def iter_sse_events(lines: AsyncIterator[str]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    DifyのServer-Sent Eventsを行単位で逐次パースし、data部のJSONをイベントとして返す
+    """
+    data_lines: List[str] = []
+    event_name: Optional[str] = None
+    async for line in lines:
+        line = line.rstrip("\r\n")
+        if not line:
+            event = _dispatch(event_name, data_lines)
+            data_lines, event_name = [], None
+            if event is not None:
+                yield event
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            data_lines.append(value)
+        elif field == "event":
+            event_name = value
+    event = _dispatch(event_name, data_lines)
+    if event is not None:
+        yield event
+
+def _dispatch(event_name: Optional[str], data_lines: List[str]) -> Optional[Dict[str, Any]]:
+    if not data_lines:
+        return None
+    try:
+        event = json.loads("\n".join(data_lines))
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(event, dict):
+        return None
+    if event_name and "event" not in event:
+        event["event"] = event_name
+    return event
+
+class StructuredOutputTracker:
+    """
+    ストリーミングイベントからstructured_outputの各フィールドを確定次第取り出す
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.text = ""
+        self.outputs: Optional[Dict[str, Any]] = None
+
+    def feed(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        イベントを取り込み、新たに確定・更新されたフィールドのみを返す
+        """
+        kind = event.get("event")
+        data = event.get("data") or {}
+        if kind == "text_chunk":
+            self.text += data.get("text", "")
+            return self._update(self._parse_partial_text(self.text))
+        if kind in ("node_finished", "workflow_finished"):
+            outputs = data.get("outputs") or {}
+            if kind == "workflow_finished":
+                self.outputs = outputs
+            structured = outputs.get("structured_output")
+            if isinstance(structured, dict):
+                return self._update(structured.items())
+        return {}
+
+    def _update(self, items: Iterable) -> Dict[str, Any]:
+        changed = {}
+        for key, value in items:
+            if self.fields.get(key) != value:
+                self.fields[key] = value
+                changed[key] = value
+        return changed
+
+    @staticmethod
+    def _parse_partial_text(text: str) -> List:
+        items = []
+        for match in _PARTIAL_FIELD_PATTERN.finditer(text):
+            try:
+                items.append((match.group(1), json.loads(f'"{match.group(2)}"')))
+            except json.JSONDecodeError:
+                continue
+        return items
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """
+    クライアント向けSSEメッセージを整形
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
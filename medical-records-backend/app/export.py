@@ -0,0 +1,150 @@
+import csv
+import io
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import orjson
+
+from .fileio import run_file_io
+from .sheets import SHEET_HEADER, record_to_row
+from .storage import RECORD_FIELDS, RecordStore
+from .xlsx import StreamingXlsxWriter
+
+# 一括エクスポートの列順
+EXPORT_FIELDS = ["id"] + RECORD_FIELDS + ["created_at"]
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# Excel出力のシート名と列幅（列はスプレッドシート出力と同じ）
+XLSX_SHEET_NAME = "医療記録"
+XLSX_COLUMN_WIDTHS = [8, 12, 18, 30, 50, 40, 30, 40, 40, 14, 30, 26]
+
+async def iter_export_batches(
+    store: RecordStore,
+    patient_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    batch_size: int = 1000
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    条件に合う記録を作成日時順にページ単位で読み出す
+    """
+    cursor = None
+    while True:
+        records, cursor = await store.query(
+            patient_id=patient_id,
+            date_from=date_from,
+            date_to=date_to,
+            sort="created_at",
+            order="asc",
+            limit=batch_size,
+            cursor=cursor,
+            fields=EXPORT_FIELDS
+        )
+        if records:
+            yield records
+        if cursor is None:
+            return
+
+async def stream_csv(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """
+    記録をCSVとして逐次出力（Excelで文字化けしないようBOM付きUTF-8）
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    writer.writerow(EXPORT_FIELDS)
+    async for records in batches:
+        writer.writerows([record.get(field) for field in EXPORT_FIELDS] for record in records)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+async def stream_ndjson(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """
+    記録を1行1JSONで逐次出力
+    """
+    async for records in batches:
+        yield b"".join(
+            orjson.dumps({field: record.get(field) for field in EXPORT_FIELDS}) + b"\n"
+            for record in records
+        )
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Parquetライターの出力を溜めておき、行グループ毎に取り出すための書き込み先
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+async def stream_parquet(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """
+    記録をParquetとして逐次出力（バッチ毎に1行グループ、pyarrowが必要）
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([("id", pa.int64())] + [(field, pa.string()) for field in EXPORT_FIELDS[1:]])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        async for records in batches:
+            columns = {field: [record.get(field) for record in records] for field in EXPORT_FIELDS}
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+async def stream_xlsx(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """
+    記録をxlsxとして逐次出力（バッチ毎に行の書き込み・圧縮をファイルI/O用スレッドプールで行い、圧縮済みの分を送る）
+    """
+    sink = _ChunkSink()
+    writer = StreamingXlsxWriter(sink, XLSX_SHEET_NAME, SHEET_HEADER, column_widths=XLSX_COLUMN_WIDTHS)
+    closed = False
+    try:
+        async for records in batches:
+            await run_file_io(writer.write_rows, map(record_to_row, records))
+            data = sink.drain()
+            if data:
+                yield data
+        await run_file_io(writer.close)
+        closed = True
+    finally:
+        if not closed:
+            writer.close()
+    yield sink.drain()
+
+EXPORT_STREAMERS = {
+    "csv": stream_csv,
+    "ndjson": stream_ndjson,
+    "parquet": stream_parquet,
+    "xlsx": stream_xlsx,
+}
@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, BinaryIO, Callable, Optional
+
+# ファイルI/O・ハッシュ計算専用のスレッドプール（イベントループと既定のスレッドプールを塞がない）
+file_io_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="file-io")
+
+def configure_file_io(max_workers: int) -> None:
+    """
+    ファイルI/O用スレッドプールのワーカー数を設定
+    """
+    global file_io_executor
+    previous = file_io_executor
+    file_io_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="file-io")
+    previous.shutdown(wait=False)
+
+async def run_file_io(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    ブロッキングするファイル操作をファイルI/O用スレッドプールで実行
+    """
+    return await asyncio.get_running_loop().run_in_executor(file_io_executor, partial(func, *args, **kwargs))
+
+async def iter_file_chunks(path: str, chunk_size: int) -> AsyncIterator[bytes]:
+    """
+    ファイルをスレッドプール上でチャンク単位に読み出す
+    """
+    f = await run_file_io(open, path, 'rb')
+    try:
+        while chunk := await run_file_io(f.read, chunk_size):
+            yield chunk
+    finally:
+        await run_file_io(f.close)
+
+async def read_file_header(path: str, size: int) -> bytes:
+    def read() -> bytes:
+        with open(path, 'rb') as f:
+            return f.read(size)
+    return await run_file_io(read)
+
+def hash_fileobj(fileobj: BinaryIO, chunk_size: int, max_bytes: int) -> tuple:
+    """
+    ファイルオブジェクト全体のSHA-256を計算し（16進ダイジェスト, 読み込んだバイト数）を返す
+    max_bytes を超えた時点で読み込みを打ち切る（呼び出し側でサイズ超過を判定）
+    hashlibは大きなバッファでGILを解放するため、スレッドプールから呼び出す前提
+    """
+    digest = hashlib.sha256()
+    total = 0
+    while chunk := fileobj.read(chunk_size):
+        total += len(chunk)
+        if total > max_bytes:
+            break
+        digest.update(chunk)
+    return digest.hexdigest(), total
+
+def hash_file(path: str, chunk_size: int, max_bytes: int) -> tuple:
+    with open(path, 'rb') as f:
+        return hash_fileobj(f, chunk_size, max_bytes)
+
+async def spool_chunks_to_tempfile(chunks: AsyncIterator[bytes], suffix: str = "") -> str:
+    """
+    非同期チャンク列を一時ファイルへ書き出してパスを返す（作成・書き込み・削除はスレッドプールで実行）
+    """
+    temp_file = await run_file_io(tempfile.NamedTemporaryFile, delete=False, suffix=suffix)
+    try:
+        async for chunk in chunks:
+            await run_file_io(temp_file.write, chunk)
+        await run_file_io(temp_file.close)
+    except BaseException:
+        await run_file_io(temp_file.close)
+        await remove_file(temp_file.name)
+        raise
+    return temp_file.name
+
+def spooled_file_path(fileobj: Any) -> Optional[str]:
+    """
+    アップロードのファイルオブジェクト（UploadFile.file）を別プロセスから読めるパス（名前付きのファイルでなければNone）
+    SpooledTemporaryFile はメモリ上にある間は name がNone、POSIXでディスクへ書き出した後も名前のない一時ファイル（name はファイル記述子）のため、
+    その場合は呼び出し側で NamedTemporaryFile へコピーする
+    """
+    name = getattr(fileobj, "name", None)
+    if not isinstance(name, str):
+        return None
+    fileobj.flush()
+    return name
+
+async def create_temp_path(suffix: str = "") -> str:
+    """
+    空の一時ファイルを作成してパスを返す（別プロセスの出力先として使用）
+    """
+    def create() -> str:
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        return path
+    return await run_file_io(create)
+
+async def remove_file(path: Optional[str]) -> None:
+    """
+    ファイルを削除（存在しない場合は何もしない）
+    """
+    if path is None:
+        return
+    try:
+        await run_file_io(os.unlink, path)
+    except FileNotFoundError:
+        pass
+
+async def remove_tree(path: str) -> None:
+    await run_file_io(shutil.rmtree, path, ignore_errors=True)
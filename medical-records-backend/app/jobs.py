@@ -0,0 +1,299 @@
+import asyncio
+import json
+import sqlite3
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+class QueueFullError(Exception):
+    """
+    ジョブキューが満杯の場合の例外
+    """
+
+class JobStore:
+    """
+    ジョブの状態と実行待ちキューを保持するストアのインターフェース
+    """
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def create(self, job: Dict[str, Any], payload: Any, maxsize: int) -> None:
+        """
+        ジョブを実行待ちとして登録（同じ種別の実行待ちがmaxsize件以上ならQueueFullError）
+        """
+        raise NotImplementedError
+
+    async def claim(self, kind: str) -> Optional[tuple]:
+        """
+        最も古い実行待ちジョブを実行中にして（ジョブID, ペイロード）を返す（なければNone）
+        """
+        raise NotImplementedError
+
+    async def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def count_queued(self, kind: str) -> int:
+        raise NotImplementedError
+
+    async def purge_expired(self, ttl: float) -> None:
+        raise NotImplementedError
+
+class MemoryJobStore(JobStore):
+    """
+    プロセス内のdictとdequeで保持するジョブストア（単一ワーカー構成向け）
+    """
+
+    def __init__(self):
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._payloads: Dict[str, Any] = {}
+        self._queued: Dict[str, deque] = {}
+
+    async def create(self, job: Dict[str, Any], payload: Any, maxsize: int) -> None:
+        queued = self._queued.setdefault(job["kind"], deque())
+        if len(queued) >= maxsize:
+            raise QueueFullError()
+        self.jobs[job["job_id"]] = job
+        self._payloads[job["job_id"]] = payload
+        queued.append(job["job_id"])
+
+    async def claim(self, kind: str) -> Optional[tuple]:
+        queued = self._queued.get(kind)
+        if not queued:
+            return None
+        job_id = queued.popleft()
+        job = self.jobs[job_id]
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        return job_id, self._payloads.pop(job_id)
+
+    async def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        job.update(status=status, result=result, error=error, finished_at=time.time())
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.jobs.get(job_id)
+
+    async def count_queued(self, kind: str) -> int:
+        return len(self._queued.get(kind, ()))
+
+    async def purge_expired(self, ttl: float) -> None:
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job["finished_at"] is not None and now - job["finished_at"] > ttl
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+class SQLiteJobStore(JobStore):
+    """
+    複数のワーカープロセスで共有するSQLite（WALモード）のジョブストア
+    実行待ちジョブは BEGIN IMMEDIATE 内で取得・更新し、同じジョブを複数のプロセスが実行しないようにする
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def start(self) -> None:
+        if self._executor is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs-db")
+        await self._run(self._open)
+
+    async def close(self) -> None:
+        if self._executor is None:
+            return
+        await self._run(self._conn.close)
+        self._executor.shutdown()
+        self._executor = None
+
+    async def create(self, job: Dict[str, Any], payload: Any, maxsize: int) -> None:
+        await self._run(self._create, job, json.dumps(payload, ensure_ascii=False), maxsize)
+
+    async def claim(self, kind: str) -> Optional[tuple]:
+        return await self._run(self._claim, kind)
+
+    async def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        await self._run(
+            self._conn.execute,
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE job_id = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(), job_id)
+        )
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._run(self._get, job_id)
+
+    async def count_queued(self, kind: str) -> int:
+        return await self._run(self._count_queued, kind)
+
+    async def purge_expired(self, ttl: float) -> None:
+        await self._run(self._conn.execute, "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (time.time() - ttl,))
+
+    async def _run(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _open(self) -> None:
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, payload TEXT, result TEXT, error TEXT, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_kind_status ON jobs (kind, status, created_at)")
+
+    def _create(self, job: Dict[str, Any], payload: str, maxsize: int) -> None:
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self._count_queued(job["kind"]) >= maxsize:
+                raise QueueFullError()
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, kind, status, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job["job_id"], job["kind"], job["status"], payload, job["created_at"])
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _claim(self, kind: str) -> Optional[tuple]:
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT job_id, payload FROM jobs WHERE kind = ? AND status = 'queued' ORDER BY created_at LIMIT 1",
+                (kind,)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, payload = NULL WHERE job_id = ?",
+                    (time.time(), row["job_id"])
+                )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return (row["job_id"], json.loads(row["payload"])) if row is not None else None
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT job_id, kind, status, created_at, started_at, finished_at, result, error FROM jobs WHERE job_id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def _count_queued(self, kind: str) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE kind = ? AND status = 'queued'", (kind,)).fetchone()[0]
+
+class JobQueue:
+    """
+    上限付きキューと固定数ワーカーで非同期ジョブを実行するジョブキュー
+    ジョブの状態はJobStoreに保持し、共有ストアを使えば別プロセスで登録されたジョブも実行・参照できる
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[Any]],
+        concurrency: int = 4,
+        maxsize: int = 100,
+        result_ttl: float = 3600.0,
+        kind: str = "job",
+        store: Optional[JobStore] = None,
+        poll_interval: float = 0.5
+    ):
+        self.handler = handler
+        self.kind = kind
+        self.concurrency = concurrency
+        self.maxsize = maxsize
+        self.result_ttl = result_ttl
+        self.store = store or MemoryJobStore()
+        self.poll_interval = poll_interval
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: list = []
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def is_full(self) -> bool:
+        return await self.store.count_queued(self.kind) >= self.maxsize
+
+    async def submit(self, payload: Any) -> str:
+        """
+        ジョブを登録してジョブIDを返す（満杯ならQueueFullError）
+        """
+        if self._wakeup is None:
+            raise RuntimeError("JobQueue is not started")
+        await self.store.purge_expired(self.result_ttl)
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "kind": self.kind,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        await self.store.create(job, payload, self.maxsize)
+        self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await self.store.get(job_id)
+        if job is None or job["kind"] != self.kind:
+            return None
+        if job["finished_at"] is not None and time.time() - job["finished_at"] > self.result_ttl:
+            return None
+        return job
+
+    async def queue_depth(self) -> int:
+        return await self.store.count_queued(self.kind)
+
+    async def _worker(self) -> None:
+        while True:
+            claimed = await self.store.claim(self.kind)
+            if claimed is None:
+                # 他プロセスで登録されたジョブはポーリングで拾う
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            job_id, payload = claimed
+            try:
+                result = await self.handler(payload)
+            except asyncio.CancelledError:
+                await asyncio.shield(self.store.finish(job_id, "failed", error="cancelled"))
+                raise
+            except Exception as e:
+                await self.store.finish(job_id, "failed", error=str(e))
+            else:
+                await self.store.finish(job_id, "succeeded", result=result)
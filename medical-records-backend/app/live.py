@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+from typing import AsyncIterator, Optional
+
+from .fileio import remove_file, run_file_io
+
+class SpoolFullError(Exception):
+    """
+    録音の合計サイズが上限を超えた場合の例外
+    """
+
+class LiveAudioSpool:
+    """
+    録音中に受信した音声チャンクを書き溜める
+    memory_bytes まではメモリに保持し、超えた時点で一時ファイルへ移す（合計 max_bytes まで）
+    SHA-256は受信と同時に計算するため、録音終了後に音声全体を読み直す必要がない
+    """
+
+    def __init__(self, max_bytes: int, memory_bytes: int, suffix: str = ""):
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.suffix = suffix
+        self.size = 0
+        self.path: Optional[str] = None
+        self._buffer: Optional[io.BytesIO] = io.BytesIO()
+        self._file = None
+        self._digest = hashlib.sha256()
+
+    async def append(self, chunk: bytes) -> None:
+        """
+        チャンクを追記（書き込み・ハッシュ計算はファイルI/O用スレッドプールで実行）
+        """
+        if self.size + len(chunk) > self.max_bytes:
+            raise SpoolFullError()
+        self.size += len(chunk)
+        await run_file_io(self._write, chunk)
+
+    def _write(self, chunk: bytes) -> None:
+        self._digest.update(chunk)
+        if self._file is None and self._buffer.tell() + len(chunk) > self.memory_bytes:
+            self._rollover()
+        (self._file or self._buffer).write(chunk)
+
+    def _rollover(self) -> None:
+        self._file = tempfile.NamedTemporaryFile(delete=False, suffix=self.suffix)
+        self.path = self._file.name
+        self._file.write(self._buffer.getbuffer())
+        self._buffer = None
+
+    async def finish(self) -> None:
+        """
+        書き込みを終了（一時ファイルへ移していた場合は閉じて path から読めるようにする）
+        """
+        if self._file is not None:
+            await run_file_io(self._file.close)
+        elif self._buffer is not None:
+            self._buffer.seek(0)
+
+    @property
+    def in_memory(self) -> bool:
+        return self.path is None
+
+    @property
+    def buffer(self) -> io.BytesIO:
+        return self._buffer
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+    async def discard(self) -> None:
+        """
+        一時ファイルを削除してメモリ上のバッファを解放
+        """
+        if self._file is not None:
+            await run_file_io(self._file.close)
+        await remove_file(self.path)
+        self._buffer = None
+
+class LiveChunkStream:
+    """
+    録音中のチャンクをDifyへの先行アップロードに渡す上限付きキュー
+    アップロードが追いつかない場合は feed が待つため、保持するチャンク数は maxsize までに抑えられる
+    """
+
+    def __init__(self, maxsize: int):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.abandoned = False
+
+    async def feed(self, chunk: bytes) -> None:
+        if not self.abandoned:
+            await self._queue.put(chunk)
+
+    async def close(self) -> None:
+        """
+        録音終了を通知（アップロード本文の末尾になる）
+        """
+        if not self.abandoned:
+            await self._queue.put(None)
+
+    def abandon(self) -> None:
+        """
+        アップロードが失敗・中断した場合に呼ぶ。以降のチャンクは捨て、待機中の feed を解放する
+        """
+        self.abandoned = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while (chunk := await self._queue.get()) is not None:
+            yield chunk
+
+def live_audio_suffix(filename: str) -> str:
+    return os.path.splitext(filename)[1].lower() or ".webm"
@@ -0,0 +1,54 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from .metrics import EVENT_LOOP_BLOCKED_TOTAL, EVENT_LOOP_LAG
+
+class EventLoopLagMonitor:
+    """
+    一定間隔でスリープし、予定より遅れて再開した時間をイベントループの遅延（ブロッキング時間）として記録
+    threshold秒を超えた遅延はログに出力し、ブロッキング回数として集計する
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.1):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.blocked_count = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def record(self, lag: float) -> None:
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        EVENT_LOOP_LAG.observe(lag)
+        if lag > self.threshold:
+            self.blocked_count += 1
+            EVENT_LOOP_BLOCKED_TOTAL.inc()
+            print(f"Event loop blocked for {lag * 1000:.0f}ms (threshold {self.threshold * 1000:.0f}ms)")
+
+    async def _run(self) -> None:
+        while True:
+            scheduled = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, time.perf_counter() - scheduled))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "last_lag_ms": round(self.last_lag * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "blocked_count": self.blocked_count,
+        }
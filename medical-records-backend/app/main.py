@@ -1,18 +1,406 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.datastructures import Headers
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from pydantic import BaseModel
-import httpx
 import json
 import os
-from typing import Dict, Any, Optional
-from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Any, Optional, Union, AsyncIterator
+from datetime import datetime, date, timedelta
+from contextlib import asynccontextmanager
+import importlib.util
+import asyncio
+import orjson
 import tempfile
 import time
-from dotenv import load_dotenv
+import uuid
+from .jobs import JobQueue, JobStore, MemoryJobStore, QueueFullError, SQLiteJobStore
+from .dify_stream import iter_sse_events, StructuredOutputTracker, format_sse
+from .cache import AudioResultCache, MemoryCacheBackend, RedisCacheBackend, SQLiteCacheBackend
+from .storage import RecordStore, SQLiteRecordStore
+from .sheets import SheetsExporter, SheetsWriter, GoogleSheetsWriter
+from .export import EXPORT_MEDIA_TYPES, EXPORT_STREAMERS, iter_export_batches
+from .metrics import (
+    ADMISSION_DECISIONS_TOTAL, ADMISSION_IN_FLIGHT, ADMISSION_QUEUED, DifyAPIError, FALLBACK_TOTAL,
+    HTTP_REQUEST_DURATION, JOB_QUEUE_DEPTH, LIVE_SESSIONS,
+    mark_worker_dead, observe_stage, observe_since, record_dify_error, render_metrics
+)
+from .resilience import CircuitBreaker, RetryBudget, call_with_resilience, hedged
+from .wav import FORMAT_EXTENSIONS, is_wav_header, wav_byte_rate, wav_duration
+from .merge import merge_medical_records
+from .fileio import (
+    configure_file_io, create_temp_path, hash_file, hash_fileobj, iter_file_chunks, read_file_header,
+    remove_file, remove_tree, run_file_io, spool_chunks_to_tempfile, spooled_file_path
+)
+from .live import LiveAudioSpool, LiveChunkStream, SpoolFullError, live_audio_suffix
+from .loop_monitor import EventLoopLagMonitor
+from .prompts import PromptTemplate, load_prompt_template
+from .record_output import RecordOutputConverter, record_fields_for
+from .admission import (
+    REJECTION_RESPONSES, AdmissionController, AdmissionMiddleware, AdmissionRejected, BodySizeLimitMiddleware, client_key,
+    retry_after_seconds
+)
+from .settings import DifySettings
+from .config import getenv
+
+# httpx・プロセスプール・numpy（app.audio）は初回利用時に読み込み、起動（import）を軽くする
+if TYPE_CHECKING:
+    import httpx
+    from concurrent.futures import ProcessPoolExecutor
+
+# 設定は環境変数を優先し、なければ .env ファイルから読み込む（.env は最初の設定読み込み時に1度だけ読む）
+# Dify関連の設定（DIFY_*）は起動時に DifySettings として1度だけ読み込んで検証する（get_dify_settings）
+
+# 音声アップロード設定（チャンク単位でDifyへ転送し、全体をメモリに載せない）
+AUDIO_UPLOAD_CHUNK_SIZE = int(getenv("AUDIO_UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_AUDIO_UPLOAD_BYTES = int(getenv("MAX_AUDIO_UPLOAD_BYTES", str(512 * 1024 * 1024)))
+
+# 非同期ジョブ設定（mode=job で /api/process-audio を即時返却）
+JOB_WORKER_CONCURRENCY = int(getenv("JOB_WORKER_CONCURRENCY", "4"))
+JOB_QUEUE_MAXSIZE = int(getenv("JOB_QUEUE_MAXSIZE", "100"))
+JOB_RESULT_TTL = float(getenv("JOB_RESULT_TTL", "3600"))
+# 複数ワーカー（uvicorn --workers N）で動かす場合は sqlite を指定してジョブをプロセス間で共有
+JOB_STORE_BACKEND = getenv("JOB_STORE_BACKEND", "memory")
+JOB_STORE_PATH = getenv("JOB_STORE_PATH", "jobs.sqlite3")
+JOB_POLL_INTERVAL = float(getenv("JOB_POLL_INTERVAL", "0.5"))
+
+# 一括音声処理設定（閉院時にまとめてアップロードされた録音を並行処理しNDJSONで逐次返す）
+AUDIO_BATCH_MAX_FILES = int(getenv("AUDIO_BATCH_MAX_FILES", "50"))
+AUDIO_BATCH_CONCURRENCY = int(getenv("AUDIO_BATCH_CONCURRENCY", "4"))
+
+# ライブ録音（WebSocket）の受信設定（メモリ上限を超えた分は一時ファイルへ、先行アップロード待ちのチャンク数は上限付き）
+LIVE_AUDIO_MEMORY_BYTES = int(getenv("LIVE_AUDIO_MEMORY_BYTES", str(8 * 1024 * 1024)))
+LIVE_AUDIO_UPLOAD_QUEUE_CHUNKS = int(getenv("LIVE_AUDIO_UPLOAD_QUEUE_CHUNKS", "32"))
+LIVE_AUDIO_EARLY_UPLOAD_ENABLED = getenv("LIVE_AUDIO_EARLY_UPLOAD_ENABLED", "true").lower() in ("1", "true", "yes")
+LIVE_AUDIO_IDLE_TIMEOUT = float(getenv("LIVE_AUDIO_IDLE_TIMEOUT", "60"))
+# 分割処理の対象かを判定するために保持するWAVヘッダーの長さ
+LIVE_WAV_HEADER_BYTES = 4096
+
+# 音声ハッシュ単位のキャッシュ設定（DifyのfileIDと変換済み医療記録）
+AUDIO_CACHE_ENABLED = getenv("AUDIO_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+AUDIO_CACHE_BACKEND = getenv("AUDIO_CACHE_BACKEND", "memory")
+AUDIO_CACHE_PATH = getenv("AUDIO_CACHE_PATH", "audio_cache.sqlite3")
+AUDIO_CACHE_REDIS_URL = getenv("AUDIO_CACHE_REDIS_URL", "redis://localhost:6379/0")
+AUDIO_CACHE_MAX_ENTRIES = int(getenv("AUDIO_CACHE_MAX_ENTRIES", "1000"))
+AUDIO_CACHE_FILE_TTL = float(getenv("AUDIO_CACHE_FILE_TTL", "3600"))
+AUDIO_CACHE_RESULT_TTL = float(getenv("AUDIO_CACHE_RESULT_TTL", "86400"))
+
+# 医療記録の永続化設定（SQLite WALモード・まとめてコミット）
+RECORD_STORE_BACKEND = getenv("RECORD_STORE_BACKEND", "sqlite")
+MEDICAL_RECORDS_DB_PATH = getenv("MEDICAL_RECORDS_DB_PATH", "medical_records.sqlite3")
+RECORD_STORE_BATCH_SIZE = int(getenv("RECORD_STORE_BATCH_SIZE", "200"))
+RECORDS_PAGE_MAX_LIMIT = int(getenv("RECORDS_PAGE_MAX_LIMIT", "500"))
+RECORDS_EXPORT_BATCH_SIZE = int(getenv("RECORDS_EXPORT_BATCH_SIZE", "1000"))
+
+# Google Sheetsエクスポート設定
+GOOGLE_SHEETS_SPREADSHEET_ID = getenv("GOOGLE_SHEETS_SPREADSHEET_ID")
+GOOGLE_SHEETS_SHEET_NAME = getenv("GOOGLE_SHEETS_SHEET_NAME", "医療記録")
+# 認証ファイルは GOOGLE_SHEETS_CREDENTIALS_FILE（別名 GOOGLE_SHEETS_CREDENTIALS_PATH）、なければ GOOGLE_APPLICATION_CREDENTIALS
+GOOGLE_SHEETS_CREDENTIALS_FILE = (
+    getenv("GOOGLE_SHEETS_CREDENTIALS_FILE") or getenv("GOOGLE_SHEETS_CREDENTIALS_PATH") or getenv("GOOGLE_APPLICATION_CREDENTIALS")
+)
+GOOGLE_SHEETS_CHUNK_SIZE = int(getenv("GOOGLE_SHEETS_CHUNK_SIZE", "500"))
+GOOGLE_SHEETS_MAX_RETRIES = int(getenv("GOOGLE_SHEETS_MAX_RETRIES", "5"))
+SHEETS_EXPORT_SYNC_LIMIT = int(getenv("SHEETS_EXPORT_SYNC_LIMIT", "1000"))
+SHEETS_EXPORT_STATE_KEY = "sheets_export_last_id"
+
+# 音声前処理設定（アップロード前にWAVをモノラル・16kHz化し前後の無音を除去）
+AUDIO_PREPROCESS_ENABLED = getenv("AUDIO_PREPROCESS_ENABLED", "true").lower() in ("1", "true", "yes")
+AUDIO_PREPROCESS_FORMAT = getenv("AUDIO_PREPROCESS_FORMAT", "wav")
+AUDIO_PREPROCESS_TRIM_SILENCE = getenv("AUDIO_PREPROCESS_TRIM_SILENCE", "true").lower() in ("1", "true", "yes")
+AUDIO_PREPROCESS_SILENCE_DB = float(getenv("AUDIO_PREPROCESS_SILENCE_DB", "-45"))
+AUDIO_PREPROCESS_WORKERS = int(getenv("AUDIO_PREPROCESS_WORKERS", "2"))
+AUDIO_CONTENT_TYPES = {".wav": "audio/wav", ".flac": "audio/flac", ".ogg": "audio/ogg", ".webm": "audio/webm", ".m4a": "audio/mp4"}
+
+# 長時間録音の分割処理設定（しきい値を超えるWAVは無音位置で分割し区間ごとに並行処理）
+AUDIO_SEGMENT_THRESHOLD_SECONDS = float(getenv("AUDIO_SEGMENT_THRESHOLD_SECONDS", "300"))
+AUDIO_SEGMENT_TARGET_SECONDS = float(getenv("AUDIO_SEGMENT_TARGET_SECONDS", "120"))
+AUDIO_SEGMENT_CONCURRENCY = int(getenv("AUDIO_SEGMENT_CONCURRENCY", "4"))
+
+# プロンプトテンプレート設定（静的な指示・専門用語はバージョン毎のファイルから起動時に1回だけ読み込む）
+PROMPT_TEMPLATE_DIR = getenv("PROMPT_TEMPLATE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompts"))
+PROMPT_TEMPLATE_VERSION = getenv("PROMPT_TEMPLATE_VERSION", "v1")
+
+# 音声処理エンドポイントの受け付け制御（同時処理数・待ち行列・クライアント毎の流量制限、0で各制限を無効化）
+# クライアントは ADMISSION_CLIENT_HEADERS の最初に値があるヘッダー（なければ接続元IP）で識別する
+# ADMISSION_CLIENT_RATES でクライアント毎の上限（件/分）を個別に指定可能（例: "x-clinic-id:iida=60,x-api-key:abc=10"）
+ADMISSION_MAX_CONCURRENCY = int(getenv("ADMISSION_MAX_CONCURRENCY", "8"))
+ADMISSION_QUEUE_SIZE = int(getenv("ADMISSION_QUEUE_SIZE", "32"))
+ADMISSION_QUEUE_TIMEOUT = float(getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+ADMISSION_RATE_PER_MINUTE = float(getenv("ADMISSION_RATE_PER_MINUTE", "0"))
+ADMISSION_BURST = int(getenv("ADMISSION_BURST", "10"))
+ADMISSION_CLIENT_HEADERS = [h.strip() for h in getenv("ADMISSION_CLIENT_HEADERS", "X-API-Key,X-Clinic-ID").split(",") if h.strip()]
+ADMISSION_CLIENT_RATES = {
+    key.strip(): float(rate) for key, _, rate in
+    (item.rpartition("=") for item in getenv("ADMISSION_CLIENT_RATES", "").split(",") if item.strip())
+}
+ADMISSION_PATHS = ("/api/process-audio", "/api/process-audio/stream", "/api/process-audio/batch")
+# 一括処理は最大 AUDIO_BATCH_CONCURRENCY 件を並行してDifyへ送るため、その数の枠を確保する
+ADMISSION_PATH_COSTS = {"/api/process-audio/batch": AUDIO_BATCH_CONCURRENCY}
+
+# 音声処理エンドポイントのリクエスト本文の上限（音声の上限に患者情報等のフォーム項目の分を加える）
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024
+UPLOAD_BODY_LIMITS = {
+    "/api/process-audio": MAX_AUDIO_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD_BYTES,
+    "/api/process-audio/stream": MAX_AUDIO_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD_BYTES,
+    "/api/process-audio/batch": (MAX_AUDIO_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD_BYTES) * AUDIO_BATCH_MAX_FILES,
+}
+
+# Difyの出力から生成する医療記録の各項目の最大文字数
+RECORD_FIELD_MAX_CHARS = int(getenv("RECORD_FIELD_MAX_CHARS", "4000"))
+
+# 起動設定（lazy はDifyクライアント・プロンプトテンプレートを起動時に作らず初回利用時に作成し、起動を速くする）
+# DIFY_WARMUP を有効にすると起動フックでDifyへの接続を確立してから受け付けを始める（失敗しても起動は続行）
+STARTUP_MODE = getenv("STARTUP_MODE", "eager")
+
+# ブロッキング処理のオフロードとイベントループ遅延の監視（間隔0で監視を無効化）
+FILE_IO_WORKERS = int(getenv("FILE_IO_WORKERS", "8"))
+EVENT_LOOP_MONITOR_INTERVAL = float(getenv("EVENT_LOOP_MONITOR_INTERVAL", "0.1"))
+EVENT_LOOP_LAG_THRESHOLD = float(getenv("EVENT_LOOP_LAG_THRESHOLD", "0.1"))
+
+dify_settings: Optional[DifySettings] = None
+dify_client: Optional["httpx.AsyncClient"] = None
+dify_breaker: Optional[CircuitBreaker] = None
+dify_retry_budget: Optional[RetryBudget] = None
+sheets_writer: Optional[SheetsWriter] = None
+audio_preprocess_pool: Optional["ProcessPoolExecutor"] = None
+prompt_template: Optional[PromptTemplate] = None
+
+class AudioTooLargeError(Exception):
+    """
+    音声ファイルが上限サイズを超えた場合の例外
+    """
+
+configure_file_io(FILE_IO_WORKERS)
+loop_monitor = EventLoopLagMonitor(interval=EVENT_LOOP_MONITOR_INTERVAL, threshold=EVENT_LOOP_LAG_THRESHOLD) if EVENT_LOOP_MONITOR_INTERVAL > 0 else None
+
+record_output_converter = RecordOutputConverter(max_field_chars=RECORD_FIELD_MAX_CHARS)
+admission_controller = AdmissionController(
+    max_concurrency=ADMISSION_MAX_CONCURRENCY, queue_size=ADMISSION_QUEUE_SIZE, queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    rate_per_minute=ADMISSION_RATE_PER_MINUTE, burst=ADMISSION_BURST, client_rates=ADMISSION_CLIENT_RATES
+)
+
+def is_retryable_dify_error(error: Exception) -> bool:
+    """
+    再試行・障害判定の対象となるDifyエラーか（タイムアウト・接続エラー・429・5xx）
+    """
+    import httpx
+
+    if isinstance(error, DifyAPIError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+def is_unsent_workflow_error(error: Exception) -> bool:
+    """
+    ワークフロー実行を再試行してよいエラーか（接続・接続プール待ちのエラー、429・5xx）
+    読み取りタイムアウト等はDify側で実行中の可能性があり、再実行すると二重に実行・課金されるため再試行しない（ブレーカーには障害として数える）
+    """
+    import httpx
+
+    if isinstance(error, DifyAPIError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+def get_dify_settings() -> DifySettings:
+    """
+    Difyの接続設定を取得（初回に環境変数から読み込んで検証し、以降は同じ設定を返す）
+    """
+    global dify_settings
+    if dify_settings is None:
+        dify_settings = DifySettings.from_env()
+    return dify_settings
+
+def get_dify_breaker() -> CircuitBreaker:
+    """
+    Dify呼び出しのサーキットブレーカーを取得（初回に設定から作成）
+    """
+    global dify_breaker
+    if dify_breaker is None:
+        settings = get_dify_settings()
+        dify_breaker = CircuitBreaker(
+            "dify", failure_threshold=settings.breaker_failure_threshold, recovery_timeout=settings.breaker_recovery_timeout
+        )
+    return dify_breaker
+
+def get_dify_retry_budget() -> RetryBudget:
+    """
+    Dify呼び出しの再試行予算を取得（初回に設定から作成）
+    """
+    global dify_retry_budget
+    if dify_retry_budget is None:
+        settings = get_dify_settings()
+        dify_retry_budget = RetryBudget(ratio=settings.retry_budget_ratio, min_per_second=settings.retry_budget_min_per_second)
+    return dify_retry_budget
+
+def create_dify_client() -> "httpx.AsyncClient":
+    """
+    接続プール・Keep-Alive・HTTP/2・フェーズ別タイムアウトを設定したDify用クライアントを作成
+    """
+    import httpx
+
+    settings = get_dify_settings()
+    limits = httpx.Limits(
+        max_connections=settings.max_connections,
+        max_keepalive_connections=settings.max_keepalive_connections,
+        keepalive_expiry=settings.keepalive_expiry
+    )
+    timeout = httpx.Timeout(
+        connect=settings.connect_timeout,
+        read=settings.read_timeout,
+        write=settings.write_timeout,
+        pool=settings.pool_timeout
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=settings.http2)
+
+def get_dify_client() -> "httpx.AsyncClient":
+    """
+    共有Difyクライアントを取得（起動フック外から呼ばれた場合はここで作成）
+    """
+    global dify_client
+    if dify_client is None or dify_client.is_closed:
+        dify_client = create_dify_client()
+    return dify_client
+
+async def warm_up_dify_connection(settings: DifySettings) -> None:
+    """
+    Difyへの接続（TLS・HTTP/2のハンドシェイク）を確立し、接続プールに残しておく
+    応答の内容・ステータスは問わず、失敗しても起動は続行する
+    """
+    start = time.perf_counter()
+    try:
+        response = await get_dify_client().get(
+            f"{settings.api_url}/parameters",
+            headers={"Authorization": f"Bearer {settings.api_key}"},
+            timeout=settings.warmup_timeout
+        )
+        print(f"Dify connection warmed up in {time.perf_counter() - start:.2f}s (status {response.status_code})")
+    except Exception as e:
+        print(f"Dify connection warm-up failed ({str(e)}), continuing startup")
+
+def get_prompt_template() -> PromptTemplate:
+    """
+    プロンプトテンプレートを取得（起動フック外から呼ばれた場合はここで読み込む）
+    """
+    global prompt_template
+    if prompt_template is None:
+        prompt_template = load_prompt_template(PROMPT_TEMPLATE_DIR, PROMPT_TEMPLATE_VERSION)
+    return prompt_template
+
+def create_audio_cache() -> Optional[AudioResultCache]:
+    """
+    設定に応じたバックエンドで音声キャッシュを作成（無効時はNone）
+    """
+    if not AUDIO_CACHE_ENABLED:
+        return None
+    if AUDIO_CACHE_BACKEND == "sqlite":
+        backend = SQLiteCacheBackend(AUDIO_CACHE_PATH, max_entries=AUDIO_CACHE_MAX_ENTRIES)
+    elif AUDIO_CACHE_BACKEND == "redis":
+        backend = RedisCacheBackend(AUDIO_CACHE_REDIS_URL)
+    elif AUDIO_CACHE_BACKEND == "memory":
+        backend = MemoryCacheBackend(max_entries=AUDIO_CACHE_MAX_ENTRIES)
+    else:
+        raise ValueError(f"unknown AUDIO_CACHE_BACKEND: {AUDIO_CACHE_BACKEND}")
+    return AudioResultCache(backend, file_ttl=AUDIO_CACHE_FILE_TTL, result_ttl=AUDIO_CACHE_RESULT_TTL)
+
+audio_cache = create_audio_cache()
+
+def create_record_store() -> RecordStore:
+    """
+    設定に応じたバックエンドで医療記録ストアを作成
+    """
+    if RECORD_STORE_BACKEND == "sqlite":
+        return SQLiteRecordStore(MEDICAL_RECORDS_DB_PATH, batch_size=RECORD_STORE_BATCH_SIZE)
+    raise ValueError(f"unknown RECORD_STORE_BACKEND: {RECORD_STORE_BACKEND}")
+
+def create_job_store() -> JobStore:
+    """
+    設定に応じたバックエンドでジョブストアを作成（memory はプロセス内のみ、sqlite はワーカー間で共有）
+    """
+    if JOB_STORE_BACKEND == "sqlite":
+        return SQLiteJobStore(JOB_STORE_PATH)
+    if JOB_STORE_BACKEND == "memory":
+        return MemoryJobStore()
+    raise ValueError(f"unknown JOB_STORE_BACKEND: {JOB_STORE_BACKEND}")
 
-load_dotenv()
+def get_audio_preprocess_pool() -> "ProcessPoolExecutor":
+    """
+    音声前処理用のプロセスプールを取得（初回利用時に作成）
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    global audio_preprocess_pool
+    if audio_preprocess_pool is None:
+        audio_preprocess_pool = ProcessPoolExecutor(
+            max_workers=AUDIO_PREPROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return audio_preprocess_pool
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    起動時に設定を検証して共有クライアント・プロンプトテンプレートを用意し、終了時に接続プール・プロセスプールを閉じる
+    終了時は複数ワーカー構成のメトリクスからこのワーカーの live 系ゲージを外す
+    STARTUP_MODE=lazy ではクライアント・テンプレート・音声処理モジュールを初回利用時まで作らない
+    """
+    settings = get_dify_settings()
+    if STARTUP_MODE != "lazy":
+        get_dify_client()
+        get_prompt_template()
+        importlib.import_module(".audio", __package__)
+    if settings.warmup and settings.configured:
+        await warm_up_dify_connection(settings)
+    if loop_monitor is not None:
+        await loop_monitor.start()
+    await record_store.start()
+    await job_store.start()
+    await audio_job_queue.start()
+    await export_job_queue.start()
+    yield
+    await export_job_queue.stop()
+    await audio_job_queue.stop()
+    await job_store.close()
+    await record_store.close()
+    if loop_monitor is not None:
+        await loop_monitor.stop()
+    global dify_client, audio_preprocess_pool
+    if dify_client is not None:
+        await dify_client.aclose()
+        dify_client = None
+    if audio_preprocess_pool is not None:
+        audio_preprocess_pool.shutdown(cancel_futures=True)
+        audio_preprocess_pool = None
+    # 終了するワーカーの実行中・待機中などのゲージを集計から外す
+    mark_worker_dead()
+
+class TimedJSONResponse(JSONResponse):
+    """
+    orjsonでシリアライズし、その時間を計測するJSONレスポンス
+    大きな応答を返すハンドラはこのクラスを直接返し、jsonable_encoder による変換を省く
+    """
+    def render(self, content: Any) -> bytes:
+        with observe_stage("response_serialization"):
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+app = FastAPI(title="音声自動カルテシステム", description="飯田クリニック向け音声自動カルテAPI", lifespan=lifespan, default_response_class=TimedJSONResponse)
+
+# CORSより内側に置き、429・503の応答にもCORSヘッダーを付ける
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=admission_controller,
+    paths=ADMISSION_PATHS,
+    header_names=ADMISSION_CLIENT_HEADERS,
+    on_decision=lambda outcome: ADMISSION_DECISIONS_TOTAL.labels(outcome=outcome).inc(),
+    costs=ADMISSION_PATH_COSTS
+)
 
-app = FastAPI(title="音声自動カルテシステム", description="飯田クリニック向け音声自動カルテAPI")
+# 受け付け制御より外側に置き、Content-Length で断れる場合は処理枠を確保しない
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits=UPLOAD_BODY_LIMITS,
+    detail=f"音声ファイルが上限サイズ（{MAX_AUDIO_UPLOAD_BYTES}バイト）を超えています"
+)
 
 # Disable CORS. Do not remove this for full-stack development.
 app.add_middleware(
@@ -21,8 +409,28 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["Retry-After"],
 )
 
+@app.middleware("http")
+async def measure_request_duration(request: Request, call_next):
+    """
+    ルート別のリクエスト処理時間を記録（受信開始時刻は各ハンドラで参照できるよう保持）
+    """
+    request.state.received_at = time.perf_counter()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_DURATION.labels(
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=status
+        ).observe(time.perf_counter() - request.state.received_at)
+
 class MedicalRecord(BaseModel):
     patient_id: Optional[str] = None
     consultation_date: str
@@ -34,42 +442,101 @@ class MedicalRecord(BaseModel):
     guidance: str
     next_appointment: Optional[str] = None
     notes: Optional[str] = None
+    prompt_version: Optional[str] = None
 
 class DifyResponse(BaseModel):
     medical_record: MedicalRecord
     confidence_score: float
     processing_time: float
 
-medical_records_db = []
+record_store = create_record_store()
+job_store = create_job_store()
+
+async def run_audio_job(payload: dict) -> Dict[str, Any]:
+    """
+    ジョブワーカーで音声を処理し、一時ファイルを削除
+    """
+    try:
+        return await process_with_dify_agent(payload["audio_path"], payload["patient_data"])
+    finally:
+        await remove_file(payload["audio_path"])
+
+async def run_sheets_export_job(payload: dict) -> Dict[str, Any]:
+    """
+    ジョブワーカーでGoogle Sheetsエクスポートを実行
+    """
+    return await run_sheets_export(payload["record_ids"], payload["incremental"])
+
+audio_job_queue = JobQueue(
+    run_audio_job, concurrency=JOB_WORKER_CONCURRENCY, maxsize=JOB_QUEUE_MAXSIZE, result_ttl=JOB_RESULT_TTL,
+    kind="process-audio", store=job_store, poll_interval=JOB_POLL_INTERVAL
+)
+export_job_queue = JobQueue(
+    run_sheets_export_job, concurrency=1, maxsize=JOB_QUEUE_MAXSIZE, result_ttl=JOB_RESULT_TTL,
+    kind="export-to-sheets", store=job_store, poll_interval=JOB_POLL_INTERVAL
+)
+
+async def find_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    全ジョブキューからジョブを検索
+    """
+    for queue in (audio_job_queue, export_job_queue):
+        job = await queue.get(job_id)
+        if job is not None:
+            return job
+    return None
 
 @app.get("/healthz")
 async def healthz():
-    return {"status": "ok", "service": "音声自動カルテシステム"}
+    return {
+        "status": "ok",
+        "service": "音声自動カルテシステム",
+        "dify_circuit": get_dify_breaker().snapshot(),
+        "dify_retry_budget": get_dify_retry_budget().snapshot(),
+        "admission": admission_controller.snapshot(),
+        "event_loop": loop_monitor.snapshot() if loop_monitor is not None else None
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus形式のメトリクスを出力
+    """
+    for queue in (audio_job_queue, export_job_queue):
+        JOB_QUEUE_DEPTH.labels(kind=queue.kind).set(await queue.queue_depth())
+    ADMISSION_IN_FLIGHT.set(admission_controller.active)
+    ADMISSION_QUEUED.set(admission_controller.queued)
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """
+    音声キャッシュのエントリ数とヒット・ミス数を取得
+    """
+    if audio_cache is None:
+        return {"success": True, "enabled": False}
+    return {"success": True, "enabled": True, **await audio_cache.stats()}
 
 @app.post("/api/process-audio")
 async def process_audio(
+    request: Request,
     audio_file: UploadFile = File(...),
     patient_name: str = Form(None),
     patient_id: str = Form(None),
     patient_age: str = Form(None),
-    patient_gender: str = Form(None)
+    patient_gender: str = Form(None),
+    mode: str = Query("sync")
 ):
     """
     音声ファイルと患者データを受信してDifyエージェントで処理し、医療記録を生成
+    mode=job の場合はジョブIDを即時返却し、結果は /api/jobs/{job_id} で取得
     """
     try:
+        observe_request_receive(request)
         
-        valid_audio_types = ['audio/', 'application/octet-stream']
-        is_wav_file = audio_file.filename and audio_file.filename.lower().endswith('.wav')
-        is_valid_content_type = any(audio_file.content_type.startswith(t) for t in valid_audio_types) if audio_file.content_type else False
-        
-        if not (is_valid_content_type or is_wav_file):
-            raise HTTPException(status_code=400, detail="音声ファイルのみアップロード可能です")
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-            content = await audio_file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        with observe_stage("validation"):
+            validate_audio_upload(audio_file)
         
         patient_data = {
             "name": patient_name,
@@ -78,40 +545,600 @@ async def process_audio(
             "gender": patient_gender
         }
         
-        response = await process_with_dify_agent(temp_file_path, patient_data)
+        if mode == "job":
+            return await submit_audio_job(audio_file, patient_data)
         
-        os.unlink(temp_file_path)
+        response = await process_with_dify_agent(audio_file, patient_data)
         
-        return {
+        return TimedJSONResponse({
             "success": True,
             "medical_record": response["medical_record"],
             "confidence_score": response["confidence_score"],
             "processing_time": response["processing_time"]
-        }
+        })
         
+    except HTTPException:
+        raise
+    except AudioTooLargeError:
+        raise HTTPException(status_code=413, detail=f"音声ファイルが上限サイズ（{MAX_AUDIO_UPLOAD_BYTES}バイト）を超えています")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"音声処理中にエラーが発生しました: {str(e)}")
 
-async def process_with_dify_agent(audio_file_path: str, patient_data: dict = None) -> Dict[str, Any]:
+def validate_audio_upload(audio_file: UploadFile) -> None:
+    """
+    音声ファイルの形式とサイズを検証（不正な場合は400・413）
+    """
+    if not is_audio_content(audio_file.filename, audio_file.content_type):
+        raise HTTPException(status_code=400, detail="音声ファイルのみアップロード可能です")
+    if audio_file.size is not None and audio_file.size > MAX_AUDIO_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"音声ファイルが上限サイズ（{MAX_AUDIO_UPLOAD_BYTES}バイト）を超えています")
+
+def is_audio_content(filename: Optional[str], content_type: Optional[str]) -> bool:
+    """
+    Content-Type が音声（またはoctet-stream）か、ファイル名が .wav か
+    """
+    valid_audio_types = ['audio/', 'application/octet-stream']
+    is_wav_file = bool(filename) and filename.lower().endswith('.wav')
+    is_valid_content_type = any(content_type.startswith(t) for t in valid_audio_types) if content_type else False
+    return is_valid_content_type or is_wav_file
+
+def observe_request_receive(request: Request) -> None:
+    """
+    リクエスト受信（マルチパート本文の受信・パース）からハンドラ開始までの時間を記録
+    """
+    received_at = getattr(request.state, "received_at", None)
+    if received_at is not None:
+        observe_since("request_receive", received_at)
+
+@app.post("/api/process-audio/stream")
+async def process_audio_stream(
+    request: Request,
+    audio_file: UploadFile = File(...),
+    patient_name: str = Form(None),
+    patient_id: str = Form(None),
+    patient_age: str = Form(None),
+    patient_gender: str = Form(None)
+):
     """
-    Difyエージェントで音声を処理して医療記録を生成
+    音声を処理し、ノード進捗と確定した構造化出力をServer-Sent Eventsで逐次返す
     """
+    observe_request_receive(request)
+    
+    with observe_stage("validation"):
+        validate_audio_upload(audio_file)
+    
+    patient_data = {
+        "name": patient_name,
+        "id": patient_id,
+        "age": patient_age,
+        "gender": patient_gender
+    }
+    
     start_time = time.time()
+    settings = get_dify_settings()
+    dify_api_url, dify_api_key, dify_app_id = settings.api_url, settings.api_key, settings.app_id
+    
+    prompt = create_medical_record_prompt(patient_data)
+    cache_prompt = record_cache_key(prompt)
+    audio_hash = None
+    cached_record = None
+    file_id = None
+    upload_error = None
+    if settings.configured:
+        try:
+            if audio_cache is not None:
+                audio_hash = await hash_audio(audio_file)
+                cached_record = await audio_cache.get_record(audio_hash, cache_prompt)
+            if cached_record is None:
+                file_id, _ = await get_or_upload_file_id(audio_file, audio_hash, dify_api_key, dify_api_url)
+        except AudioTooLargeError:
+            raise HTTPException(status_code=413, detail=f"音声ファイルが上限サイズ（{MAX_AUDIO_UPLOAD_BYTES}バイト）を超えています")
+        except Exception as e:
+            record_dify_error(e, "upload")
+            upload_error = str(e)
+    
+    async def event_stream():
+        if cached_record is not None:
+            yield format_sse("result", {
+                "medical_record": cached_record,
+                "confidence_score": 0.85,
+                "processing_time": round(time.time() - start_time, 2)
+            })
+            return
+        
+        if file_id is None:
+            if upload_error:
+                print(f"Dify API error: {upload_error}, falling back to mock response")
+                yield format_sse("error", {"detail": upload_error})
+            FALLBACK_TOTAL.labels(reason="dify_error" if upload_error else "not_configured").inc()
+            fallback = await fallback_mock_response(patient_data)
+            yield format_sse("result", fallback)
+            return
+        
+        tracker = StructuredOutputTracker()
+        try:
+            async for event in stream_workflow_from_dify(prompt, file_id, dify_api_key, dify_api_url, dify_app_id):
+                kind = event.get("event")
+                data = event.get("data") or {}
+                if kind in ("node_started", "node_finished"):
+                    yield format_sse("progress", {
+                        "event": kind,
+                        "node_id": data.get("node_id"),
+                        "node_type": data.get("node_type"),
+                        "title": data.get("title"),
+                        "status": data.get("status", "running")
+                    })
+                for field, value in tracker.feed(event).items():
+                    yield format_sse("partial", {
+                        "field": field,
+                        "value": value,
+                        "medical_record_fields": record_fields_for(field)
+                    })
+                if kind == "workflow_finished" and data.get("status", "succeeded") != "succeeded":
+                    raise Exception(f"Workflow failed: {data.get('error')}")
+            
+            with observe_stage("output_conversion"):
+                if "structured_output" in (tracker.outputs or {}):
+                    medical_record = record_output_converter.convert(tracker.outputs)
+                elif tracker.fields:
+                    medical_record = record_output_converter.convert(tracker.fields)
+                else:
+                    medical_record = record_output_converter.convert(tracker.text or tracker.outputs)
+            medical_record["prompt_version"] = get_prompt_template().version
+            
+            if audio_hash is not None:
+                await audio_cache.set_record(audio_hash, cache_prompt, medical_record)
+            
+            yield format_sse("result", {
+                "medical_record": medical_record,
+                "confidence_score": 0.85,
+                "processing_time": round(time.time() - start_time, 2)
+            })
+        except Exception as e:
+            print(f"Dify API error: {str(e)}, falling back to mock response")
+            record_dify_error(e, "workflow")
+            FALLBACK_TOTAL.labels(reason="dify_error").inc()
+            yield format_sse("error", {"detail": str(e)})
+            fallback = await fallback_mock_response(patient_data)
+            yield format_sse("result", fallback)
     
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def parse_batch_metadata(metadata: Optional[str], count: int) -> list:
+    """
+    一括処理の患者情報（音声ファイルと同じ順のJSON配列）を患者データのリストに変換
+    """
+    if not metadata:
+        return [{"name": None, "id": None, "age": None, "gender": None} for _ in range(count)]
+    try:
+        items = json.loads(metadata)
+    except json.JSONDecodeError:
+        items = None
+    if not isinstance(items, list) or len(items) != count or not all(isinstance(item, dict) for item in items):
+        raise HTTPException(status_code=400, detail=f"metadataは音声ファイルと同じ件数（{count}件）のJSONオブジェクト配列で指定してください")
+
+    def value(item: dict, key: str) -> Optional[str]:
+        return str(item[key]) if item.get(key) is not None else None
+
+    return [{
+        "name": value(item, "patient_name"),
+        "id": value(item, "patient_id"),
+        "age": value(item, "patient_age"),
+        "gender": value(item, "patient_gender")
+    } for item in items]
+
+@app.post("/api/process-audio/batch")
+async def process_audio_batch(
+    request: Request,
+    audio_files: list[UploadFile] = File(...),
+    metadata: str = Form(None),
+    save: bool = Query(True)
+):
+    """
+    複数の音声ファイルを並行処理し、完了した順に結果をNDJSONで逐次返す
+    metadata は音声ファイルと同じ順の患者情報（patient_name, patient_id, patient_age, patient_gender）のJSON配列
+    save=true の場合は全件の処理後に1トランザクションでまとめて保存し、最終行で記録IDを返す
+    """
+    observe_request_receive(request)
+
+    if len(audio_files) > AUDIO_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"一度に処理できる音声ファイルは{AUDIO_BATCH_MAX_FILES}件までです")
+    with observe_stage("validation"):
+        for audio_file in audio_files:
+            validate_audio_upload(audio_file)
+        patients = parse_batch_metadata(metadata, len(audio_files))
+
+    # 応答の送信中はアップロードファイルが閉じられている可能性があるため、先に一時ファイルへ退避
+    audio_paths = []
     try:
-        dify_api_url = os.getenv("DIFY_API_URL", "https://api.dify.ai/v1")
-        dify_api_key = os.getenv("DIFY_API_KEY")
-        dify_app_id = os.getenv("DIFY_APP_ID")
+        for audio_file in audio_files:
+            audio_paths.append(await spool_audio_to_tempfile(audio_file))
+    except BaseException as e:
+        for path in audio_paths:
+            await remove_file(path)
+        if isinstance(e, AudioTooLargeError):
+            raise HTTPException(status_code=413, detail=f"音声ファイルが上限サイズ（{MAX_AUDIO_UPLOAD_BYTES}バイト）を超えています")
+        raise
+    filenames = [audio_file.filename for audio_file in audio_files]
+
+    async def result_stream():
+        semaphore = asyncio.Semaphore(AUDIO_BATCH_CONCURRENCY)
+
+        async def process_item(index: int) -> dict:
+            async with semaphore:
+                try:
+                    result = await process_with_dify_agent(audio_paths[index], patients[index])
+                    item = {
+                        "status": "succeeded",
+                        "medical_record": MedicalRecord.model_validate(result["medical_record"]).model_dump(),
+                        "confidence_score": result["confidence_score"],
+                        "processing_time": result["processing_time"]
+                    }
+                except Exception as e:
+                    item = {"status": "failed", "error": str(e)}
+                finally:
+                    await remove_file(audio_paths[index])
+            return {"type": "item", "index": index, "filename": filenames[index], **item}
+
+        tasks = [asyncio.create_task(process_item(index)) for index in range(len(audio_paths))]
+        records = {}
+        try:
+            for completed in asyncio.as_completed(tasks):
+                item = await completed
+                if item["status"] == "succeeded":
+                    records[item["index"]] = item["medical_record"]
+                yield orjson.dumps(item) + b"\n"
+
+            summary = {
+                "type": "summary",
+                "total": len(tasks),
+                "succeeded": len(records),
+                "failed": len(tasks) - len(records),
+                "record_ids": [None] * len(tasks)
+            }
+            if save and records:
+                indexes = sorted(records)
+                created_at = datetime.now().isoformat()
+                try:
+                    saved = await record_store.save_many([{**records[index], "created_at": created_at} for index in indexes])
+                    for index, row in zip(indexes, saved):
+                        summary["record_ids"][index] = row["id"]
+                except Exception as e:
+                    summary["save_error"] = f"記録保存中にエラーが発生しました: {str(e)}"
+            yield orjson.dumps(summary) + b"\n"
+        finally:
+            # クライアント切断時は未完了の処理を中止し、残った一時ファイルを削除
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for path in audio_paths:
+                await remove_file(path)
+
+    return StreamingResponse(
+        result_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/api/process-audio/live")
+async def process_audio_live(websocket: WebSocket):
+    """
+    録音中の音声チャンクをWebSocketで受信し、録音終了後すぐに医療記録を生成
+    1. {"type": "start", "patient_name", "patient_id", "patient_age", "patient_gender", "filename", "content_type", "early_upload"} を送信
+    2. 音声チャンクをバイナリメッセージで送信（受信毎に {"type": "ack", "bytes": 累計バイト数} を返す）
+    3. {"type": "stop"} で録音終了を通知すると {"type": "result", ...} を返して切断
+    early_upload が真の場合は受信と並行して元の音声をDifyへアップロードする（録音全体が必要な前処理は行わない）
+    """
+    await websocket.accept()
+    LIVE_SESSIONS.inc()
+    spool: Optional[LiveAudioSpool] = None
+    stream: Optional[LiveChunkStream] = None
+    upload_task: Optional[asyncio.Task] = None
+    try:
+        start = parse_live_control(await receive_live_message(websocket))
+        if start is None or start.get("type") != "start":
+            await close_live_session(websocket, 1008, "最初に start メッセージを送信してください")
+            return
+        
+        filename = os.path.basename(str(start.get("filename") or "recording.webm"))
+        content_type = str(start.get("content_type") or "audio/webm")
+        if not is_audio_content(filename, content_type):
+            await close_live_session(websocket, 1008, "音声ファイルのみアップロード可能です")
+            return
+        
+        patient_data = {key: start.get(f"patient_{key}") for key in ("name", "id", "age", "gender")}
+        spool = LiveAudioSpool(MAX_AUDIO_UPLOAD_BYTES, LIVE_AUDIO_MEMORY_BYTES, suffix=live_audio_suffix(filename))
+        
+        settings = get_dify_settings()
+        dify_api_url, dify_api_key = settings.api_url, settings.api_key
+        dify_configured = settings.configured
+        if dify_configured and LIVE_AUDIO_EARLY_UPLOAD_ENABLED and start.get("early_upload"):
+            stream = LiveChunkStream(LIVE_AUDIO_UPLOAD_QUEUE_CHUNKS)
+            upload_task = asyncio.create_task(upload_live_stream_to_dify(stream, filename, content_type, dify_api_key, dify_api_url))
+        elif dify_configured and AUDIO_PREPROCESS_ENABLED:
+            # 録音終了後の前処理がワーカープロセスの起動を待たないよう、録音中に起動しておく
+            from .audio import warm_up_worker
+            asyncio.get_running_loop().run_in_executor(get_audio_preprocess_pool(), warm_up_worker)
         
-        if not dify_api_key or not dify_app_id:
+        await websocket.send_json({"type": "ready", "early_upload": upload_task is not None, "max_bytes": MAX_AUDIO_UPLOAD_BYTES})
+        
+        header = b""
+        while True:
+            message = await receive_live_message(websocket)
+            chunk = message.get("bytes")
+            if chunk is not None:
+                await spool.append(chunk)
+                if stream is not None:
+                    header += chunk[:LIVE_WAV_HEADER_BYTES - len(header)]
+                    if exceeds_segment_threshold(header, spool.size):
+                        # 分割処理の対象になる長さのWAVは区間ごとにアップロードするため、録音全体の先行アップロードは中止する
+                        upload_task.cancel()
+                        await asyncio.gather(upload_task, return_exceptions=True)
+                        stream = upload_task = None
+                    else:
+                        await stream.feed(chunk)
+                await websocket.send_json({"type": "ack", "bytes": spool.size})
+                continue
+            control = parse_live_control(message)
+            if control is not None and control.get("type") == "stop":
+                break
+            await websocket.send_json({"type": "error", "detail": "不明なメッセージです"})
+        
+        if spool.size == 0:
+            await close_live_session(websocket, 1008, "音声データを受信していません")
+            return
+        await spool.finish()
+        
+        file_id = None
+        if upload_task is not None:
+            await stream.close()
+            try:
+                with observe_stage("live_upload_wait"):
+                    file_id = await upload_task
+            except Exception as e:
+                print(f"Early upload failed: {str(e)}, uploading after recording")
+                record_dify_error(e, "upload")
+        
+        if spool.in_memory:
+            audio = UploadFile(spool.buffer, size=spool.size, filename=filename, headers=Headers({"content-type": content_type}))
+        else:
+            audio = spool.path
+        # 録音終了後の処理はHTTPの音声処理エンドポイントと同じ処理枠を使う（混雑時は再試行までの目安を付けて断る）
+        try:
+            admitted_at = await admission_controller.acquire(client_key(websocket.headers, websocket.client, ADMISSION_CLIENT_HEADERS))
+        except AdmissionRejected as e:
+            ADMISSION_DECISIONS_TOTAL.labels(outcome=e.reason).inc()
+            await close_live_session(websocket, 1013, REJECTION_RESPONSES[e.reason][1], retry_after=retry_after_seconds(e))
+            return
+        ADMISSION_DECISIONS_TOTAL.labels(outcome="admitted").inc()
+        try:
+            response = await process_with_dify_agent(audio, patient_data, known_hash=spool.hexdigest(), uploaded_file_id=file_id)
+        finally:
+            admission_controller.release(admitted_at)
+        
+        await websocket.send_json({
+            "type": "result",
+            "success": True,
+            "medical_record": response["medical_record"],
+            "confidence_score": response["confidence_score"],
+            "processing_time": response["processing_time"],
+            "recording_bytes": spool.size,
+            "early_upload": file_id is not None
+        })
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except asyncio.TimeoutError:
+        await close_live_session(websocket, 1008, f"{LIVE_AUDIO_IDLE_TIMEOUT:g}秒間メッセージを受信しなかったため切断しました")
+    except SpoolFullError:
+        await close_live_session(websocket, 1009, f"音声ファイルが上限サイズ（{MAX_AUDIO_UPLOAD_BYTES}バイト）を超えています")
+    except Exception as e:
+        await close_live_session(websocket, 1011, f"音声処理中にエラーが発生しました: {str(e)}")
+    finally:
+        LIVE_SESSIONS.dec()
+        if upload_task is not None:
+            upload_task.cancel()
+            await asyncio.gather(upload_task, return_exceptions=True)
+        if spool is not None:
+            await spool.discard()
+
+def exceeds_segment_threshold(header: bytes, size: int) -> bool:
+    """
+    受信中のWAV録音が分割処理の対象となる長さ（AUDIO_SEGMENT_THRESHOLD_SECONDS）を超えたか（WAV以外は常にFalse）
+    """
+    byte_rate = wav_byte_rate(header)
+    return AUDIO_SEGMENT_THRESHOLD_SECONDS > 0 and byte_rate > 0 and size > AUDIO_SEGMENT_THRESHOLD_SECONDS * byte_rate
+
+async def receive_live_message(websocket: WebSocket) -> dict:
+    """
+    次のメッセージを受信（LIVE_AUDIO_IDLE_TIMEOUT秒受信がなければTimeoutError、切断時はWebSocketDisconnect）
+    """
+    message = await asyncio.wait_for(websocket.receive(), LIVE_AUDIO_IDLE_TIMEOUT)
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    return message
+
+def parse_live_control(message: dict) -> Optional[dict]:
+    """
+    テキストメッセージをJSONの制御メッセージとして解釈（解釈できない場合はNone）
+    """
+    if message.get("text") is None:
+        return None
+    try:
+        control = orjson.loads(message["text"])
+    except orjson.JSONDecodeError:
+        return None
+    return control if isinstance(control, dict) else None
+
+async def close_live_session(websocket: WebSocket, code: int, detail: str, retry_after: Optional[int] = None) -> None:
+    """
+    エラー内容を通知してから切断（クライアントが既に切断している場合は何もしない）
+    retry_after を指定した場合は再試行までの目安（秒）を通知に含める
+    """
+    error = {"type": "error", "detail": detail}
+    if retry_after is not None:
+        error["retry_after"] = retry_after
+    try:
+        await websocket.send_json(error)
+        await websocket.close(code=code)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+
+async def spool_audio_to_tempfile(audio_file: UploadFile) -> str:
+    """
+    ジョブ実行用に音声をチャンク単位で一時ファイルへ退避（書き込みはスレッドプールで実行）
+    """
+    with observe_stage("temp_write"):
+        return await spool_chunks_to_tempfile(iter_audio_chunks(audio_file), suffix=".wav")
+
+async def audio_input_path(audio: Union[str, UploadFile]) -> tuple:
+    """
+    プロセスプールで読み込む音声のパスと、処理後に削除する一時ファイルか（パス, 削除するか）
+    アップロードが名前付きのファイルならそのまま読み、それ以外（メモリ上・名前のない一時ファイル）は一時ファイルへ退避する
+    """
+    if isinstance(audio, str):
+        return audio, False
+    path = await run_file_io(spooled_file_path, audio.file)
+    if path is not None:
+        return path, False
+    return await spool_audio_to_tempfile(audio), True
+
+async def submit_audio_job(audio_file: UploadFile, patient_data: dict) -> TimedJSONResponse:
+    """
+    音声処理ジョブを登録して202を返す（キュー満杯時は429）
+    """
+    if await audio_job_queue.is_full():
+        raise HTTPException(status_code=429, detail="処理待ちのジョブが上限に達しています。しばらくしてから再試行してください")
+    
+    audio_path = await spool_audio_to_tempfile(audio_file)
+    try:
+        job_id = await audio_job_queue.submit({"audio_path": audio_path, "patient_data": patient_data})
+    except QueueFullError:
+        await remove_file(audio_path)
+        raise HTTPException(status_code=429, detail="処理待ちのジョブが上限に達しています。しばらくしてから再試行してください")
+    
+    return TimedJSONResponse(status_code=202, content={
+        "success": True,
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/jobs/{job_id}"
+    })
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """
+    ジョブの状態を取得（完了済みの場合は結果を含む）
+    """
+    job = await find_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    
+    return TimedJSONResponse({
+        "success": True,
+        "job_id": job_id,
+        "kind": job["kind"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "result": job["result"],
+        "error": job["error"]
+    })
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """
+    ジョブの結果を取得（未完了の場合は202）
+    """
+    job = await find_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    
+    if job["status"] == "failed":
+        if job["kind"] == "export-to-sheets":
+            raise HTTPException(status_code=500, detail=f"エクスポート中にエラーが発生しました: {job['error']}")
+        raise HTTPException(status_code=500, detail=f"音声処理中にエラーが発生しました: {job['error']}")
+    if job["status"] != "succeeded":
+        return TimedJSONResponse(status_code=202, content={"success": False, "job_id": job_id, "status": job["status"]})
+    
+    result = job["result"]
+    if job["kind"] == "export-to-sheets":
+        return TimedJSONResponse(result)
+    return TimedJSONResponse({
+        "success": True,
+        "medical_record": result["medical_record"],
+        "confidence_score": result["confidence_score"],
+        "processing_time": result["processing_time"]
+    })
+
+async def process_with_dify_agent(
+    audio: Union[str, UploadFile],
+    patient_data: dict = None,
+    known_hash: Optional[str] = None,
+    uploaded_file_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Difyエージェントで音声を処理して医療記録を生成（audioはファイルパスまたはUploadFile）
+    ライブ録音では受信中に計算したハッシュ（known_hash）と先行アップロード済みのfileID（uploaded_file_id）を渡せる
+    分割処理の対象となる長時間録音では区間ごとにアップロードするため uploaded_file_id は使わない
+    （ライブ録音は分割の対象となる長さを超えた時点で先行アップロードを中止するため、録音を2回送ることはない）
+    """
+    start_time = time.time()
+    operation = "configuration"
+    
+    try:
+        settings = get_dify_settings()
+        dify_api_url, dify_api_key, dify_app_id = settings.api_url, settings.api_key, settings.app_id
+        
+        if not settings.configured:
             print("Dify API key or App ID not configured, using fallback mock response")
+            FALLBACK_TOTAL.labels(reason="not_configured").inc()
             return await fallback_mock_response(patient_data)
         
-        file_id = await upload_file_to_dify(audio_file_path, dify_api_key, dify_api_url)
-        
         prompt = create_medical_record_prompt(patient_data)
+        cache_prompt = record_cache_key(prompt)
+        
+        operation = "upload"
+        audio_hash = None
+        if audio_cache is not None:
+            audio_hash = known_hash or await hash_audio(audio)
+            cached_record = await audio_cache.get_record(audio_hash, cache_prompt)
+            if cached_record is not None:
+                return {
+                    "medical_record": cached_record,
+                    "confidence_score": 0.85,
+                    "processing_time": round(time.time() - start_time, 2)
+                }
+        
+        if await is_long_recording(audio):
+            operation = "segmented"
+            medical_record = await process_segmented_audio(audio, prompt, dify_api_key, dify_api_url, dify_app_id)
+        else:
+            if uploaded_file_id is not None:
+                file_id, file_id_cached = uploaded_file_id, False
+                if audio_hash is not None:
+                    await audio_cache.set_file_id(audio_hash, file_id)
+            else:
+                file_id, file_id_cached = await get_or_upload_file_id(audio, audio_hash, dify_api_key, dify_api_url)
+            
+            operation = "workflow"
+            try:
+                medical_record = await send_workflow_to_dify(prompt, file_id, dify_api_key, dify_api_url, dify_app_id)
+            except Exception:
+                if not file_id_cached:
+                    raise
+                # キャッシュ済みfileIDがDify側で失効している可能性があるため再アップロード
+                await audio_cache.invalidate_file_id(audio_hash)
+                file_id, _ = await get_or_upload_file_id(audio, audio_hash, dify_api_key, dify_api_url)
+                medical_record = await send_workflow_to_dify(prompt, file_id, dify_api_key, dify_api_url, dify_app_id)
         
-        medical_record = await send_workflow_to_dify(prompt, file_id, dify_api_key, dify_api_url, dify_app_id)
+        medical_record["prompt_version"] = get_prompt_template().version
+        if audio_hash is not None:
+            await audio_cache.set_record(audio_hash, cache_prompt, medical_record)
         
         processing_time = time.time() - start_time
         
@@ -121,148 +1148,382 @@ async def process_with_dify_agent(audio_file_path: str, patient_data: dict = Non
             "processing_time": round(processing_time, 2)
         }
         
+    except AudioTooLargeError:
+        raise
     except Exception as e:
         print(f"Dify API error: {str(e)}, falling back to mock response")
-        return await fallback_mock_response(patient_data)
+        record_dify_error(e, operation)
+        FALLBACK_TOTAL.labels(reason="dify_error").inc()
+        fallback = await fallback_mock_response(patient_data)
+        fallback["processing_time"] = round(time.time() - start_time, 2)
+        return fallback
 
-async def upload_file_to_dify(audio_file_path: str, api_key: str, api_url: str) -> str:
+async def is_long_recording(audio: Union[str, UploadFile]) -> bool:
     """
-    音声ファイルをDifyにアップロード
+    分割処理の対象となる長時間のWAV録音か（ヘッダーの再生時間で判定）
     """
-    async with httpx.AsyncClient() as client:
-        with open(audio_file_path, 'rb') as f:
-            files = {'file': (os.path.basename(audio_file_path), f, 'audio/wav')}
-            headers = {'Authorization': f'Bearer {api_key}'}
-            
-            response = await client.post(
-                f"{api_url}/files/upload",
-                headers=headers,
-                files=files,
-                data={'user': 'medical-system'}
-            )
-            
-            if response.status_code not in [200, 201]:
-                raise Exception(f"File upload failed: {response.text}")
-            
-            result = response.json()
-            return result['id']
+    if AUDIO_SEGMENT_THRESHOLD_SECONDS <= 0 or not await is_wav_audio(audio):
+        return False
+    if isinstance(audio, str):
+        duration = await run_file_io(wav_duration, audio)
+    else:
+        duration = await run_file_io(wav_duration, audio.file)
+        await audio.seek(0)
+    return duration > AUDIO_SEGMENT_THRESHOLD_SECONDS
 
-def create_medical_record_prompt(patient_data: dict = None) -> str:
+def create_segment_prompt(prompt: str, index: int, total: int) -> str:
     """
-    医療記録生成用のプロンプトを作成
+    区間の位置を伝える指示をプロンプトに追加
     """
-    patient_info = ""
-    if patient_data:
-        patient_info = f"""
-患者情報:
-- 氏名: {patient_data.get('name', '不明')}
-- 患者ID: {patient_data.get('id', '不明')}
-- 年齢: {patient_data.get('age', '不明')}
-- 性別: {patient_data.get('gender', '不明')}
+    return f"""{prompt}
+この音声は長時間の診察録音を分割した第{index + 1}/{total}区間です。この区間で言及された内容のみを記録し、言及のない項目は「〜を確認してください」としてください。
 """
-    
-    prompt = f"""
-あなたは芦屋Rいいだ内科クリニックの医療記録作成アシスタントです。
-内科・消化器内科専門の医師の診察音声から、構造化された医療記録を作成してください。
-
-{patient_info}
-
-以下の形式でJSONレスポンスを返してください：
-
-{{
-    "patient_id": "患者ID",
-    "consultation_date": "診察日時（YYYY-MM-DD HH:MM形式）",
-    "chief_complaint": "主訴",
-    "present_illness": "現病歴",
-    "physical_examination": "身体所見",
-    "diagnosis": "診断",
-    "prescription": "処方・治療",
-    "guidance": "生活指導・注意事項",
-    "next_appointment": "次回予約",
-    "notes": "備考"
-}}
-
-専門用語について：
-- 消化器内科：胃炎、胃潰瘍、逆流性食道炎、過敏性腸症候群、炎症性腸疾患など
-- 内科一般：高血圧、糖尿病、脂質異常症、甲状腺疾患など
-- 検査：胃カメラ、大腸カメラ、ピロリ菌検査、血液検査など
-
-音声から診察内容を正確に抽出し、医療記録として適切な日本語で記録してください。
-"""
-    
-    return prompt
 
-async def send_workflow_to_dify(prompt: str, file_id: str, api_key: str, api_url: str, app_id: str) -> dict:
+async def process_segmented_audio(audio: Union[str, UploadFile], prompt: str, api_key: str, api_url: str, app_id: str) -> dict:
     """
-    DifyのワークフローAPIに音声ファイル付きでメッセージを送信
+    録音を無音位置で分割し、区間ごとのアップロード・ワークフロー実行を並行数を制限して行い、録音順に統合
     """
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
-        
-        data = {
-            "inputs": {
-                "audio_file_id": file_id,
-                "prompt": prompt
-            },
-            "response_mode": "blocking",
-            "user": "medical-system"
-        }
+    from .audio import split_wav_file
+
+    input_path, spooled = await audio_input_path(audio)
+    segment_dir = await run_file_io(tempfile.mkdtemp, prefix="segments_")
+    try:
+        with observe_stage("audio_segment"):
+            segment_paths = await asyncio.get_running_loop().run_in_executor(
+                get_audio_preprocess_pool(),
+                split_wav_file,
+                input_path,
+                segment_dir,
+                AUDIO_SEGMENT_TARGET_SECONDS,
+                AUDIO_PREPROCESS_FORMAT,
+                AUDIO_PREPROCESS_TRIM_SILENCE,
+                AUDIO_PREPROCESS_SILENCE_DB
+            )
+        print(f"Processing long recording in {len(segment_paths)} segments")
         
-        response = await client.post(
-            f"{api_url}/workflows/run",
-            headers=headers,
-            json=data
-        )
+        semaphore = asyncio.Semaphore(AUDIO_SEGMENT_CONCURRENCY)
         
-        if response.status_code != 200:
-            raise Exception(f"Workflow API failed: {response.text}")
+        async def process_segment(index: int, segment_path: str) -> dict:
+            async with semaphore:
+                file_id = await upload_file_to_dify(segment_path, api_key, api_url)
+                segment_prompt = create_segment_prompt(prompt, index, len(segment_paths))
+                return await send_workflow_to_dify(segment_prompt, file_id, api_key, api_url, app_id)
         
-        result = response.json()
+        tasks = [asyncio.create_task(process_segment(i, path)) for i, path in enumerate(segment_paths)]
+        try:
+            # gatherは入力順に結果を返すため、完了順に関わらず録音順で統合される
+            segment_records = await asyncio.gather(*tasks)
+        finally:
+            # 1区間でも失敗した場合は結果が使われないため、処理中・待機中の区間を中止し、分割ファイルを削除する前に終了を待つ
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return merge_medical_records(segment_records)
+    finally:
+        await remove_tree(segment_dir)
+        if spooled:
+            await remove_file(input_path)
+
+async def iter_audio_chunks(audio: Union[str, UploadFile]) -> AsyncIterator[bytes]:
+    """
+    音声をチャンク単位で読み出し、上限サイズを超えた時点でAudioTooLargeErrorを送出
+    """
+    total = 0
+    chunks = iter_file_chunks(audio, AUDIO_UPLOAD_CHUNK_SIZE) if isinstance(audio, str) else iter_upload_chunks(audio)
+    async for chunk in chunks:
+        total += len(chunk)
+        if total > MAX_AUDIO_UPLOAD_BYTES:
+            raise AudioTooLargeError()
+        yield chunk
+
+async def iter_upload_chunks(audio: UploadFile) -> AsyncIterator[bytes]:
+    while chunk := await audio.read(AUDIO_UPLOAD_CHUNK_SIZE):
+        yield chunk
+
+async def hash_audio(audio: Union[str, UploadFile]) -> str:
+    """
+    音声のSHA-256をスレッドプールで計算（UploadFileは先頭に戻す）
+    """
+    with observe_stage("audio_hash"):
+        if isinstance(audio, str):
+            audio_hash, total = await run_file_io(hash_file, audio, AUDIO_UPLOAD_CHUNK_SIZE, MAX_AUDIO_UPLOAD_BYTES)
+        else:
+            await audio.seek(0)
+            audio_hash, total = await run_file_io(hash_fileobj, audio.file, AUDIO_UPLOAD_CHUNK_SIZE, MAX_AUDIO_UPLOAD_BYTES)
+            await audio.seek(0)
+        if total > MAX_AUDIO_UPLOAD_BYTES:
+            raise AudioTooLargeError()
+        return audio_hash
+
+async def get_or_upload_file_id(audio: Union[str, UploadFile], audio_hash: Optional[str], api_key: str, api_url: str) -> tuple:
+    """
+    キャッシュ済みのDify fileIDを返し、なければアップロードして登録（fileID, キャッシュ由来か）
+    """
+    if audio_hash is not None:
+        file_id = await audio_cache.get_file_id(audio_hash)
+        if file_id is not None:
+            return file_id, True
+    
+    async with preprocessed_audio(audio) as upload_source:
+        file_id = await upload_file_to_dify(upload_source, api_key, api_url)
+    if audio_hash is not None:
+        await audio_cache.set_file_id(audio_hash, file_id)
+    return file_id, False
+
+async def is_wav_audio(audio: Union[str, UploadFile]) -> bool:
+    """
+    先頭のRIFFヘッダーでWAVかどうかを判定（UploadFileは先頭に戻す）
+    """
+    if isinstance(audio, str):
+        header = await read_file_header(audio, 12)
+    else:
+        header = await audio.read(12)
+        await audio.seek(0)
+    return is_wav_header(header)
+
+@asynccontextmanager
+async def preprocessed_audio(audio: Union[str, UploadFile]):
+    """
+    WAV音声をプロセスプールでモノラル・16kHz化した一時ファイルのパスを渡す
+    前処理が無効・WAV以外・変換失敗の場合は元の音声をそのまま渡す
+    """
+    if not AUDIO_PREPROCESS_ENABLED or not await is_wav_audio(audio):
+        yield audio
+        return
+    
+    from .audio import preprocess_wav_file
+    
+    input_path, spooled = await audio_input_path(audio)
+    output_path = await create_temp_path(suffix=".pre")
+    upload_path = None
+    try:
+        try:
+            with observe_stage("audio_preprocess"):
+                info = await asyncio.get_running_loop().run_in_executor(
+                    get_audio_preprocess_pool(),
+                    preprocess_wav_file,
+                    input_path,
+                    output_path,
+                    AUDIO_PREPROCESS_FORMAT,
+                    AUDIO_PREPROCESS_TRIM_SILENCE,
+                    AUDIO_PREPROCESS_SILENCE_DB
+                )
+        except Exception as e:
+            print(f"Audio preprocessing failed: {str(e)}, uploading original audio")
+            info = None
         
-        if 'data' in result and 'outputs' in result['data']:
-            outputs = result['data']['outputs']
-            if 'structured_output' in outputs:
-                structured_data = outputs['structured_output']
-                return convert_workflow_output_to_medical_record(structured_data)
+        if info is None:
+            if not isinstance(audio, str):
+                await audio.seek(0)
+            yield audio
+            return
         
-        return parse_text_response_to_medical_record(str(result))
+        upload_path = output_path + FORMAT_EXTENSIONS[info["format"]]
+        await run_file_io(os.replace, output_path, upload_path)
+        print(f"Audio preprocessed: {info['input_seconds']:.1f}s -> {info['output_seconds']:.1f}s")
+        yield upload_path
+    finally:
+        for path in (output_path, upload_path, input_path if spooled else None):
+            await remove_file(path)
 
-def convert_workflow_output_to_medical_record(structured_data: dict) -> dict:
+async def stream_multipart_body(boundary: str, filename: str, content_type: str, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
     """
-    Difyワークフローの構造化出力を医療記録形式に変換
+    Difyのファイルアップロード用multipart本文を逐次生成
     """
-    return {
-        "patient_id": "AUTO-GENERATED",
-        "consultation_date": datetime.now().strftime("%Y-%m-%d %H:%M"),
-        "chief_complaint": structured_data.get('subjective', '主訴を確認してください'),
-        "present_illness": structured_data.get('subjective', '現病歴を確認してください'),
-        "physical_examination": structured_data.get('objective', '身体所見を確認してください'),
-        "diagnosis": structured_data.get('assessment', '診断を確認してください'),
-        "prescription": structured_data.get('plan', '処方内容を確認してください'),
-        "guidance": structured_data.get('plan', '指導内容を確認してください'),
-        "next_appointment": "次回予約を確認してください",
-        "notes": f"Dify AI処理完了 - 構造化データから生成"
+    safe_filename = filename.replace('"', '%22').replace('\r', '').replace('\n', '')
+    yield (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="user"\r\n\r\n'
+        f'medical-system\r\n'
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="file"; filename="{safe_filename}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'
+    ).encode('utf-8')
+    async for chunk in chunks:
+        yield chunk
+    yield f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+async def upload_file_to_dify(audio: Union[str, UploadFile], api_key: str, api_url: str) -> str:
+    """
+    音声ファイルをDifyにストリーミングアップロード（ブレーカー・再試行付き）
+    ファイルパスの場合は DIFY_UPLOAD_HEDGE_DELAY 秒で応答がなければ2本目を並行送信
+    """
+    settings = get_dify_settings()
+
+    async def attempt() -> str:
+        if isinstance(audio, str) and settings.upload_hedge_delay > 0:
+            return await hedged(lambda: post_file_to_dify(audio, api_key, api_url), settings.upload_hedge_delay)
+        return await post_file_to_dify(audio, api_key, api_url)
+    
+    async def rewind() -> None:
+        if not isinstance(audio, str):
+            await audio.seek(0)
+    
+    return await call_with_resilience(
+        attempt,
+        get_dify_breaker(),
+        get_dify_retry_budget(),
+        is_retryable_dify_error,
+        max_attempts=settings.retry_max_attempts,
+        base_delay=settings.retry_base_delay,
+        max_delay=settings.retry_max_delay,
+        before_retry=rewind
+    )
+
+async def post_file_to_dify(audio: Union[str, UploadFile], api_key: str, api_url: str) -> str:
+    """
+    音声ファイルをDifyに1回アップロード
+    """
+    if isinstance(audio, str):
+        filename = os.path.basename(audio)
+        content_type = AUDIO_CONTENT_TYPES.get(os.path.splitext(audio)[1].lower(), 'audio/wav')
+    else:
+        filename = os.path.basename(audio.filename or 'audio.wav')
+        content_type = audio.content_type if audio.content_type and audio.content_type.startswith('audio/') else 'audio/wav'
+    
+    return await post_chunks_to_dify(filename, content_type, iter_audio_chunks(audio), api_key, api_url)
+
+async def post_chunks_to_dify(filename: str, content_type: str, chunks: AsyncIterator[bytes], api_key: str, api_url: str) -> str:
+    """
+    チャンク列をファイル本文としてDifyに1回アップロード
+    """
+    client = get_dify_client()
+    boundary = uuid.uuid4().hex
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': f'multipart/form-data; boundary={boundary}'
     }
+    
+    with observe_stage("dify_upload"):
+        response = await client.post(
+            f"{api_url}/files/upload",
+            headers=headers,
+            content=stream_multipart_body(boundary, filename, content_type, chunks)
+        )
+    
+    if response.status_code not in [200, 201]:
+        raise DifyAPIError("upload", response.status_code, f"File upload failed: {response.text}")
+    
+    result = response.json()
+    return result['id']
 
-def parse_text_response_to_medical_record(text_response: str) -> dict:
+async def upload_live_stream_to_dify(stream: LiveChunkStream, filename: str, content_type: str, api_key: str, api_url: str) -> str:
     """
-    テキストレスポンスを医療記録形式に変換（フォールバック用）
+    録音中のチャンクを受信と並行してDifyへアップロード（本文は録音終了で確定する）
+    送信済みのチャンクは再送できないため再試行せず、失敗時は録音終了後に通常のアップロードを行う
     """
-    return {
-        "patient_id": "AUTO-GENERATED",
-        "consultation_date": datetime.now().strftime("%Y-%m-%d %H:%M"),
-        "chief_complaint": "音声から抽出された主訴",
-        "present_illness": text_response[:200] if text_response else "音声処理結果を確認してください",
-        "physical_examination": "診察所見を確認してください",
-        "diagnosis": "診断を確認してください",
-        "prescription": "処方内容を確認してください",
-        "guidance": "指導内容を確認してください",
-        "next_appointment": "次回予約を確認してください",
-        "notes": f"Dify処理結果: {text_response}"
+    try:
+        return await call_with_resilience(
+            lambda: post_chunks_to_dify(filename, content_type, stream, api_key, api_url),
+            get_dify_breaker(),
+            get_dify_retry_budget(),
+            is_retryable_dify_error,
+            max_attempts=1
+        )
+    finally:
+        stream.abandon()
+
+def create_medical_record_prompt(patient_data: dict = None) -> str:
+    """
+    医療記録生成用のプロンプトを作成（静的部分は読み込み済みテンプレートを使い、患者情報ブロックのみ描画）
+    """
+    return get_prompt_template().render(patient_data, include_static=get_dify_settings().prompt_mode != "context")
+
+def record_cache_key(prompt: str) -> str:
+    """
+    記録キャッシュ用のプロンプト識別子（context モードでも静的部分の変更で無効になるようテンプレートバージョンを含める）
+    """
+    return f"{get_prompt_template().version}:{get_dify_settings().prompt_mode}\n{prompt}"
+
+def build_workflow_request(prompt: str, file_id: str, api_key: str, response_mode: str = "blocking") -> tuple:
+    """
+    DifyワークフローAPIのヘッダーとリクエスト本文を作成
+    """
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    
+    data = {
+        "inputs": {
+            "audio_file_id": file_id,
+            "prompt": prompt
+        },
+        "response_mode": response_mode,
+        "user": "medical-system"
     }
+    if get_dify_settings().prompt_mode == "context":
+        data["inputs"]["prompt_version"] = get_prompt_template().version
+    
+    return headers, data
+
+async def send_workflow_to_dify(prompt: str, file_id: str, api_key: str, api_url: str, app_id: str) -> dict:
+    """
+    DifyのワークフローAPIに音声ファイル付きでメッセージを送信（ブレーカー・再試行付き）
+    ワークフローは冪等でないため、読み取りタイムアウト等の届いた可能性があるエラーは再試行しない
+    """
+    settings = get_dify_settings()
+    return await call_with_resilience(
+        lambda: post_workflow_to_dify(prompt, file_id, api_key, api_url, app_id),
+        get_dify_breaker(),
+        get_dify_retry_budget(),
+        is_retryable_dify_error,
+        max_attempts=settings.retry_max_attempts,
+        base_delay=settings.retry_base_delay,
+        max_delay=settings.retry_max_delay,
+        can_retry=is_unsent_workflow_error
+    )
+
+async def post_workflow_to_dify(prompt: str, file_id: str, api_key: str, api_url: str, app_id: str) -> dict:
+    """
+    DifyのワークフローAPIを1回呼び出し、医療記録形式に変換
+    """
+    client = get_dify_client()
+    headers, data = build_workflow_request(prompt, file_id, api_key)
+    
+    with observe_stage("dify_workflow"):
+        response = await client.post(
+            f"{api_url}/workflows/run",
+            headers=headers,
+            json=data
+        )
+    
+    if response.status_code != 200:
+        raise DifyAPIError("workflow", response.status_code, f"Workflow API failed: {response.text}")
+    
+    with observe_stage("output_conversion"):
+        result = response.json()
+        outputs = (result.get('data') or {}).get('outputs')
+        return record_output_converter.convert(outputs if outputs is not None else result)
+
+async def stream_workflow_from_dify(prompt: str, file_id: str, api_key: str, api_url: str, app_id: str) -> AsyncIterator[Dict[str, Any]]:
+    """
+    DifyのワークフローAPIをstreamingモードで呼び出し、イベントを逐次返す
+    """
+    client = get_dify_client()
+    headers, data = build_workflow_request(prompt, file_id, api_key, response_mode="streaming")
+    breaker = get_dify_breaker()
+    
+    breaker.before_call()
+    try:
+        async with client.stream("POST", f"{api_url}/workflows/run", headers=headers, json=data) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise DifyAPIError("workflow", response.status_code, f"Workflow API failed: {response.text}")
+            
+            async for event in iter_sse_events(response.aiter_lines()):
+                yield event
+    except Exception as e:
+        if is_retryable_dify_error(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    except BaseException:
+        # クライアント切断（GeneratorExit）・キャンセルでも試行呼び出しの枠を解放する
+        breaker.record_cancelled()
+        raise
+    breaker.record_success()
 
 async def fallback_mock_response(patient_data: dict = None) -> Dict[str, Any]:
     """
@@ -295,50 +1556,230 @@ async def save_medical_record(record: MedicalRecord):
     医療記録をデータベースに保存
     """
     try:
-        record_dict = record.dict()
-        record_dict["id"] = len(medical_records_db) + 1
+        record_dict = record.model_dump()
         record_dict["created_at"] = datetime.now().isoformat()
         
-        medical_records_db.append(record_dict)
+        saved = await record_store.save(record_dict)
         
         return {
             "success": True,
             "message": "医療記録が保存されました",
-            "record_id": record_dict["id"]
+            "record_id": saved["id"]
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"記録保存中にエラーが発生しました: {str(e)}")
 
 @app.get("/api/records")
-async def get_medical_records():
+async def get_medical_records(
+    patient_id: Optional[str] = Query(None),
+    date_from: Optional[date] = Query(None),
+    date_to: Optional[date] = Query(None),
+    sort: str = Query("created_at"),
+    order: str = Query("desc"),
+    limit: int = Query(50, ge=1, le=RECORDS_PAGE_MAX_LIMIT),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+    include_total: bool = Query(False)
+):
     """
-    保存された医療記録一覧を取得
+    保存された医療記録一覧をカーソル方式のページ単位で取得
+    fields=chief_complaint,diagnosis のように取得項目を絞り込み可能（idは常に含む）
     """
-    return {
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    date_from_value = date_from.isoformat() if date_from else None
+    date_to_value = (date_to + timedelta(days=1)).isoformat() if date_to else None
+    
+    try:
+        records, next_cursor = await record_store.query(
+            patient_id=patient_id,
+            date_from=date_from_value,
+            date_to=date_to_value,
+            sort=sort,
+            order=order,
+            limit=limit,
+            cursor=cursor,
+            fields=field_list
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"検索条件が正しくありません: {str(e)}")
+    
+    response = {
         "success": True,
-        "records": medical_records_db,
-        "total": len(medical_records_db)
+        "records": records,
+        "count": len(records),
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None
     }
+    if include_total:
+        response["total"] = await record_store.count_matching(patient_id, date_from_value, date_to_value)
+    return TimedJSONResponse(response)
 
-@app.post("/api/export-to-sheets")
-async def export_to_google_sheets(record_ids: Optional[list[int]] = None):
+@app.get("/api/records/search")
+async def search_medical_records(
+    q: str = Query(..., min_length=1),
+    patient_id: Optional[str] = Query(None),
+    date_from: Optional[date] = Query(None),
+    date_to: Optional[date] = Query(None),
+    limit: int = Query(50, ge=1, le=RECORDS_PAGE_MAX_LIMIT),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None)
+):
     """
-    医療記録をGoogle Sheetsにエクスポート（モック実装）
+    主訴・現病歴・診断・処方・備考を全文検索し、新しい順にカーソル方式のページ単位で取得
+    空白区切りの複数語はすべてを含む記録を返す
     """
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+
     try:
-        if record_ids:
-            records_to_export = [r for r in medical_records_db if r["id"] in record_ids]
-        else:
-            records_to_export = medical_records_db
-        
-        
+        records, next_cursor = await record_store.search(
+            q,
+            patient_id=patient_id,
+            date_from=date_from.isoformat() if date_from else None,
+            date_to=(date_to + timedelta(days=1)).isoformat() if date_to else None,
+            limit=limit,
+            cursor=cursor,
+            fields=field_list
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"検索条件が正しくありません: {str(e)}")
+
+    return TimedJSONResponse({
+        "success": True,
+        "query": q,
+        "records": records,
+        "count": len(records),
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None
+    })
+
+@app.get("/api/records/export")
+async def export_medical_records(
+    format: str = Query("csv"),
+    patient_id: Optional[str] = Query(None),
+    date_from: Optional[date] = Query(None),
+    date_to: Optional[date] = Query(None)
+):
+    """
+    医療記録をCSV・NDJSON・Parquet・xlsxで一括ダウンロード（一定メモリで逐次出力）
+    """
+    if format not in EXPORT_STREAMERS:
+        raise HTTPException(status_code=400, detail=f"未対応の形式です: {format}（csv, ndjson, parquet, xlsx）")
+    if format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise HTTPException(status_code=501, detail="Parquet出力にはpyarrowのインストールが必要です")
+    
+    return stream_export(format, patient_id, date_from, date_to)
+
+@app.post("/api/export-to-excel")
+async def export_to_excel(
+    patient_id: Optional[str] = Query(None),
+    date_from: Optional[date] = Query(None),
+    date_to: Optional[date] = Query(None)
+):
+    """
+    医療記録をExcel（xlsx）でダウンロード（ワークブックをメモリ上に組み立てず、一定メモリで逐次出力）
+    """
+    return stream_export("xlsx", patient_id, date_from, date_to)
+
+def stream_export(format: str, patient_id: Optional[str], date_from: Optional[date], date_to: Optional[date]) -> StreamingResponse:
+    """
+    条件に合う記録を作成日時順に読み出し、指定形式で逐次出力するレスポンスを作成（date_toは当日を含む）
+    """
+    batches = iter_export_batches(
+        record_store,
+        patient_id=patient_id,
+        date_from=date_from.isoformat() if date_from else None,
+        date_to=(date_to + timedelta(days=1)).isoformat() if date_to else None,
+        batch_size=RECORDS_EXPORT_BATCH_SIZE
+    )
+    filename = f"medical_records_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}"
+    
+    return StreamingResponse(
+        EXPORT_STREAMERS[format](batches),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+async def get_sheets_writer() -> Optional[SheetsWriter]:
+    """
+    Google Sheetsの書き込み先を取得（未設定の場合はNone）
+    認証ファイルの読み込みとAPIクライアントの作成はブロッキングのため、初回にファイルI/O用スレッドプールで行う
+    """
+    global sheets_writer
+    if sheets_writer is None and GOOGLE_SHEETS_SPREADSHEET_ID and GOOGLE_SHEETS_CREDENTIALS_FILE:
+        writer = await run_file_io(
+            GoogleSheetsWriter, GOOGLE_SHEETS_SPREADSHEET_ID, GOOGLE_SHEETS_SHEET_NAME, GOOGLE_SHEETS_CREDENTIALS_FILE
+        )
+        # 作成中に並行して作成された場合は先に作成されたものを使う
+        if sheets_writer is None:
+            sheets_writer = writer
+    return sheets_writer
+
+async def run_sheets_export(record_ids: Optional[list[int]] = None, incremental: bool = False) -> Dict[str, Any]:
+    """
+    医療記録をチャンク単位でGoogle Sheetsに書き込む
+    incremental=True の場合は前回エクスポート以降に作成された記録のみを対象とする
+    """
+    writer = await get_sheets_writer()
+    if writer is None:
+        print("Google Sheets not configured, using mock export")
+        exported_count = len(record_ids) if record_ids else await record_store.count()
         return {
             "success": True,
-            "message": f"{len(records_to_export)}件の記録をGoogle Sheetsにエクスポートしました",
+            "message": f"{exported_count}件の記録をGoogle Sheetsにエクスポートしました",
             "sheet_url": "https://docs.google.com/spreadsheets/d/mock-sheet-id",
-            "exported_count": len(records_to_export)
+            "exported_count": exported_count
         }
+    
+    watermark = int(await record_store.get_state(SHEETS_EXPORT_STATE_KEY) or 0) if not record_ids else 0
+    after_id = watermark if incremental else 0
+    
+    async def save_watermark(last_id: int) -> None:
+        # 全件エクスポートが途中で失敗した場合に、保存済みの位置を戻さない
+        if last_id > watermark:
+            await record_store.set_state(SHEETS_EXPORT_STATE_KEY, str(last_id))
+    
+    # 書き込み済みの位置はチャンク毎に保存し、途中で失敗しても次回の差分エクスポートで重複させない
+    exporter = SheetsExporter(writer, chunk_size=GOOGLE_SHEETS_CHUNK_SIZE, max_retries=GOOGLE_SHEETS_MAX_RETRIES)
+    result = await exporter.export(
+        record_store.iter_batches(after_id=after_id, record_ids=record_ids or None, batch_size=GOOGLE_SHEETS_CHUNK_SIZE),
+        on_chunk=None if record_ids else save_watermark
+    )
+    
+    return {
+        "success": True,
+        "message": f"{result['exported_count']}件の記録をGoogle Sheetsにエクスポートしました",
+        "sheet_url": writer.spreadsheet_url,
+        "exported_count": result["exported_count"]
+    }
+
+@app.post("/api/export-to-sheets")
+async def export_to_google_sheets(
+    record_ids: Optional[list[int]] = None,
+    incremental: bool = Query(False),
+    mode: str = Query("auto")
+):
+    """
+    医療記録をGoogle Sheetsにエクスポート
+    件数の多いエクスポート（記録ID指定なし、または SHEETS_EXPORT_SYNC_LIMIT 件超）はジョブとして実行
+    """
+    try:
+        run_as_job = mode == "job" or (mode == "auto" and (not record_ids or len(record_ids) > SHEETS_EXPORT_SYNC_LIMIT))
+        if run_as_job:
+            try:
+                job_id = await export_job_queue.submit({"record_ids": record_ids, "incremental": incremental})
+            except QueueFullError:
+                raise HTTPException(status_code=429, detail="処理待ちのジョブが上限に達しています。しばらくしてから再試行してください")
+            return TimedJSONResponse(status_code=202, content={
+                "success": True,
+                "job_id": job_id,
+                "status": "queued",
+                "status_url": f"/api/jobs/{job_id}"
+            })
+        
+        return await run_sheets_export(record_ids, incremental)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"エクスポート中にエラーが発生しました: {str(e)}")
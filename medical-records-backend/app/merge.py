@@ -0,0 +1,57 @@
+from typing import List, Optional
+
+# 区間ごとの記載を録音順に連結する項目
+MERGED_TEXT_FIELDS = (
+    "chief_complaint",
+    "present_illness",
+    "physical_examination",
+    "diagnosis",
+    "prescription",
+    "guidance",
+    "notes",
+)
+
+PLACEHOLDER_SUFFIX = "を確認してください"
+AUTO_GENERATED_PATIENT_ID = "AUTO-GENERATED"
+
+def is_placeholder(value: Optional[str]) -> bool:
+    """
+    未抽出を表す値（空・「〜を確認してください」）か
+    """
+    return not value or not str(value).strip() or str(value).strip().endswith(PLACEHOLDER_SUFFIX)
+
+def merge_text(values: List[Optional[str]]) -> Optional[str]:
+    """
+    プレースホルダーを除いた値を録音順・重複なしで改行連結（すべてプレースホルダーなら先頭の値）
+    """
+    merged = []
+    for value in values:
+        if is_placeholder(value):
+            continue
+        text = str(value).strip()
+        if text not in merged:
+            merged.append(text)
+    if not merged:
+        return values[0] if values else None
+    return "\n".join(merged)
+
+def merge_medical_records(records: List[dict]) -> dict:
+    """
+    録音順に並んだ区間ごとの医療記録を1件に統合する
+    入力の順序のみで結果が決まり、同じ入力からは常に同じ記録が得られる
+    """
+    if not records:
+        raise ValueError("records must not be empty")
+    if len(records) == 1:
+        return dict(records[0])
+
+    merged = {field: merge_text([record.get(field) for record in records]) for field in MERGED_TEXT_FIELDS}
+
+    patient_ids = [record.get("patient_id") for record in records]
+    merged["patient_id"] = next((pid for pid in patient_ids if pid and pid != AUTO_GENERATED_PATIENT_ID), patient_ids[0])
+    # 診察日時は録音開始（最初の区間）、次回予約は最後に言及された区間を採用
+    merged["consultation_date"] = records[0].get("consultation_date")
+    appointments = [record.get("next_appointment") for record in records]
+    merged["next_appointment"] = next((a for a in reversed(appointments) if not is_placeholder(a)), appointments[-1])
+    merged["notes"] = f"{merged['notes']}\n（{len(records)}区間の処理結果を統合）" if merged["notes"] else f"{len(records)}区間の処理結果を統合"
+    return merged
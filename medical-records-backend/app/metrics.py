@@ -0,0 +1,141 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+from .resilience import CircuitOpenError
+
+# ミリ秒単位の処理からDifyのタイムアウト（60秒）付近までを捕捉するバケット
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+STAGE_DURATION = Histogram(
+    "medical_records_stage_duration_seconds",
+    "Duration of each processing stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "medical_records_http_request_duration_seconds",
+    "Duration of HTTP requests by route",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+FALLBACK_TOTAL = Counter(
+    "medical_records_fallback_responses_total",
+    "Number of times fallback_mock_response was used",
+    ["reason"],
+)
+
+DIFY_ERRORS_TOTAL = Counter(
+    "medical_records_dify_errors_total",
+    "Dify API errors by operation and status code",
+    ["operation", "status_code"],
+)
+
+JOB_QUEUE_DEPTH = Gauge(
+    "medical_records_job_queue_depth",
+    "Number of queued jobs waiting for a worker",
+    ["kind"],
+    multiprocess_mode="livemax",
+)
+
+LIVE_SESSIONS = Gauge(
+    "medical_records_live_sessions",
+    "Number of open live recording WebSocket sessions",
+    multiprocess_mode="livesum",
+)
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "medical_records_admission_in_flight",
+    "Number of admitted requests currently being processed",
+    multiprocess_mode="livesum",
+)
+
+ADMISSION_QUEUED = Gauge(
+    "medical_records_admission_queued",
+    "Number of requests waiting for a processing slot",
+    multiprocess_mode="livesum",
+)
+
+ADMISSION_DECISIONS_TOTAL = Counter(
+    "medical_records_admission_decisions_total",
+    "Admission decisions for the processing endpoints",
+    ["outcome"],
+)
+
+EVENT_LOOP_LAG = Histogram(
+    "medical_records_event_loop_lag_seconds",
+    "Delay between the scheduled and actual wake-up of the event loop monitor",
+    buckets=LATENCY_BUCKETS,
+)
+
+EVENT_LOOP_BLOCKED_TOTAL = Counter(
+    "medical_records_event_loop_blocked_total",
+    "Number of times the event loop was blocked longer than the threshold",
+)
+
+class DifyAPIError(Exception):
+    """
+    Dify APIが成功以外のステータスを返した場合の例外
+    """
+
+    def __init__(self, operation: str, status_code: int, message: str):
+        super().__init__(message)
+        self.operation = operation
+        self.status_code = status_code
+
+@contextmanager
+def observe_stage(stage: str):
+    """
+    withブロックの所要時間をステージ別ヒストグラムに記録
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(stage=stage).observe(time.perf_counter() - start)
+
+def observe_since(stage: str, started_at: float) -> None:
+    """
+    perf_counterの開始時刻からの経過時間をステージ別ヒストグラムに記録
+    """
+    STAGE_DURATION.labels(stage=stage).observe(time.perf_counter() - started_at)
+
+def record_dify_error(error: Exception, operation: str = "unknown") -> None:
+    """
+    Dify呼び出しのエラーをステータスコード（または種別）毎に集計
+    """
+    import httpx
+
+    if isinstance(error, DifyAPIError):
+        DIFY_ERRORS_TOTAL.labels(operation=error.operation, status_code=str(error.status_code)).inc()
+    elif isinstance(error, CircuitOpenError):
+        DIFY_ERRORS_TOTAL.labels(operation=operation, status_code="circuit_open").inc()
+    elif isinstance(error, httpx.TimeoutException):
+        DIFY_ERRORS_TOTAL.labels(operation=operation, status_code="timeout").inc()
+    elif isinstance(error, httpx.TransportError):
+        DIFY_ERRORS_TOTAL.labels(operation=operation, status_code="connection_error").inc()
+    else:
+        DIFY_ERRORS_TOTAL.labels(operation=operation, status_code="other").inc()
+
+def render_metrics() -> tuple:
+    """
+    Prometheusテキスト形式のメトリクスと Content-Type を返す
+    複数ワーカー構成で PROMETHEUS_MULTIPROC_DIR が設定されている場合は全プロセスの値を集計する
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+def mark_worker_dead(pid: int = None) -> None:
+    """
+    終了したワーカーの live 系ゲージを集計対象から外す（PROMETHEUS_MULTIPROC_DIR 未設定時は何もしない）
+    pid を省略すると現在のプロセスを対象にする
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid() if pid is None else pid)
@@ -0,0 +1,70 @@
+import os
+from functools import lru_cache
+from typing import Optional
+
+# プロンプトテンプレートの構成ファイル（prompts/<バージョン>/ 配下）
+INSTRUCTIONS_FILE = "instructions.txt"
+VOCABULARY_FILE = "vocabulary.txt"
+PATIENT_CONTEXT_FILE = "patient_context.txt"
+
+PATIENT_CONTEXT_FIELDS = ("name", "id", "age", "gender")
+UNKNOWN_VALUE = "不明"
+
+class PromptTemplate:
+    """
+    バージョン管理された医療記録生成プロンプト
+    静的な指示・専門用語部分は読み込み時に1度だけ組み立て、リクエスト毎には患者情報ブロックのみを描画する
+    """
+
+    def __init__(self, version: str, instructions: str, vocabulary: str, patient_context: str, context_cache_size: int = 1024):
+        self.version = version
+        self.static_prompt = f"{instructions.strip()}\n\n{vocabulary.strip()}\n"
+        self.patient_context = patient_context.strip()
+        self._render_context = lru_cache(maxsize=context_cache_size)(self._render)
+        self._render_prompt = lru_cache(maxsize=context_cache_size)(self._compose)
+
+    def _render(self, values: tuple) -> str:
+        return self.patient_context.format_map({
+            field: str(value) if value else UNKNOWN_VALUE for field, value in zip(PATIENT_CONTEXT_FIELDS, values)
+        })
+
+    def _compose(self, values: Optional[tuple], include_static: bool) -> str:
+        context = self._render_context(values) if values is not None else ""
+        if not include_static:
+            return context
+        return f"{self.static_prompt}\n{context}\n" if context else self.static_prompt
+
+    @staticmethod
+    def _patient_values(patient_data: Optional[dict]) -> Optional[tuple]:
+        if not patient_data:
+            return None
+        get = patient_data.get
+        return (get("name"), get("id"), get("age"), get("gender"))
+
+    def render_context(self, patient_data: Optional[dict]) -> str:
+        """
+        患者情報ブロックを描画（同じ患者情報の組み合わせはキャッシュから返す）
+        """
+        values = self._patient_values(patient_data)
+        return self._render_context(values) if values is not None else ""
+
+    def render(self, patient_data: Optional[dict], include_static: bool = True) -> str:
+        """
+        送信するプロンプトを作成（include_static=Falseの場合は患者情報ブロックのみ）
+        """
+        return self._render_prompt(self._patient_values(patient_data), include_static)
+
+    def cache_info(self):
+        return self._render_context.cache_info()
+
+def load_prompt_template(directory: str, version: str) -> PromptTemplate:
+    """
+    prompts/<version>/ のテンプレートファイルを読み込む（存在しない場合はFileNotFoundError）
+    """
+    version_dir = os.path.join(directory, version)
+
+    def read(filename: str) -> str:
+        with open(os.path.join(version_dir, filename), encoding="utf-8") as f:
+            return f.read()
+
+    return PromptTemplate(version, read(INSTRUCTIONS_FILE), read(VOCABULARY_FILE), read(PATIENT_CONTEXT_FILE))
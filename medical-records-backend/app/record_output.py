@@ -0,0 +1,246 @@
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Union
+
+import orjson
+from pydantic import ConfigDict, TypeAdapter, ValidationError, with_config
+from typing_extensions import TypedDict
+
+from .merge import AUTO_GENERATED_PATIENT_ID
+
+# 構造化出力（SOAP形式）の各項目に対応する医療記録の項目
+STRUCTURED_OUTPUT_FIELD_MAP = {
+    "subjective": ["chief_complaint", "present_illness"],
+    "objective": ["physical_examination"],
+    "assessment": ["diagnosis"],
+    "plan": ["prescription", "guidance"]
+}
+
+# 抽出できなかった項目の値（merge.py は「〜を確認してください」を未抽出として扱う）
+PLACEHOLDERS = {
+    "chief_complaint": "主訴を確認してください",
+    "present_illness": "現病歴を確認してください",
+    "physical_examination": "身体所見を確認してください",
+    "diagnosis": "診断を確認してください",
+    "prescription": "処方内容を確認してください",
+    "guidance": "指導内容を確認してください",
+    "next_appointment": "次回予約を確認してください",
+}
+
+RECORD_TEXT_FIELDS = list(PLACEHOLDERS) + ["notes"]
+
+# テキスト出力を探すDifyの出力キー（LLMノードの text、チャットアプリの answer など）
+TEXT_OUTPUT_KEYS = ("text", "output", "result", "answer")
+
+# 自由記述の見出し（医療記録の項目名・SOAP）と対応する項目
+TEXT_LABELS = {
+    "主訴": "chief_complaint",
+    "chief complaint": "chief_complaint",
+    "現病歴": "present_illness",
+    "present illness": "present_illness",
+    "身体所見": "physical_examination",
+    "診察所見": "physical_examination",
+    "physical examination": "physical_examination",
+    "診断": "diagnosis",
+    "診断名": "diagnosis",
+    "diagnosis": "diagnosis",
+    "処方・治療": "prescription",
+    "処方": "prescription",
+    "治療": "prescription",
+    "prescription": "prescription",
+    "生活指導・注意事項": "guidance",
+    "生活指導": "guidance",
+    "注意事項": "guidance",
+    "指導": "guidance",
+    "guidance": "guidance",
+    "次回予約": "next_appointment",
+    "次回": "next_appointment",
+    "next appointment": "next_appointment",
+    "備考": "notes",
+    "notes": "notes",
+    "s": "subjective",
+    "subjective": "subjective",
+    "o": "objective",
+    "objective": "objective",
+    "a": "assessment",
+    "assessment": "assessment",
+    "p": "plan",
+    "plan": "plan",
+}
+
+_LABEL_ALTERNATION = "|".join(re.escape(label) for label in sorted(TEXT_LABELS, key=len, reverse=True))
+# 行頭の「【診断】」「[Plan]」「診断：」「S:」、または見出しだけの行（「## 診断」）
+_LABEL_PATTERN = re.compile(
+    rf"^[ \t]*(?:[-*・#>]+[ \t]*)?(?:【({_LABEL_ALTERNATION})】|\[({_LABEL_ALTERNATION})\]|({_LABEL_ALTERNATION})[ \t]*[:：]|({_LABEL_ALTERNATION})[ \t]*$)[ \t]*[:：]?",
+    re.MULTILINE | re.IGNORECASE
+)
+_CONSULTATION_DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}$")
+
+FieldText = Optional[Union[str, List[str]]]
+
+@with_config(ConfigDict(coerce_numbers_to_str=True, str_strip_whitespace=True))
+class WorkflowFields(TypedDict, total=False):
+    """
+    Difyの構造化出力（SOAP形式・医療記録形式のどちらのキーも受け付け、それ以外のキーは無視）
+    """
+    subjective: FieldText
+    objective: FieldText
+    assessment: FieldText
+    plan: FieldText
+    patient_id: FieldText
+    consultation_date: FieldText
+    chief_complaint: FieldText
+    present_illness: FieldText
+    physical_examination: FieldText
+    diagnosis: FieldText
+    prescription: FieldText
+    guidance: FieldText
+    next_appointment: FieldText
+    notes: FieldText
+
+WORKFLOW_FIELD_KEYS = frozenset(WorkflowFields.__annotations__)
+
+# 備考が出力に含まれない場合に、どの形式から生成したかを記録する
+SOURCE_NOTES = {
+    "structured": "Dify AI処理完了 - 構造化データから生成",
+    "text": "Dify AI処理完了 - テキスト出力の見出しから生成",
+    "unstructured": "Dify AI処理完了 - 見出しのないテキスト出力を現病歴として記録",
+    "empty": "Difyの出力から項目を抽出できませんでした",
+}
+
+def extract_labeled_fields(text: str) -> Dict[str, str]:
+    """
+    自由記述から見出し付きの項目を取り出す（JSONで書かれていればそのまま解釈する）
+    JSONはコードブロック（```json）等に囲まれていてもよく、最初の「{」から最後の「}」までを解釈する
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if 0 <= start < end:
+        try:
+            parsed = orjson.loads(text[start:end + 1])
+        except orjson.JSONDecodeError:
+            parsed = None
+        if isinstance(parsed, dict) and isinstance(parsed.get("structured_output"), dict):
+            parsed = parsed["structured_output"]
+        if isinstance(parsed, dict) and WORKFLOW_FIELD_KEYS.intersection(parsed):
+            return parsed
+
+    matches = list(_LABEL_PATTERN.finditer(text))
+    fields: Dict[str, str] = {}
+    for match, following in zip(matches, matches[1:] + [None]):
+        label = next(group for group in match.groups() if group is not None)
+        field = TEXT_LABELS[label.lower()]
+        content = text[match.end():following.start() if following else len(text)].strip()
+        if content:
+            fields[field] = f"{fields[field]}\n{content}" if field in fields else content
+    return fields
+
+class RecordOutputConverter:
+    """
+    Difyの出力（構造化出力・自由記述）を医療記録に変換する
+    検証はPydanticのコンパイル済みバリデーターで行い、複数件はまとめて1回で検証する
+    各項目は max_field_chars 文字までに切り詰め、生の出力を記録に保存しない
+    """
+
+    def __init__(self, max_field_chars: int = 4000):
+        self.max_field_chars = max_field_chars
+        self._adapter = TypeAdapter(WorkflowFields)
+        self._batch_adapter = TypeAdapter(List[WorkflowFields])
+
+    def convert(self, output: Any) -> Dict[str, Any]:
+        """
+        1件の出力を医療記録に変換
+        """
+        fields, source = self._extract(output)
+        try:
+            validated = self._adapter.validate_python(fields)
+        except ValidationError:
+            validated = self._adapter.validate_python(self._salvage(fields))
+        return self._to_record(validated, source, datetime.now().strftime("%Y-%m-%d %H:%M"))
+
+    def convert_many(self, outputs: List[Any]) -> List[Dict[str, Any]]:
+        """
+        複数の出力をまとめて医療記録に変換（再処理用、検証は1回の呼び出しで行う）
+        """
+        extracted = [self._extract(output) for output in outputs]
+        try:
+            validated = self._batch_adapter.validate_python([fields for fields, _ in extracted])
+        except ValidationError as e:
+            invalid = {error["loc"][0] for error in e.errors()}
+            validated = self._batch_adapter.validate_python([
+                self._salvage(fields) if index in invalid else fields for index, (fields, _) in enumerate(extracted)
+            ])
+        now = datetime.now().strftime("%Y-%m-%d %H:%M")
+        return [self._to_record(fields, source, now) for fields, (_, source) in zip(validated, extracted)]
+
+    def _extract(self, output: Any) -> tuple:
+        """
+        出力から項目のdictを取り出し、（項目, 取り出し元）を返す
+        """
+        if isinstance(output, dict):
+            structured = output.get("structured_output")
+            if isinstance(structured, dict):
+                return structured, "structured"
+            if WORKFLOW_FIELD_KEYS.intersection(output):
+                return output, "structured"
+            texts = [output[key] for key in TEXT_OUTPUT_KEYS if isinstance(output.get(key), str)]
+            output = "\n".join(texts)
+        if isinstance(output, str) and output.strip():
+            fields = extract_labeled_fields(output)
+            if fields:
+                return fields, "text"
+            # 見出しのない自由記述は現病歴として扱う
+            return {"present_illness": output}, "unstructured"
+        return {}, "empty"
+
+    @staticmethod
+    def _salvage(fields: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        検証できない値を含む出力を検証できる形にする（入れ子のdictは「キー: 値」の行に展開し、それ以外の値は捨てる）
+        """
+        salvaged = {}
+        for key, value in fields.items():
+            if key not in WORKFLOW_FIELD_KEYS:
+                continue
+            if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+                salvaged[key] = value
+            elif isinstance(value, list):
+                salvaged[key] = [str(item) for item in value if isinstance(item, (str, int, float))]
+            elif isinstance(value, dict):
+                salvaged[key] = "\n".join(f"{name}: {item}" for name, item in value.items() if isinstance(item, (str, int, float)))
+        return salvaged
+
+    def _text(self, value: FieldText) -> Optional[str]:
+        if isinstance(value, list):
+            value = "\n".join(item for item in value if item)
+        if not value:
+            return None
+        return value if len(value) <= self.max_field_chars else value[:self.max_field_chars - 1] + "…"
+
+    def _to_record(self, fields: Dict[str, Any], source: str, now: str) -> Dict[str, Any]:
+        values = {key: self._text(value) for key, value in fields.items()}
+        for soap_key, record_fields in STRUCTURED_OUTPUT_FIELD_MAP.items():
+            if values.get(soap_key):
+                for field in record_fields:
+                    if not values.get(field):
+                        values[field] = values[soap_key]
+
+        consultation_date = values.get("consultation_date")
+        if not consultation_date or not _CONSULTATION_DATE_PATTERN.match(consultation_date):
+            consultation_date = now
+
+        record = {
+            "patient_id": values.get("patient_id") or AUTO_GENERATED_PATIENT_ID,
+            "consultation_date": consultation_date,
+        }
+        for field, placeholder in PLACEHOLDERS.items():
+            record[field] = values.get(field) or placeholder
+        record["notes"] = values.get("notes") or SOURCE_NOTES[source]
+        return record
+
+def record_fields_for(output_field: str) -> List[str]:
+    """
+    構造化出力の項目名に対応する医療記録の項目（SOAP形式・医療記録形式の両方）
+    """
+    if output_field in STRUCTURED_OUTPUT_FIELD_MAP:
+        return STRUCTURED_OUTPUT_FIELD_MAP[output_field]
+    return [output_field] if output_field in RECORD_TEXT_FIELDS else []
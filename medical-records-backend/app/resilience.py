@@ -0,0 +1,186 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+class CircuitOpenError(Exception):
+    """
+    サーキットブレーカーが開いているため呼び出しを即時失敗させた場合の例外
+    """
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit '{name}' is open, retry after {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    連続失敗で開き、一定時間後に試行呼び出し（half-open）で復旧を確認するサーキットブレーカー
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.half_open_calls = 0
+        self.total_failures = 0
+        self.total_rejections = 0
+
+    def before_call(self) -> None:
+        """
+        呼び出し前に状態を確認し、開いている場合はCircuitOpenErrorを送出
+        """
+        if self.state == "open":
+            elapsed = time.monotonic() - self.opened_at
+            if elapsed < self.recovery_timeout:
+                self.total_rejections += 1
+                raise CircuitOpenError(self.name, self.recovery_timeout - elapsed)
+            self.state = "half_open"
+            self.half_open_calls = 0
+        if self.state == "half_open":
+            if self.half_open_calls >= self.half_open_max_calls:
+                self.total_rejections += 1
+                raise CircuitOpenError(self.name, self.recovery_timeout)
+            self.half_open_calls += 1
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self.total_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def record_cancelled(self) -> None:
+        """
+        結果が出る前に中断された呼び出し（キャンセル・クライアント切断）の後始末
+        half-open の試行呼び出しが中断された場合は開いた状態に戻し、recovery_timeout 後に改めて試行する
+        """
+        if self.state == "half_open":
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "total_failures": self.total_failures,
+            "total_rejections": self.total_rejections,
+            "retry_after": max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at)) if self.state == "open" else 0.0,
+        }
+
+class RetryBudget:
+    """
+    直近の呼び出し数に対する再試行の割合を制限するグローバルな再試行予算
+    障害時に再試行が負荷を増幅しないよう、window秒内の再試行数を min_per_second * window + ratio * 呼び出し数 までに抑える
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, window: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._calls: deque = deque()
+        self._retries: deque = deque()
+
+    def record_call(self) -> None:
+        self._calls.append(time.monotonic())
+
+    def try_acquire(self) -> bool:
+        """
+        再試行が予算内であれば消費してTrueを返す
+        """
+        now = time.monotonic()
+        for timestamps in (self._calls, self._retries):
+            while timestamps and now - timestamps[0] > self.window:
+                timestamps.popleft()
+        allowed = self.min_per_second * self.window + self.ratio * len(self._calls)
+        if len(self._retries) >= allowed:
+            return False
+        self._retries.append(now)
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"calls_in_window": len(self._calls), "retries_in_window": len(self._retries)}
+
+async def call_with_resilience(
+    operation: Callable[[], Awaitable[Any]],
+    breaker: CircuitBreaker,
+    budget: RetryBudget,
+    is_retryable: Callable[[Exception], bool],
+    max_attempts: int = 3,
+    base_delay: float = 0.5,
+    max_delay: float = 8.0,
+    before_retry: Optional[Callable[[], Awaitable[None]]] = None,
+    can_retry: Optional[Callable[[Exception], bool]] = None
+) -> Any:
+    """
+    サーキットブレーカー・再試行予算・ジッター付き指数バックオフで operation を実行
+    is_retryable で障害と判定したエラーをブレーカーに数え、そのうち can_retry（既定は全て）を満たすものを再試行する
+    """
+    budget.record_call()
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = await operation()
+        except Exception as e:
+            retryable = is_retryable(e)
+            if retryable:
+                breaker.record_failure()
+            else:
+                # 4xx等はDify自体が応答しているため障害として数えない
+                breaker.record_success()
+            attempt += 1
+            if not retryable or (can_retry is not None and not can_retry(e)):
+                raise
+            if attempt >= max_attempts or not budget.try_acquire():
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+            print(f"Dify call failed ({str(e)}), retrying in {delay:.2f}s (attempt {attempt + 1}/{max_attempts})")
+            await asyncio.sleep(delay)
+            if before_retry is not None:
+                await before_retry()
+            continue
+        except BaseException:
+            # キャンセル等で結果が出なかった場合も試行呼び出しの枠を解放する
+            breaker.record_cancelled()
+            raise
+        breaker.record_success()
+        return result
+
+async def hedged(operation: Callable[[], Awaitable[Any]], delay: float) -> Any:
+    """
+    delay秒以内に完了しない場合は同じ処理をもう1本起動し、先に成功した結果を採用
+    """
+    first = asyncio.create_task(operation())
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+    except asyncio.CancelledError:
+        first.cancel()
+        raise
+    if done:
+        return first.result()
+
+    second = asyncio.create_task(operation())
+    pending = {first, second}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,72 @@
+import re
+import unicodedata
+from typing import Dict, List, Optional
+
+# 全文検索の対象列
+SEARCH_FIELDS = [
+    "chief_complaint",
+    "present_illness",
+    "diagnosis",
+    "prescription",
+    "notes",
+]
+
+# 患者IDでの絞り込みをインデックス内で行うための列（検索語の照合対象には含めない）
+PATIENT_KEY_COLUMN = "patient_key"
+INDEX_COLUMNS = SEARCH_FIELDS + [PATIENT_KEY_COLUMN]
+
+# 記号・空白・句読点を区切りとして文字の連続を取り出す
+_RUN_PATTERN = re.compile(r"[^\W_]+")
+
+def normalize_text(text: str) -> str:
+    """
+    全角英数・半角カナを揃え、英字を小文字にする（NFKC正規化）
+    """
+    return unicodedata.normalize("NFKC", text).lower()
+
+def text_runs(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return _RUN_PATTERN.findall(normalize_text(text))
+
+def bigrams(run: str) -> List[str]:
+    if len(run) < 2:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+def tokenize_for_index(text: Optional[str]) -> str:
+    """
+    日本語の単語境界に依存しないよう、文字の連続を2文字ずつずらした bi-gram の空白区切りに変換
+    「急性胃腸炎」→「急性 性胃 胃腸 腸炎」
+    """
+    return " ".join(token for run in text_runs(text) for token in bigrams(run))
+
+def patient_key(patient_id: Optional[str]) -> str:
+    return " ".join(text_runs(patient_id))
+
+def index_row(record: Dict[str, Optional[str]]) -> List[str]:
+    """
+    全文検索インデックスに登録する列の値（INDEX_COLUMNS順）
+    """
+    return [tokenize_for_index(record.get(field)) for field in SEARCH_FIELDS] + [patient_key(record.get("patient_id"))]
+
+def build_match_query(query: str, patient_id: Optional[str] = None) -> Optional[str]:
+    """
+    検索語をFTS5のMATCH式に変換（検索語がなければNone）
+    空白区切りの各語はAND条件、各語は bi-gram の連続（フレーズ）として部分一致させる
+    1文字の語はその文字で始まる bi-gram の前方一致で検索する
+    患者ID指定時は患者キー列の一致も条件に加え、該当患者の記録だけをインデックス上で絞り込む
+    """
+    phrases = []
+    for run in text_runs(query):
+        if len(run) == 1:
+            phrases.append(f'"{run}"*')
+        else:
+            phrases.append('"' + " ".join(bigrams(run)) + '"')
+    if not phrases:
+        return None
+    match = "{" + " ".join(SEARCH_FIELDS) + "} : (" + " AND ".join(phrases) + ")"
+    key = patient_key(patient_id)
+    if key:
+        match += f' AND {PATIENT_KEY_COLUMN} : "{key}"'
+    return match
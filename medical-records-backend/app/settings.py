@@ -0,0 +1,87 @@
+from typing import Literal, Mapping, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+
+from .config import config_environ
+
+DEFAULT_DIFY_API_URL = "https://api.dify.ai/v1"
+
+class DifySettings(BaseModel):
+    """
+    Difyへの接続設定（環境変数から1度だけ読み込んで検証し、リクエスト毎には参照のみ行う）
+    接続プール・タイムアウト・再試行・サーキットブレーカー等の数値は範囲を検証し、不正な値では起動に失敗する
+    """
+    model_config = ConfigDict(frozen=True, str_strip_whitespace=True)
+
+    api_url: str = DEFAULT_DIFY_API_URL
+    api_key: Optional[str] = None
+    app_id: Optional[str] = None
+
+    # 接続プール（アプリ全体で1つのクライアントを共有）
+    max_connections: int = Field(100, ge=1)
+    max_keepalive_connections: int = Field(20, ge=0)
+    keepalive_expiry: float = Field(30.0, ge=0)
+    http2: bool = True
+    connect_timeout: float = Field(5.0, gt=0)
+    read_timeout: float = Field(60.0, gt=0)
+    write_timeout: float = Field(30.0, gt=0)
+    pool_timeout: float = Field(10.0, gt=0)
+
+    # 障害対策（サーキットブレーカー・再試行予算・ヘッジリクエスト、ヘッジは0で無効）
+    breaker_failure_threshold: int = Field(5, ge=1)
+    breaker_recovery_timeout: float = Field(30.0, gt=0)
+    retry_max_attempts: int = Field(3, ge=1, le=10)
+    retry_base_delay: float = Field(0.5, ge=0)
+    retry_max_delay: float = Field(8.0, ge=0)
+    retry_budget_ratio: float = Field(0.2, ge=0, le=1)
+    retry_budget_min_per_second: float = Field(1.0, ge=0)
+    upload_hedge_delay: float = Field(0.0, ge=0)
+
+    # inline はプロンプト全文を送信、context は患者情報ブロックのみ送信
+    prompt_mode: Literal["inline", "context"] = "inline"
+
+    # 起動フックでDifyへの接続を確立してから受け付けを始める
+    warmup: bool = False
+    warmup_timeout: float = Field(5.0, gt=0)
+
+    @field_validator("api_url")
+    @classmethod
+    def validate_api_url(cls, value: str) -> str:
+        if not value.startswith(("http://", "https://")):
+            raise ValueError("DIFY_API_URL は http:// または https:// で始まるURLを指定してください")
+        return value.rstrip("/")
+
+    @field_validator("api_key", "app_id", mode="before")
+    @classmethod
+    def empty_to_none(cls, value: Optional[str]) -> Optional[str]:
+        return value or None
+
+    @model_validator(mode="after")
+    def validate_limits(self) -> "DifySettings":
+        if self.max_keepalive_connections > self.max_connections:
+            raise ValueError("DIFY_MAX_KEEPALIVE_CONNECTIONS は DIFY_MAX_CONNECTIONS 以下を指定してください")
+        if self.retry_base_delay > self.retry_max_delay:
+            raise ValueError("DIFY_RETRY_BASE_DELAY は DIFY_RETRY_MAX_DELAY 以下を指定してください")
+        return self
+
+    @property
+    def configured(self) -> bool:
+        """
+        APIキーとアプリIDが設定されているか（未設定時はモックにフォールバック）
+        """
+        return bool(self.api_key and self.app_id)
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None) -> "DifySettings":
+        """
+        DIFY_* の環境変数（フィールド名の大文字）から作成
+        environ を省略した場合は、.env ファイルの値を環境変数で上書きしたものを使う（config_environ）
+        """
+        if environ is None:
+            environ = config_environ()
+        values = {}
+        for name in cls.model_fields:
+            value = environ.get(f"DIFY_{name.upper()}")
+            if value is not None and (value.strip() or name in ("api_key", "app_id")):
+                values[name] = value
+        return cls(**values)
@@ -0,0 +1,190 @@
+import asyncio
+import random
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+# スプレッドシートの列（見出し, 医療記録フィールド）
+SHEET_COLUMNS = [
+    ("記録ID", "id"),
+    ("患者ID", "patient_id"),
+    ("診察日時", "consultation_date"),
+    ("主訴", "chief_complaint"),
+    ("現病歴", "present_illness"),
+    ("身体所見", "physical_examination"),
+    ("診断", "diagnosis"),
+    ("処方・治療", "prescription"),
+    ("生活指導・注意事項", "guidance"),
+    ("次回予約", "next_appointment"),
+    ("備考", "notes"),
+    ("作成日時", "created_at"),
+]
+
+SHEET_HEADER = [title for title, _ in SHEET_COLUMNS]
+
+def record_to_row(record: Dict[str, Any]) -> List[Any]:
+    """
+    医療記録をスプレッドシートの1行に変換
+    """
+    row = []
+    for _, field in SHEET_COLUMNS:
+        value = record.get(field)
+        row.append("" if value is None else value)
+    return row
+
+class RetryableSheetsError(Exception):
+    """
+    レート制限・一時的な障害など再試行可能なエラー
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class SheetsWriter:
+    """
+    スプレッドシート書き込み先のインターフェース
+    """
+
+    spreadsheet_url = ""
+
+    async def ensure_header(self, header: List[str]) -> None:
+        raise NotImplementedError
+
+    async def append_rows(self, rows: List[List[Any]]) -> None:
+        raise NotImplementedError
+
+class GoogleSheetsWriter(SheetsWriter):
+    """
+    Google Sheets APIのbatchUpdate（appendCells）で行を追加する書き込み先
+    """
+
+    def __init__(self, spreadsheet_id: str, sheet_name: str, credentials_file: str):
+        from google.oauth2 import service_account
+        from googleapiclient.discovery import build
+
+        credentials = service_account.Credentials.from_service_account_file(
+            credentials_file, scopes=["https://www.googleapis.com/auth/spreadsheets"]
+        )
+        self._service = build("sheets", "v4", credentials=credentials, cache_discovery=False)
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.spreadsheet_url = f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}"
+        self._sheet_id: Optional[int] = None
+
+    async def ensure_header(self, header: List[str]) -> None:
+        values = await self._call(
+            self._service.spreadsheets().values().get(spreadsheetId=self.spreadsheet_id, range=f"'{self.sheet_name}'!1:1")
+        )
+        if not values.get("values"):
+            await self.append_rows([header])
+
+    async def append_rows(self, rows: List[List[Any]]) -> None:
+        if self._sheet_id is None:
+            self._sheet_id = await self._resolve_sheet_id()
+        body = {
+            "requests": [{
+                "appendCells": {
+                    "sheetId": self._sheet_id,
+                    "fields": "userEnteredValue",
+                    "rows": [{"values": [self._cell(value) for value in row]} for row in rows],
+                }
+            }]
+        }
+        await self._call(self._service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id, body=body))
+
+    async def _resolve_sheet_id(self) -> int:
+        spreadsheet = await self._call(
+            self._service.spreadsheets().get(spreadsheetId=self.spreadsheet_id, fields="sheets.properties")
+        )
+        for sheet in spreadsheet.get("sheets", []):
+            properties = sheet["properties"]
+            if properties["title"] == self.sheet_name:
+                return properties["sheetId"]
+        raise ValueError(f"Sheet not found: {self.sheet_name}")
+
+    @staticmethod
+    def _cell(value: Any) -> Dict[str, Any]:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return {"userEnteredValue": {"numberValue": value}}
+        return {"userEnteredValue": {"stringValue": str(value)}}
+
+    @staticmethod
+    async def _call(request) -> Dict[str, Any]:
+        from googleapiclient.errors import HttpError
+
+        try:
+            return await asyncio.to_thread(request.execute, num_retries=0)
+        except HttpError as e:
+            status = getattr(e.resp, "status", None)
+            if status in (429, 500, 502, 503, 504):
+                retry_after = e.resp.get("retry-after") if hasattr(e.resp, "get") else None
+                raise RetryableSheetsError(f"Sheets API error {status}", float(retry_after) if retry_after else None)
+            raise
+
+class FakeSheetsWriter(SheetsWriter):
+    """
+    テスト用のプロセス内スプレッドシート（failures の順に書き込みを失敗させる。None の回は成功）
+    """
+
+    spreadsheet_url = "https://docs.google.com/spreadsheets/d/fake-sheet-id"
+
+    def __init__(self, failures: Optional[List[Exception]] = None):
+        self.rows: List[List[Any]] = []
+        self.calls = 0
+        self.failures = list(failures or [])
+
+    async def ensure_header(self, header: List[str]) -> None:
+        if not self.rows:
+            self.rows.append(list(header))
+
+    async def append_rows(self, rows: List[List[Any]]) -> None:
+        self.calls += 1
+        failure = self.failures.pop(0) if self.failures else None
+        if failure is not None:
+            raise failure
+        self.rows.extend(rows)
+
+class SheetsExporter:
+    """
+    医療記録をチャンク単位で行に変換し、再試行付きでスプレッドシートへ書き込む
+    """
+
+    def __init__(self, writer: SheetsWriter, chunk_size: int = 500, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 32.0):
+        self.writer = writer
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    async def export(
+        self,
+        batches: AsyncIterator[List[Dict[str, Any]]],
+        on_chunk: Optional[Callable[[Any], Awaitable[None]]] = None
+    ) -> Dict[str, Any]:
+        """
+        記録のバッチを順に書き込み、書き込み件数と最後に書き込んだ記録IDを返す
+        on_chunk はチャンクの書き込みが成功する度に最後の記録IDで呼ばれる（途中で失敗しても書き込み済みの位置を残せる）
+        """
+        await self._with_retry(self.writer.ensure_header, SHEET_HEADER)
+        exported = 0
+        last_id = None
+        async for records in batches:
+            for i in range(0, len(records), self.chunk_size):
+                chunk = records[i:i + self.chunk_size]
+                await self._with_retry(self.writer.append_rows, [record_to_row(r) for r in chunk])
+                exported += len(chunk)
+                last_id = chunk[-1].get("id", last_id)
+                if on_chunk is not None and last_id is not None:
+                    await on_chunk(last_id)
+        return {"exported_count": exported, "last_id": last_id}
+
+    async def _with_retry(self, operation, *args) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await operation(*args)
+            except RetryableSheetsError as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                delay = max(e.retry_after or 0.0, random.uniform(0, delay))
+                print(f"Sheets API rate limited or unavailable: {str(e)}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
@@ -0,0 +1,466 @@
+import asyncio
+import base64
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .search import INDEX_COLUMNS, SEARCH_FIELDS, build_match_query, index_row
+
+# 医療記録テーブルの列（id・created_at以外）
+RECORD_FIELDS = [
+    "patient_id",
+    "consultation_date",
+    "chief_complaint",
+    "present_illness",
+    "physical_examination",
+    "diagnosis",
+    "prescription",
+    "guidance",
+    "next_appointment",
+    "notes",
+    "prompt_version",
+]
+
+# 一覧取得で指定可能な並び替え列
+SORTABLE_FIELDS = ["created_at", "consultation_date"]
+
+# 既存記録を全文検索インデックスへ登録する際の1トランザクションあたりの件数
+SEARCH_INDEX_BACKFILL_BATCH = 10_000
+
+def encode_cursor(sort_value: Any, record_id: int) -> str:
+    """
+    キーセットページネーション用のカーソルを作成
+    """
+    raw = json.dumps([sort_value, record_id], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    カーソルを（並び替え値, ID）に復元（不正な場合はValueError）
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, record_id = json.loads(raw)
+        return sort_value, int(record_id)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+class RecordStore:
+    """
+    医療記録ストレージのインターフェース
+    """
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def save(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def save_many(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def get(self, record_id: int) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def get_many(self, record_ids: List[int]) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def find_by_patient(self, patient_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def query(
+        self,
+        patient_id: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        sort: str = "created_at",
+        order: str = "desc",
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = None
+    ) -> tuple:
+        raise NotImplementedError
+
+    async def search(
+        self,
+        query: str,
+        patient_id: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = None
+    ) -> tuple:
+        raise NotImplementedError
+
+    def iter_batches(self, after_id: int = 0, record_ids: Optional[List[int]] = None, batch_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        raise NotImplementedError
+
+    async def get_state(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set_state(self, key: str, value: str) -> None:
+        raise NotImplementedError
+
+    async def count(self) -> int:
+        raise NotImplementedError
+
+    async def count_matching(self, patient_id: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None) -> int:
+        raise NotImplementedError
+
+class SQLiteRecordStore(RecordStore):
+    """
+    WALモードのSQLiteに医療記録を保存するストア
+    書き込みは専用スレッドでまとめてコミットし、読み込みは別接続で並行に行う
+    """
+
+    def __init__(self, path: str, batch_size: int = 200, batch_interval: float = 0.002):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self._write_conn: Optional[sqlite3.Connection] = None
+        self._read_conn: Optional[sqlite3.Connection] = None
+        self._write_executor: Optional[ThreadPoolExecutor] = None
+        self._read_executor: Optional[ThreadPoolExecutor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._writer_task is not None:
+            return
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="records-write")
+        self._read_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="records-read")
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._write_executor, self._open_write_connection)
+        await loop.run_in_executor(self._read_executor, self._open_read_connection)
+        self._queue = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._writer())
+
+    async def close(self) -> None:
+        if self._writer_task is None:
+            return
+        await self._queue.join()
+        self._writer_task.cancel()
+        await asyncio.gather(self._writer_task, return_exceptions=True)
+        self._writer_task = None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._write_executor, self._write_conn.close)
+        await loop.run_in_executor(self._read_executor, self._read_conn.close)
+        self._write_executor.shutdown()
+        self._read_executor.shutdown()
+
+    async def save(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        return (await self.save_many([record]))[0]
+
+    async def save_many(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        複数の記録を1トランザクションで保存し、ID・作成日時付きの記録を返す
+        """
+        if not records:
+            return []
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((records, future))
+        return await future
+
+    async def get(self, record_id: int) -> Optional[Dict[str, Any]]:
+        rows = await self._read("SELECT * FROM medical_records WHERE id = ?", (record_id,))
+        return rows[0] if rows else None
+
+    async def get_many(self, record_ids: List[int]) -> List[Dict[str, Any]]:
+        if not record_ids:
+            return []
+        ids = sorted(set(record_ids))
+        rows = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(await self._read(f"SELECT * FROM medical_records WHERE id IN ({placeholders}) ORDER BY id", tuple(chunk)))
+        return rows
+
+    async def find_by_patient(self, patient_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        return await self._read(
+            "SELECT * FROM medical_records WHERE patient_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+            (patient_id, limit)
+        )
+
+    async def iter_batches(self, after_id: int = 0, record_ids: Optional[List[int]] = None, batch_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        ID順に記録をバッチ単位で読み出す（record_ids指定時はそのIDのみ）
+        """
+        if record_ids is not None:
+            ids = sorted(set(i for i in record_ids if i > after_id))
+            for i in range(0, len(ids), batch_size):
+                batch = await self.get_many(ids[i:i + batch_size])
+                if batch:
+                    yield batch
+            return
+        while True:
+            batch = await self._read(
+                "SELECT * FROM medical_records WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, batch_size)
+            )
+            if not batch:
+                return
+            yield batch
+            after_id = batch[-1]["id"]
+
+    async def get_state(self, key: str) -> Optional[str]:
+        rows = await self._read("SELECT value FROM app_state WHERE key = ?", (key,))
+        return rows[0]["value"] if rows else None
+
+    async def set_state(self, key: str, value: str) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self._write_executor,
+            self._write_conn.execute,
+            "INSERT OR REPLACE INTO app_state (key, value) VALUES (?, ?)",
+            (key, value)
+        )
+
+    async def count(self) -> int:
+        rows = await self._read("SELECT COUNT(*) AS total FROM medical_records")
+        return rows[0]["total"]
+
+    async def query(
+        self,
+        patient_id: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        sort: str = "created_at",
+        order: str = "desc",
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = None
+    ) -> tuple:
+        """
+        条件に合う記録をインデックス順に取得し、（記録一覧, 次ページのカーソル）を返す
+        date_from は以上、date_to は未満で consultation_date と比較する
+        """
+        if sort not in SORTABLE_FIELDS:
+            raise ValueError(f"unsupported sort field: {sort}")
+        if order not in ("asc", "desc"):
+            raise ValueError(f"unsupported order: {order}")
+        unknown = [f for f in fields or [] if f not in RECORD_FIELDS + ["id", "created_at"]]
+        if unknown:
+            raise ValueError(f"unsupported fields: {', '.join(unknown)}")
+
+        conditions, params = self._filter_conditions(patient_id, date_from, date_to)
+        comparison = "<" if order == "desc" else ">"
+        if cursor:
+            sort_value, record_id = decode_cursor(cursor)
+            conditions.append(f"({sort}, id) {comparison} (?, ?)")
+            params.extend([sort_value, record_id])
+
+        selected = ["id"] + [f for f in (fields or RECORD_FIELDS + ["created_at"]) if f != "id"]
+        if sort not in selected:
+            selected.append(sort)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        direction = order.upper()
+        rows = await self._read(
+            f"SELECT {', '.join(selected)} FROM medical_records {where} "
+            f"ORDER BY {sort} {direction}, id {direction} LIMIT ?",
+            tuple(params) + (limit + 1,)
+        )
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][sort], rows[-1]["id"])
+        if fields is not None and sort not in fields:
+            for row in rows:
+                del row[sort]
+        return rows, next_cursor
+
+    async def search(
+        self,
+        query: str,
+        patient_id: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = None
+    ) -> tuple:
+        """
+        全文検索インデックスで記録を検索し、新しい順（ID降順）に（記録一覧, 次ページのカーソル）を返す
+        """
+        match = build_match_query(query, patient_id)
+        if match is None:
+            raise ValueError("empty search query")
+        unknown = [f for f in fields or [] if f not in RECORD_FIELDS + ["id", "created_at"]]
+        if unknown:
+            raise ValueError(f"unsupported fields: {', '.join(unknown)}")
+
+        conditions, params = self._filter_conditions(patient_id, date_from, date_to)
+        if cursor:
+            _, record_id = decode_cursor(cursor)
+            conditions.append("f.rowid < ?")
+            params.append(record_id)
+        selected = ", ".join(f"m.{f}" for f in ["id"] + [f for f in (fields or RECORD_FIELDS + ["created_at"]) if f != "id"])
+        where = "".join(f" AND {condition}" for condition in conditions)
+        sql = (
+            f"SELECT {selected} FROM medical_records_fts f JOIN medical_records m ON m.id = f.rowid "
+            f"WHERE medical_records_fts MATCH ?{where} ORDER BY f.rowid DESC LIMIT ?"
+        )
+        rows = await self._read(sql, (match, *params, limit + 1))
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(None, rows[-1]["id"])
+        return rows, next_cursor
+
+    async def count_matching(self, patient_id: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None) -> int:
+        conditions, params = self._filter_conditions(patient_id, date_from, date_to)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = await self._read(f"SELECT COUNT(*) AS total FROM medical_records {where}", tuple(params))
+        return rows[0]["total"]
+
+    @staticmethod
+    def _filter_conditions(patient_id: Optional[str], date_from: Optional[str], date_to: Optional[str]) -> tuple:
+        conditions, params = [], []
+        if patient_id is not None:
+            conditions.append("patient_id = ?")
+            params.append(patient_id)
+        if date_from is not None:
+            conditions.append("consultation_date >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            conditions.append("consultation_date < ?")
+            params.append(date_to)
+        return conditions, params
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _open_write_connection(self) -> None:
+        self._write_conn = self._connect()
+        columns = ", ".join(f"{field} TEXT" for field in RECORD_FIELDS)
+        self._write_conn.execute(
+            f"CREATE TABLE IF NOT EXISTS medical_records ("
+            f"id INTEGER PRIMARY KEY AUTOINCREMENT, {columns}, created_at TEXT NOT NULL)"
+        )
+        existing = {row["name"] for row in self._write_conn.execute("PRAGMA table_info(medical_records)")}
+        for field in RECORD_FIELDS:
+            if field not in existing:
+                self._write_conn.execute(f"ALTER TABLE medical_records ADD COLUMN {field} TEXT")
+        self._write_conn.execute("CREATE INDEX IF NOT EXISTS idx_medical_records_patient_id ON medical_records (patient_id, created_at)")
+        self._write_conn.execute("CREATE INDEX IF NOT EXISTS idx_medical_records_consultation_date ON medical_records (consultation_date)")
+        self._write_conn.execute("CREATE INDEX IF NOT EXISTS idx_medical_records_created_at ON medical_records (created_at)")
+        self._write_conn.execute("CREATE TABLE IF NOT EXISTS app_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        # 全文検索インデックス（bi-gram化した本文と患者キーのみを保持するcontentlessなFTS5テーブル、rowidは記録ID）
+        # 1文字の検索語を前方一致で引けるよう1文字の接頭辞インデックスも作成
+        self._write_conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS medical_records_fts USING fts5({', '.join(INDEX_COLUMNS)}, content='', prefix='1')"
+        )
+        self._backfill_search_index()
+
+    def _backfill_search_index(self) -> None:
+        """
+        全文検索インデックス未登録の既存記録（インデックス導入前の記録）を登録
+        """
+        row = self._write_conn.execute("SELECT rowid FROM medical_records_fts ORDER BY rowid DESC LIMIT 1").fetchone()
+        last_id = row[0] if row is not None else 0
+        while True:
+            rows = self._write_conn.execute(
+                f"SELECT id, patient_id, {', '.join(SEARCH_FIELDS)} FROM medical_records WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, SEARCH_INDEX_BACKFILL_BATCH)
+            ).fetchall()
+            if not rows:
+                return
+            self._write_conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_conn.executemany(self._search_insert_sql(), [[row["id"]] + index_row(dict(row)) for row in rows])
+                self._write_conn.execute("COMMIT")
+            except BaseException:
+                self._write_conn.execute("ROLLBACK")
+                raise
+            last_id = rows[-1]["id"]
+
+    @staticmethod
+    def _search_insert_sql() -> str:
+        return f"INSERT INTO medical_records_fts (rowid, {', '.join(INDEX_COLUMNS)}) VALUES (?{', ?' * len(INDEX_COLUMNS)})"
+
+    def _open_read_connection(self) -> None:
+        self._read_conn = self._connect()
+
+    async def _read(self, sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, self._execute_read, sql, params)
+
+    def _execute_read(self, sql: str, params: tuple) -> List[Dict[str, Any]]:
+        return [dict(row) for row in self._read_conn.execute(sql, params)]
+
+    async def _writer(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            if self.batch_interval:
+                await asyncio.sleep(self.batch_interval)
+            pending = len(batch[0][0])
+            while pending < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                batch.append(item)
+                pending += len(item[0])
+            try:
+                try:
+                    results = await loop.run_in_executor(self._write_executor, self._insert_batch, [records for records, _ in batch])
+                except Exception as e:
+                    if len(batch) == 1:
+                        raise
+                    # まとめた保存が失敗した場合は、他の呼び出し元の保存を巻き込まないよう呼び出し元ごとに保存し直す
+                    print(f"Batched record insert failed ({str(e)}), retrying each caller separately")
+                    for records, future in batch:
+                        try:
+                            saved = (await loop.run_in_executor(self._write_executor, self._insert_batch, [records]))[0]
+                        except Exception as item_error:
+                            if not future.done():
+                                future.set_exception(item_error)
+                        else:
+                            if not future.done():
+                                future.set_result(saved)
+                else:
+                    for (_, future), saved in zip(batch, results):
+                        if not future.done():
+                            future.set_result(saved)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _insert_batch(self, batches: List[List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+        columns = ", ".join(RECORD_FIELDS + ["created_at"])
+        placeholders = ", ".join("?" * (len(RECORD_FIELDS) + 1))
+        sql = f"INSERT INTO medical_records ({columns}) VALUES ({placeholders})"
+        search_sql = self._search_insert_sql()
+        results = []
+        self._write_conn.execute("BEGIN IMMEDIATE")
+        try:
+            for records in batches:
+                saved = []
+                for record in records:
+                    row = {field: record.get(field) for field in RECORD_FIELDS}
+                    row["created_at"] = record.get("created_at") or datetime.now().isoformat()
+                    cursor = self._write_conn.execute(sql, [row[field] for field in RECORD_FIELDS] + [row["created_at"]])
+                    row["id"] = cursor.lastrowid
+                    self._write_conn.execute(search_sql, [row["id"]] + index_row(row))
+                    saved.append(row)
+                results.append(saved)
+            self._write_conn.execute("COMMIT")
+        except BaseException:
+            self._write_conn.execute("ROLLBACK")
+            raise
+        return results
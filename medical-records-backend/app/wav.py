@@ -0,0 +1,32 @@
+import wave
+
+# WAVヘッダーの判定・再生時間の取得など、numpyを使わない処理（アプリ本体はこちらのみを起動時に読み込む）
+FORMAT_EXTENSIONS = {"wav": ".wav", "flac": ".flac", "opus": ".ogg"}
+
+def is_wav_header(header: bytes) -> bool:
+    return len(header) >= 12 and header[:4] == b"RIFF" and header[8:12] == b"WAVE"
+
+def wav_byte_rate(header: bytes) -> int:
+    """
+    WAVの先頭バイト列の fmt チャンクから1秒あたりのバイト数を取得（WAVでない・fmt チャンクが含まれない場合は0）
+    """
+    if not is_wav_header(header):
+        return 0
+    offset = 12
+    while offset + 8 <= len(header):
+        chunk_id = header[offset:offset + 4]
+        size = int.from_bytes(header[offset + 4:offset + 8], "little")
+        if chunk_id == b"fmt ":
+            return int.from_bytes(header[offset + 16:offset + 20], "little") if offset + 20 <= len(header) else 0
+        offset += 8 + size + (size & 1)
+    return 0
+
+def wav_duration(source) -> float:
+    """
+    WAVヘッダーから再生時間（秒）を取得（パスまたはシーク可能なファイルオブジェクト、読めない場合は0）
+    """
+    try:
+        with wave.open(source, "rb") as wav_file:
+            return wav_file.getnframes() / wav_file.getframerate()
+    except (wave.Error, EOFError, ZeroDivisionError):
+        return 0.0
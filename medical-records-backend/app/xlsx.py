@@ -0,0 +1,168 @@
+import math
+import re
+import time
+import zipfile
+from typing import Any, BinaryIO, Iterable, List, Sequence
+
+# Excelのセルに格納できる最大文字数
+MAX_CELL_CHARS = 32767
+
+# XML 1.0で使用できない制御文字（Excelが破損ファイルとして扱うため除去する）
+_ILLEGAL_XML_CHARS = "".join(map(chr, [*range(0x00, 0x09), 0x0b, 0x0c, *range(0x0e, 0x20), 0xfffe, 0xffff]))
+_NEEDS_ESCAPE = re.compile(f"[&<>{re.escape(_ILLEGAL_XML_CHARS)}]")
+_ESCAPE_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", **dict.fromkeys(_ILLEGAL_XML_CHARS)})
+_ATTRIBUTE_ESCAPE_TABLE = str.maketrans({**_ESCAPE_TABLE, ord('"'): "&quot;"})
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+# 既定スタイル（0）と見出し用の太字（1）のみ
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+def column_letter(index: int) -> str:
+    """
+    0始まりの列番号をExcelの列名（A, B, ..., Z, AA, ...）に変換
+    """
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+def cell_text(value: Any) -> str:
+    """
+    セルに書き込む文字列（XMLエスケープ・制御文字の除去・Excelの文字数上限での切り詰め）
+    大半のセルはエスケープ不要なため、該当文字がある場合のみ変換する
+    """
+    text = value if isinstance(value, str) else str(value)
+    if len(text) > MAX_CELL_CHARS:
+        text = text[:MAX_CELL_CHARS]
+    if _NEEDS_ESCAPE.search(text) is None:
+        return text
+    return text.translate(_ESCAPE_TABLE)
+
+class StreamingXlsxWriter:
+    """
+    1シートのxlsxを一定メモリで書き出すライター
+    文字列はインライン文字列として行毎に書き出すため、共有文字列表を保持しない
+    出力先はシーク不可でもよい（zipのデータディスクリプタ方式で書き出す）
+    """
+
+    def __init__(self, fileobj: BinaryIO, sheet_name: str, header: Sequence[str], column_widths: Sequence[float] = (), compresslevel: int = 1):
+        self._zip = zipfile.ZipFile(fileobj, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+        self._columns = [column_letter(i) for i in range(len(header))]
+        self._row = 0
+        self._write_part("[Content_Types].xml", _CONTENT_TYPES)
+        self._write_part("_rels/.rels", _ROOT_RELS)
+        self._write_part("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        self._write_part("xl/styles.xml", _STYLES)
+        self._write_part("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{sheet_name.translate(_ATTRIBUTE_ESCAPE_TABLE)}" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>'
+        ))
+        # シートは行数が分からないまま書き続けるため、2GiBを超えても壊れないようZIP64で開く
+        self._sheet = self._zip.open(self._zip_info("xl/worksheets/sheet1.xml"), mode="w", force_zip64=True)
+        cols = "".join(
+            f'<col min="{i + 1}" max="{i + 1}" width="{width:g}" customWidth="1"/>' for i, width in enumerate(column_widths)
+        )
+        self._sheet.write((
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>'
+            + (f"<cols>{cols}</cols>" if cols else "")
+            + "<sheetData>"
+        ).encode("utf-8"))
+        self._write_rows([header], style=1)
+
+    @property
+    def rows_written(self) -> int:
+        """
+        書き込んだデータ行数（見出しを除く）
+        """
+        return max(0, self._row - 1)
+
+    def _zip_info(self, name: str) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        return info
+
+    def _write_part(self, name: str, content: str) -> None:
+        self._zip.writestr(self._zip_info(name), content)
+
+    def write_rows(self, rows: Iterable[Sequence[Any]]) -> None:
+        """
+        行を追記（数値は数値セル、None・空文字は空セル、それ以外は文字列セル）
+        """
+        self._write_rows(rows, style=0)
+
+    def _write_rows(self, rows: Iterable[Sequence[Any]], style: int) -> None:
+        # 1バッチ数千行×12列を書き出すため、文字列セルを先に判定し属性の書式化も最小限にする
+        style_attr = f' s="{style}"' if style else ""
+        needs_escape = _NEEDS_ESCAPE.search
+        parts: List[str] = []
+        append = parts.append
+        for values in rows:
+            self._row += 1
+            row = self._row
+            append(f'<row r="{row}">')
+            for column, value in zip(self._columns, values):
+                if type(value) is str:
+                    if not value:
+                        continue
+                    if len(value) > MAX_CELL_CHARS or needs_escape(value) is not None:
+                        value = cell_text(value)
+                    append(f'<c r="{column}{row}"{style_attr} t="inlineStr"><is><t xml:space="preserve">{value}</t></is></c>')
+                elif value is None:
+                    continue
+                elif isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+                    append(f'<c r="{column}{row}"{style_attr}><v>{value}</v></c>')
+                else:
+                    append(f'<c r="{column}{row}"{style_attr} t="inlineStr"><is><t xml:space="preserve">{cell_text(value)}</t></is></c>')
+            append("</row>")
+        self._sheet.write("".join(parts).encode("utf-8"))
+
+    def close(self) -> None:
+        """
+        シートを閉じてzipの中央ディレクトリを書き出す
+        """
+        self._sheet.write(b"</sheetData></worksheet>")
+        self._sheet.close()
+        self._zip.close()
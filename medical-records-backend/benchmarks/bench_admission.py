@@ -0,0 +1,146 @@
+"""
+受け付け制御の負荷試験
+APIとDifyスタブを同一プロセス内で起動し、1つのクリニックが大量に、他のクリニックが少数ずつ
+/api/process-audio に同時に送信したときの結果を、受け付け制御なし・ありで比較する
+クリニック毎の成功・429・503の件数、成功したリクエストのレイテンシ、アプリ内で同時に処理したリクエスト数とDifyへの同時実行数の最大値を出力する
+
+実行: python -m benchmarks.bench_admission [--noisy-requests 40] [--quiet-clinics 2] [--quiet-requests 5]
+      [--max-concurrency 4] [--queue-size 16] [--queue-timeout 10] [--rate-per-minute 6] [--burst 10]
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from app import main
+from benchmarks.bench_dify_client import percentile
+from benchmarks.bench_e2e import configured_app, write_wav_fixtures
+from benchmarks.dify_stub import create_stub_app, run_stub_server
+
+ADMISSION_SETTINGS = ("max_concurrency", "queue_size", "queue_timeout", "rate_per_minute", "burst")
+
+@contextmanager
+def configured_admission(**settings):
+    """
+    受け付け制御の設定を一時的に変更し、終了後に元へ戻す
+    """
+    controller = main.admission_controller
+    saved = {name: getattr(controller, name) for name in ADMISSION_SETTINGS}
+    for name, value in settings.items():
+        setattr(controller, name, value)
+    try:
+        yield controller
+    finally:
+        for name, value in saved.items():
+            setattr(controller, name, value)
+
+async def run_burst(client: httpx.AsyncClient, audio: bytes, mode: str, args) -> dict:
+    """
+    全クリニックのリクエストを同時に送信し、クリニック毎の結果を集計
+    """
+    clinics = [("noisy", args.noisy_requests)] + [(f"quiet-{n}", args.quiet_requests) for n in range(args.quiet_clinics)]
+    results = {name: {"200": 0, "429": 0, "503": 0, "other": 0, "latencies": [], "missing_retry_after": 0} for name, _ in clinics}
+
+    async def one(clinic: str, i: int):
+        start = time.perf_counter()
+        response = await client.post(
+            "/api/process-audio",
+            headers={"X-Clinic-ID": f"{mode}-{clinic}"},
+            files={"audio_file": (f"{clinic}_{i}.wav", audio, "audio/wav")},
+            data={"patient_id": f"{clinic}-{i}"}
+        )
+        result = results[clinic]
+        status = str(response.status_code)
+        result[status if status in result else "other"] += 1
+        if response.status_code == 200:
+            result["latencies"].append(time.perf_counter() - start)
+        elif response.status_code in (429, 503) and "retry-after" not in response.headers:
+            result["missing_retry_after"] += 1
+
+    # 各クリニックのリクエストを交互に並べ、同時に到着させる
+    requests = [(clinic, i) for i in range(max(count for _, count in clinics)) for clinic, count in clinics if i < count]
+    await asyncio.gather(*(one(clinic, i) for clinic, i in requests))
+    return results
+
+async def sample_active(controller, peak: dict, interval: float = 0.005) -> None:
+    """
+    アプリ内で処理中のリクエスト数（音声の受信・一時ファイル・前処理を伴う）の最大値を記録
+    APIサーバーは別スレッドのイベントループで動くため、一定間隔で読み取る
+    """
+    while True:
+        peak["active"] = max(peak["active"], controller.active)
+        await asyncio.sleep(interval)
+
+async def run_suite(args) -> dict:
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        audio_path = next(iter(write_wav_fixtures(directory, [args.duration]).values()))
+        with open(audio_path, "rb") as f:
+            audio = f.read()
+        stub = create_stub_app(latency=args.workflow_latency, upload_latency=args.upload_latency)
+        with run_stub_server(app=stub) as stub_url, configured_app(directory, stub_url, args), run_stub_server(app=main.app) as api_url:
+            timeout = httpx.Timeout(300.0)
+            limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+            async with httpx.AsyncClient(base_url=api_url, timeout=timeout, limits=limits) as client:
+                modes = {
+                    "disabled": dict(max_concurrency=0, rate_per_minute=0),
+                    "enabled": dict(
+                        max_concurrency=args.max_concurrency, queue_size=args.queue_size, queue_timeout=args.queue_timeout,
+                        rate_per_minute=args.rate_per_minute, burst=args.burst
+                    ),
+                }
+                for mode, settings in modes.items():
+                    with configured_admission(**settings) as controller:
+                        stub.state.max_in_flight = 0
+                        peak = {"active": 0}
+                        sampler = asyncio.create_task(sample_active(controller, peak))
+                        start = time.perf_counter()
+                        clinics = await run_burst(client, audio, mode, args)
+                        elapsed = time.perf_counter() - start
+                        sampler.cancel()
+                        report[mode] = {
+                            "clinics": clinics,
+                            "elapsed": elapsed,
+                            "max_in_flight": peak["active"],
+                            "dify_max_in_flight": stub.state.max_in_flight,
+                            "admission": controller.snapshot(),
+                        }
+    return report
+
+def print_report(report: dict) -> None:
+    print(f"{'mode':<9} {'clinic':<8} {'200':>5} {'429':>5} {'503':>5} {'p50 ms':>9} {'p99 ms':>9}")
+    for mode, result in report.items():
+        for clinic, counts in result["clinics"].items():
+            latencies = counts["latencies"]
+            p50 = percentile(latencies, 50) * 1000 if latencies else 0
+            p99 = percentile(latencies, 99) * 1000 if latencies else 0
+            print(f"{mode:<9} {clinic:<8} {counts['200']:5d} {counts['429']:5d} {counts['503']:5d} {p50:9.1f} {p99:9.1f}")
+        print(f"{mode:<9} elapsed {result['elapsed']:.2f}s, max in-flight {result['max_in_flight']}, Dify max in-flight {result['dify_max_in_flight']}")
+
+def main_(args) -> dict:
+    report = asyncio.run(run_suite(args))
+    print_report(report)
+    return report
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--noisy-requests", type=int, default=40, help="大量に送信するクリニックのリクエスト数")
+    parser.add_argument("--quiet-clinics", type=int, default=2, help="少数ずつ送信するクリニック数")
+    parser.add_argument("--quiet-requests", type=int, default=5, help="少数ずつ送信するクリニック毎のリクエスト数")
+    parser.add_argument("--duration", type=float, default=30, help="送信するWAVの長さ（秒）")
+    parser.add_argument("--upload-latency", type=float, default=0.05, help="スタブの /files/upload の応答遅延（秒）")
+    parser.add_argument("--workflow-latency", type=float, default=0.5, help="スタブの /workflows/run の応答遅延（秒）")
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=16)
+    parser.add_argument("--queue-timeout", type=float, default=10)
+    parser.add_argument("--rate-per-minute", type=float, default=6)
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--cache", action="store_true", help="音声キャッシュを有効にする")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    main_(parse_args())
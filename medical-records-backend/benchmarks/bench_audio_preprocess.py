@@ -0,0 +1,69 @@
+"""
+音声前処理（モノラル化・16kHzリサンプリング・無音除去）のベンチマーク
+合成した44.1kHz WAVをそのままアップロードする場合と前処理後にアップロードする場合で、
+アップロードバイト数・前処理時間・想定回線速度での所要時間を比較する
+
+実行: python -m benchmarks.bench_audio_preprocess [--minutes 1,5,15] [--channels 2] [--format wav] [--uplink-mbps 20]
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from app import main
+from app.audio import synthesize_wav
+from app.settings import DifySettings
+from benchmarks.dify_stub import create_stub_app, run_stub_server
+
+async def upload(audio_path: str, api_url: str, stub, preprocess: bool) -> tuple:
+    main.AUDIO_PREPROCESS_ENABLED = preprocess
+    stub.state.upload_bytes = 0
+    start = time.perf_counter()
+    await main.get_or_upload_file_id(audio_path, None, "bench", api_url)
+    return time.perf_counter() - start, stub.state.upload_bytes
+
+async def amain(args) -> None:
+    main.AUDIO_PREPROCESS_FORMAT = args.format
+    main.dify_settings = DifySettings(http2=False)
+    stub = create_stub_app(args.latency)
+    uplink = args.uplink_mbps * 1_000_000 / 8
+
+    with run_stub_server(app=stub) as api_url, tempfile.TemporaryDirectory() as directory:
+        # プロセスプールの起動コストを計測から除外
+        warmup_path = os.path.join(directory, "warmup.wav")
+        with open(warmup_path, "wb") as f:
+            f.write(synthesize_wav(1.0))
+        await upload(warmup_path, api_url, stub, preprocess=True)
+
+        print(f"{'minutes':>7} {'raw MiB':>9} {'pre MiB':>9} {'ratio':>6} {'local raw':>10} {'local pre':>10} "
+              f"{'e2e raw@' + str(args.uplink_mbps) + 'Mbps':>16} {'e2e pre':>9} {'saved':>8}")
+        for minutes in (float(m) for m in args.minutes.split(",")):
+            audio_path = os.path.join(directory, f"audio_{minutes}.wav")
+            with open(audio_path, "wb") as f:
+                f.write(synthesize_wav(minutes * 60, sample_rate=args.sample_rate, channels=args.channels,
+                                       leading_silence=args.silence, trailing_silence=args.silence))
+
+            raw_time, raw_bytes = await upload(audio_path, api_url, stub, preprocess=False)
+            pre_time, pre_bytes = await upload(audio_path, api_url, stub, preprocess=True)
+            # ローカルのスタブには帯域制限がないため、回線速度分の転送時間を加算して見積もる
+            raw_e2e = raw_time + raw_bytes / uplink
+            pre_e2e = pre_time + pre_bytes / uplink
+            print(f"{minutes:7.1f} {raw_bytes / 1024 / 1024:9.1f} {pre_bytes / 1024 / 1024:9.1f} {raw_bytes / pre_bytes:6.1f} "
+                  f"{raw_time:9.2f}s {pre_time:9.2f}s {raw_e2e:15.2f}s {pre_e2e:8.2f}s {raw_e2e - pre_e2e:7.2f}s")
+            os.unlink(audio_path)
+
+        await main.get_dify_client().aclose()
+    main.audio_preprocess_pool.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", default="1,5,15")
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--silence", type=float, default=5.0, help="先頭・末尾に付与する無音（秒）")
+    parser.add_argument("--format", default="wav", choices=["wav", "flac", "opus"])
+    parser.add_argument("--uplink-mbps", type=float, default=20.0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    asyncio.run(amain(parser.parse_args()))
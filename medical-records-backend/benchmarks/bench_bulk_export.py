@@ -0,0 +1,59 @@
+"""
+医療記録一括エクスポートのベンチマーク
+合成記録（既定1M件）をCSV・NDJSON・Parquet・xlsxで逐次出力し、所要時間・出力サイズ・ピークメモリを計測する
+
+実行: python -m benchmarks.bench_bulk_export [--records 1000000] [--formats csv,ndjson,parquet,xlsx]
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+
+from app.export import EXPORT_STREAMERS, iter_export_batches
+from app.storage import SQLiteRecordStore
+from benchmarks.bench_record_store import synthetic_record
+
+async def seed(store: SQLiteRecordStore, total: int) -> None:
+    saved = 0
+    while saved < total:
+        batch = [synthetic_record(saved + i) for i in range(min(10_000, total - saved))]
+        await store.save_many(batch)
+        saved += len(batch)
+
+async def run_export(store: SQLiteRecordStore, format: str, trace_memory: bool) -> tuple:
+    if trace_memory:
+        tracemalloc.start()
+    size = 0
+    start = time.perf_counter()
+    async for chunk in EXPORT_STREAMERS[format](iter_export_batches(store, batch_size=1000)):
+        size += len(chunk)
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, size, peak
+
+async def amain(args) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteRecordStore(os.path.join(directory, "records.sqlite3"))
+        await store.start()
+        start = time.perf_counter()
+        await seed(store, args.records)
+        print(f"seeded {args.records} records in {time.perf_counter() - start:.1f}s")
+
+        for format in args.formats.split(","):
+            elapsed, size, _ = await run_export(store, format, trace_memory=False)
+            _, _, peak = await run_export(store, format, trace_memory=True)
+            print(f"{format:<8} {elapsed:7.2f}s  {args.records / elapsed:9.0f} rows/s  "
+                  f"{size / 1024 / 1024:8.1f}MiB  peak_python_mem={peak / 1024 / 1024:6.1f}MiB")
+        await store.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--formats", default="csv,ndjson,parquet,xlsx")
+    asyncio.run(amain(parser.parse_args()))
@@ -0,0 +1,94 @@
+"""
+Dify呼び出しのレイテンシ比較ベンチマーク
+リクエスト毎にクライアントを作成する方式（旧実装）と共有クライアントをp50/p99で比較する
+
+実行: python -m benchmarks.bench_dify_client [--requests 200] [--concurrency 20] [--latency 0.01]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+
+from app import main
+from app.settings import DifySettings
+from benchmarks.dify_stub import run_stub_server
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def per_request_client_flow(audio_path: str, api_url: str) -> None:
+    """
+    旧実装と同じくアップロード・ワークフロー毎にクライアントを作成
+    """
+    async with httpx.AsyncClient() as client:
+        with open(audio_path, 'rb') as f:
+            response = await client.post(
+                f"{api_url}/files/upload",
+                headers={'Authorization': 'Bearer bench'},
+                files={'file': ('audio.wav', f, 'audio/wav')},
+                data={'user': 'medical-system'}
+            )
+        file_id = response.json()['id']
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        await client.post(
+            f"{api_url}/workflows/run",
+            headers={'Authorization': 'Bearer bench'},
+            json={"inputs": {"audio_file_id": file_id, "prompt": "bench"}, "response_mode": "blocking", "user": "medical-system"}
+        )
+
+async def shared_client_flow(audio_path: str, api_url: str) -> None:
+    file_id = await main.upload_file_to_dify(audio_path, "bench", api_url)
+    await main.send_workflow_to_dify("bench", file_id, "bench", api_url, "bench")
+
+async def run(flow, audio_path: str, api_url: str, total: int, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await flow(audio_path, api_url)
+            samples.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one() for _ in range(total)))
+    return samples
+
+def report(label: str, samples: list) -> None:
+    print(f"{label:<24} p50={percentile(samples, 50) * 1000:8.2f}ms  "
+          f"p99={percentile(samples, 99) * 1000:8.2f}ms  mean={statistics.mean(samples) * 1000:8.2f}ms")
+
+async def amain(args) -> None:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
+        f.write(os.urandom(args.size))
+        audio_path = f.name
+    try:
+        with run_stub_server(args.latency) as api_url:
+            await run(per_request_client_flow, audio_path, api_url, args.concurrency, args.concurrency)
+            before = await run(per_request_client_flow, audio_path, api_url, args.requests, args.concurrency)
+            await run(shared_client_flow, audio_path, api_url, args.concurrency, args.concurrency)
+            after = await run(shared_client_flow, audio_path, api_url, args.requests, args.concurrency)
+            await main.get_dify_client().aclose()
+    finally:
+        os.unlink(audio_path)
+
+    print(f"requests={args.requests} concurrency={args.concurrency} stub_latency={args.latency}s size={args.size}B")
+    report("before (client/request)", before)
+    report("after (shared pool)", after)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--size", type=int, default=64 * 1024)
+    args = parser.parse_args()
+    # ローカルスタブは平文HTTP/1.1のため、プール効果のみを比較する
+    main.dify_settings = DifySettings(http2=False)
+    asyncio.run(amain(args))
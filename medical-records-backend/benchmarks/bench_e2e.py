@@ -0,0 +1,314 @@
+"""
+エンドツーエンドの負荷試験・ベンチマーク
+APIとDifyスタブ（/files/upload・/workflows/run のレイテンシを指定可能）を同一プロセス内で起動し、
+ベクトル演算で生成した長さの異なるWAVを使ってエンドポイント毎に同時リクエストをかけ、
+スループット・p50/p95/p99レイテンシ・ピークRSSを出力する
+--output で結果をJSONに保存し、--baseline で前回結果と比較して性能劣化を検出できる
+
+実行: python -m benchmarks.bench_e2e [--requests 50] [--concurrency 10] [--durations 5,30,120]
+      [--upload-latency 0.05] [--workflow-latency 0.2] [--output results.json] [--baseline results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import httpx
+
+from app import main
+from app.audio import synthesize_wav
+from app.settings import DifySettings
+from benchmarks.bench_dify_client import percentile
+from benchmarks.dify_stub import create_stub_app, run_stub_server
+
+SEARCH_TERMS = ["腹痛", "胃腸炎", "整腸剤", "下痢"]
+
+def write_wav_fixtures(directory: str, durations: list, sample_rate: int = 44100) -> dict:
+    """
+    指定した長さ（秒）のWAVをベクトル演算で生成して保存し、{ラベル: パス} を返す
+    """
+    fixtures = {}
+    for index, seconds in enumerate(durations):
+        path = os.path.join(directory, f"fixture_{seconds:g}s.wav")
+        with open(path, "wb") as f:
+            f.write(synthesize_wav(seconds, sample_rate=sample_rate, leading_silence=0.5, trailing_silence=0.5, seed=index))
+        fixtures[f"{seconds:g}s"] = path
+    return fixtures
+
+def current_rss() -> int:
+    """
+    現在のRSS（バイト）。/proc がない環境ではプロセス開始以降のピークRSSで代用
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+class RSSSampler:
+    """
+    計測区間中のRSSを別スレッドで一定間隔ごとに記録し、ピーク値を保持する
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+async def run_scenario(name: str, request, total: int, concurrency: int) -> dict:
+    """
+    request(i) を同時実行数concurrencyでtotal回実行し、スループット・レイテンシ・ピークRSSを返す
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = []
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await request(i)
+            except Exception as e:
+                errors.append(repr(e))
+                return
+            latencies.append(time.perf_counter() - start)
+
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+    if errors:
+        print(f"  {name}: {len(errors)} errors (first: {errors[0]})")
+    return {
+        "endpoint": name,
+        "requests": total,
+        "errors": len(errors),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        "peak_rss_mb": round(rss.peak / 1024 / 1024, 1),
+    }
+
+def sample_record(i: int) -> dict:
+    return {
+        "patient_id": f"P-{i % 500:05d}",
+        "consultation_date": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d} 10:00",
+        "chief_complaint": "腹痛、下痢症状",
+        "present_illness": "3日前から腹痛と下痢が続いている",
+        "physical_examination": "腹部：軽度圧痛あり",
+        "diagnosis": "急性胃腸炎の疑い",
+        "prescription": "整腸剤",
+        "guidance": "水分補給を指導",
+    }
+
+def build_scenarios(client: httpx.AsyncClient, fixtures: dict, args) -> list:
+    """
+    （エンドポイント名, リクエスト関数）の一覧
+    """
+    audio = {label: open(path, "rb").read() for label, path in fixtures.items()}
+
+    def upload(label: str, i: int) -> dict:
+        return {"audio_file": (f"{label}_{i}.wav", audio[label], "audio/wav")}
+
+    def patient(i: int) -> dict:
+        return {"patient_id": f"P-{i:05d}", "patient_name": f"患者{i}", "patient_age": "45", "patient_gender": "男性"}
+
+    def process_audio(label: str):
+        async def request(i: int):
+            response = await client.post("/api/process-audio", files=upload(label, i), data=patient(i))
+            response.raise_for_status()
+        return request
+
+    def process_audio_stream(label: str):
+        async def request(i: int):
+            async with client.stream("POST", "/api/process-audio/stream", files=upload(label, i), data=patient(i)) as response:
+                response.raise_for_status()
+                async for _ in response.aiter_bytes():
+                    pass
+        return request
+
+    def process_audio_job(label: str):
+        async def request(i: int):
+            response = await client.post("/api/process-audio", params={"mode": "job"}, files=upload(label, i), data=patient(i))
+            response.raise_for_status()
+            job_id = response.json()["job_id"]
+            while True:
+                status = (await client.get(f"/api/jobs/{job_id}")).json()["status"]
+                if status == "succeeded":
+                    return
+                if status == "failed":
+                    raise RuntimeError(f"job {job_id} failed")
+                await asyncio.sleep(args.poll_interval)
+        return request
+
+    async def process_audio_batch(i: int):
+        label = next(iter(audio))
+        files = [("audio_files", (f"{label}_{i}_{n}.wav", audio[label], "audio/wav")) for n in range(args.batch_size)]
+        async with client.stream("POST", "/api/process-audio/batch", files=files) as response:
+            response.raise_for_status()
+            async for _ in response.aiter_lines():
+                pass
+
+    async def save_record(i: int):
+        (await client.post("/api/save-record", json=sample_record(i))).raise_for_status()
+
+    async def list_records(i: int):
+        (await client.get("/api/records", params={"limit": 50})).raise_for_status()
+
+    async def search_records(i: int):
+        (await client.get("/api/records/search", params={"q": SEARCH_TERMS[i % len(SEARCH_TERMS)], "limit": 50})).raise_for_status()
+
+    scenarios = []
+    for label in audio:
+        scenarios.append((f"POST /api/process-audio [{label}]", process_audio(label)))
+    first = next(iter(audio))
+    scenarios += [
+        (f"POST /api/process-audio/stream [{first}]", process_audio_stream(first)),
+        (f"POST /api/process-audio?mode=job [{first}]", process_audio_job(first)),
+        (f"POST /api/process-audio/batch [{args.batch_size}x{first}]", process_audio_batch),
+        ("POST /api/save-record", save_record),
+        ("GET /api/records", list_records),
+        ("GET /api/records/search", search_records),
+    ]
+    return scenarios
+
+@contextmanager
+def configured_app(directory: str, stub_url: str, args):
+    """
+    一時ディレクトリの記録DBとDifyスタブを使うようアプリを設定し（既定では同一音声のキャッシュを無効化）、終了後に元へ戻す
+    """
+    saved_store, saved_cache, saved_settings = main.record_store, main.audio_cache, main.dify_settings
+    main.record_store = main.SQLiteRecordStore(os.path.join(directory, "records.sqlite3"))
+    if not args.cache:
+        main.audio_cache = None
+    # ローカルスタブは平文HTTP/1.1のため HTTP/2 は使わない
+    main.dify_settings = DifySettings(api_url=stub_url, api_key="bench", app_id="bench", http2=False)
+    try:
+        yield
+    finally:
+        main.record_store, main.audio_cache, main.dify_settings = saved_store, saved_cache, saved_settings
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare_with_baseline(results: list, baseline_path: str, max_regression: float) -> list:
+    """
+    前回結果と比較し、p95レイテンシの増加またはスループットの低下がmax_regressionを超えたエンドポイントを返す
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {result["endpoint"]: result for result in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["endpoint"])
+        if previous is None or not previous["p95_ms"] or not result["p95_ms"]:
+            continue
+        p95_change = result["p95_ms"] / previous["p95_ms"] - 1
+        throughput_change = result["throughput_rps"] / previous["throughput_rps"] - 1 if previous["throughput_rps"] else 0.0
+        print(f"  {result['endpoint']:<48} p95 {p95_change:+7.1%}  throughput {throughput_change:+7.1%}")
+        if p95_change > max_regression or throughput_change < -max_regression:
+            regressions.append(result["endpoint"])
+    return regressions
+
+async def run_suite(args) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        durations = [float(d) for d in args.durations.split(",")]
+        fixtures = write_wav_fixtures(directory, durations)
+        stub = create_stub_app(latency=args.workflow_latency, upload_latency=args.upload_latency)
+        with run_stub_server(app=stub) as stub_url, configured_app(directory, stub_url, args), run_stub_server(app=main.app) as api_url:
+            timeout = httpx.Timeout(120.0)
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=api_url, timeout=timeout, limits=limits) as client:
+                results = []
+                for name, request in build_scenarios(client, fixtures, args):
+                    if args.only and args.only not in name:
+                        continue
+                    # 接続確立・プロセスプール起動を除くため同時実行数分を先に実行して捨てる
+                    await run_scenario(name, request, min(args.concurrency, args.requests), args.concurrency)
+                    results.append(await run_scenario(name, request, args.requests, args.concurrency))
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "parameters": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "durations": args.durations,
+            "upload_latency": args.upload_latency,
+            "workflow_latency": args.workflow_latency,
+            "batch_size": args.batch_size,
+            "cache": args.cache,
+        },
+        "results": results,
+    }
+
+def print_report(report: dict) -> None:
+    print(f"revision={report['revision']} cpu_count={report['cpu_count']} " + " ".join(f"{k}={v}" for k, v in report["parameters"].items()))
+    print(f"{'endpoint':<48} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'RSS MB':>8} {'errors':>6}")
+    for r in report["results"]:
+        print(f"{r['endpoint']:<48} {r['throughput_rps']:8.1f} {r['p50_ms'] or 0:9.1f} {r['p95_ms'] or 0:9.1f} "
+              f"{r['p99_ms'] or 0:9.1f} {r['peak_rss_mb']:8.1f} {r['errors']:6d}")
+
+def main_(args) -> int:
+    report = asyncio.run(run_suite(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        print(f"baseline: {args.baseline}")
+        regressions = compare_with_baseline(report["results"], args.baseline, args.max_regression)
+        if regressions:
+            print(f"regressions over {args.max_regression:.0%}: {', '.join(regressions)}")
+            return 1
+    return 1 if any(r["errors"] for r in report["results"]) else 0
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50, help="エンドポイント毎のリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--durations", default="5,30,120", help="WAVフィクスチャの長さ（秒、カンマ区切り）")
+    parser.add_argument("--upload-latency", type=float, default=0.05, help="スタブの /files/upload の応答遅延（秒）")
+    parser.add_argument("--workflow-latency", type=float, default=0.2, help="スタブの /workflows/run の応答遅延（秒）")
+    parser.add_argument("--batch-size", type=int, default=5, help="一括処理1回あたりの音声数")
+    parser.add_argument("--poll-interval", type=float, default=0.02, help="ジョブ状態のポーリング間隔（秒）")
+    parser.add_argument("--cache", action="store_true", help="音声キャッシュを有効にする")
+    parser.add_argument("--only", default=None, help="エンドポイント名にこの文字列を含むシナリオのみ実行")
+    parser.add_argument("--output", default=None, help="結果を保存するJSONファイル")
+    parser.add_argument("--baseline", default=None, help="比較対象の前回結果JSONファイル")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="許容する性能劣化の割合")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    sys.exit(main_(parse_args()))
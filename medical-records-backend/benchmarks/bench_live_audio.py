@@ -0,0 +1,68 @@
+"""
+ライブ録音（WebSocket）の録音終了から医療記録が返るまでの時間のベンチマーク
+録音をチャンク単位で送信し、先行アップロードあり・なしで stop 送信から result 受信までの時間を比較する
+Difyスタブは帯域制限付きでアップロードを受信する（録音後にまとめて送ると転送時間がそのまま待ち時間になる）
+
+実行: python -m benchmarks.bench_live_audio [--recording-seconds 300] [--bitrate-kbps 128] [--bandwidth-kbps 4000]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from fastapi.testclient import TestClient
+
+from app import main
+from benchmarks.bench_dify_client import percentile
+from benchmarks.bench_e2e import configured_app
+from benchmarks.dify_stub import create_stub_app, run_stub_server
+
+def record_once(client: TestClient, audio: bytes, chunk_size: int, chunk_interval: float, early_upload: bool) -> dict:
+    """
+    録音1件を送信し、stop から result までの時間（秒）と結果を返す
+    """
+    with client.websocket_connect("/api/process-audio/live") as ws:
+        ws.send_json({"type": "start", "patient_id": "P-BENCH", "filename": "recording.webm", "content_type": "audio/webm", "early_upload": early_upload})
+        ws.receive_json()
+        for offset in range(0, len(audio), chunk_size):
+            ws.send_bytes(audio[offset:offset + chunk_size])
+            ws.receive_json()
+            time.sleep(chunk_interval)
+        stopped_at = time.perf_counter()
+        ws.send_json({"type": "stop"})
+        result = ws.receive_json()
+    return {"seconds": time.perf_counter() - stopped_at, "result": result}
+
+def main_(args) -> None:
+    bytes_per_second = args.bitrate_kbps * 1000 // 8
+    audio = os.urandom(int(args.recording_seconds * bytes_per_second))
+    chunk_size = int(args.chunk_seconds * bytes_per_second)
+    # 実時間の録音を --speedup 倍速で再現する
+    chunk_interval = args.chunk_seconds / args.speedup
+
+    stub = create_stub_app(latency=args.workflow_latency)
+    stub.state.upload_bandwidth = args.bandwidth_kbps * 1000 / 8
+    print(f"recording {args.recording_seconds:.0f}s ({len(audio) / 1e6:.1f}MB), upload bandwidth {args.bandwidth_kbps}kbps, workflow {args.workflow_latency}s")
+    print(f"{'mode':<14} {'p50':>8} {'p95':>8} {'max':>8}")
+    with tempfile.TemporaryDirectory() as directory, run_stub_server(app=stub) as stub_url:
+        with configured_app(directory, stub_url, argparse.Namespace(cache=False)), TestClient(main.app) as client:
+            for early_upload in (False, True):
+                timings = []
+                for _ in range(args.repeat):
+                    run = record_once(client, audio, chunk_size, chunk_interval, early_upload)
+                    assert run["result"]["type"] == "result" and run["result"]["early_upload"] is early_upload, run["result"]
+                    timings.append(run["seconds"])
+                name = "early upload" if early_upload else "after stop"
+                print(f"{name:<14} {percentile(timings, 50):7.2f}s {percentile(timings, 95):7.2f}s {max(timings):7.2f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recording-seconds", type=float, default=300.0)
+    parser.add_argument("--bitrate-kbps", type=int, default=128)
+    parser.add_argument("--chunk-seconds", type=float, default=1.0)
+    parser.add_argument("--speedup", type=float, default=20.0)
+    parser.add_argument("--bandwidth-kbps", type=int, default=4000)
+    parser.add_argument("--workflow-latency", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    main_(parser.parse_args())
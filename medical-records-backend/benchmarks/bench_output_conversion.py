@@ -0,0 +1,100 @@
+"""
+Difyの出力から医療記録への変換のベンチマーク
+構造化出力（SOAP形式・医療記録形式）・見出し付きテキスト・見出しのないテキストを混ぜた出力について、
+1件ずつの変換（convert）とまとめて検証する変換（convert_many）のスループットと、生成される記録のサイズを比較する
+記録サイズは旧実装（テキスト出力時に応答全体を str() で備考に保存）と比較する
+
+実行: python -m benchmarks.bench_output_conversion [--outputs 20000] [--repeat 3]
+"""
+
+import argparse
+import time
+from datetime import datetime
+
+import orjson
+
+from app.record_output import RecordOutputConverter
+
+def sample_outputs(count: int) -> list:
+    """
+    実運用で見られる形の出力を順に混ぜて count 件作る
+    """
+    shapes = [
+        lambda i: {"structured_output": {
+            "subjective": f"{i % 7 + 1}日前から腹痛と下痢が続いている。食欲不振もあり。",
+            "objective": "腹部：軽度圧痛あり、腸音亢進",
+            "assessment": "急性胃腸炎の疑い",
+            "plan": ["整腸剤、止痢剤を処方", "水分補給を指導"],
+        }},
+        lambda i: {"text": "```json\n" + orjson.dumps({
+            "patient_id": f"P-{i:05d}",
+            "chief_complaint": "胸やけ",
+            "present_illness": "食後の胸やけが2週間続く",
+            "diagnosis": "逆流性食道炎",
+            "prescription": "PPIを処方",
+            "next_appointment": "2週間後",
+        }).decode() + "\n```"},
+        lambda i: {"text": "【主訴】\n頭痛\n【現病歴】\n昨日から頭痛あり\n【診断】緊張型頭痛\n処方：鎮痛剤\n次回予約：必要時"},
+        lambda i: {"text": "患者は3日前から咳嗽と発熱を訴えている。" * 40},
+    ]
+    return [shapes[i % len(shapes)](i) for i in range(count)]
+
+def legacy_convert(output: dict) -> dict:
+    """
+    旧実装（structured_output の各項目をそのまま写し、それ以外は応答全体を文字列化して備考へ）
+    """
+    now = datetime.now().strftime("%Y-%m-%d %H:%M")
+    if "structured_output" in output:
+        data = output["structured_output"]
+        return {
+            "patient_id": "AUTO-GENERATED", "consultation_date": now,
+            "chief_complaint": data.get("subjective", "主訴を確認してください"),
+            "present_illness": data.get("subjective", "現病歴を確認してください"),
+            "physical_examination": data.get("objective", "身体所見を確認してください"),
+            "diagnosis": data.get("assessment", "診断を確認してください"),
+            "prescription": data.get("plan", "処方内容を確認してください"),
+            "guidance": data.get("plan", "指導内容を確認してください"),
+            "next_appointment": "次回予約を確認してください",
+            "notes": "Dify AI処理完了 - 構造化データから生成",
+        }
+    text = str({"workflow_run_id": "00000000-0000-0000-0000-000000000000", "data": {"status": "succeeded", "outputs": output}})
+    return {
+        "patient_id": "AUTO-GENERATED", "consultation_date": now,
+        "chief_complaint": "音声から抽出された主訴", "present_illness": text[:200],
+        "physical_examination": "診察所見を確認してください", "diagnosis": "診断を確認してください",
+        "prescription": "処方内容を確認してください", "guidance": "指導内容を確認してください",
+        "next_appointment": "次回予約を確認してください", "notes": f"Dify処理結果: {text}",
+    }
+
+def measure(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main_(args) -> None:
+    converter = RecordOutputConverter()
+    outputs = sample_outputs(args.outputs)
+
+    timings = {
+        "legacy": measure(lambda: [legacy_convert(output) for output in outputs], args.repeat),
+        "convert": measure(lambda: [converter.convert(output) for output in outputs], args.repeat),
+        "convert_many": measure(lambda: converter.convert_many(outputs), args.repeat),
+    }
+    print(f"{'method':<14} {'outputs/s':>12} {'us/output':>10}")
+    for name, elapsed in timings.items():
+        print(f"{name:<14} {len(outputs) / elapsed:12.0f} {elapsed / len(outputs) * 1_000_000:10.1f}")
+
+    legacy_sizes = [len(orjson.dumps(legacy_convert(output))) for output in outputs[:4]]
+    current_sizes = [len(orjson.dumps(record)) for record in converter.convert_many(outputs[:4])]
+    print(f"{'shape':<22} {'legacy bytes':>12} {'current bytes':>14}")
+    for shape, legacy, current in zip(["structured (SOAP)", "JSON in text", "labeled text", "free text"], legacy_sizes, current_sizes):
+        print(f"{shape:<22} {legacy:12d} {current:14d}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--outputs", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    main_(parser.parse_args())
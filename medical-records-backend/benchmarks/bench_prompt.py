@@ -0,0 +1,84 @@
+"""
+プロンプト生成のマイクロベンチマーク
+毎回f-stringで全文を組み立てる旧実装と、テンプレート（inline / context モード）のリクエスト毎コスト（本文のJSONエンコードまで）・送信バイト数を比較する
+
+実行: python -m benchmarks.bench_prompt [--iterations 100000] [--patients 100]
+"""
+
+import argparse
+import json
+import time
+
+from app import main
+from app.settings import DifySettings
+
+def legacy_prompt(patient_data: dict = None) -> str:
+    """
+    旧実装（リクエスト毎に全文をf-stringで組み立て）
+    """
+    patient_info = ""
+    if patient_data:
+        patient_info = f"""
+患者情報:
+- 氏名: {patient_data.get('name', '不明')}
+- 患者ID: {patient_data.get('id', '不明')}
+- 年齢: {patient_data.get('age', '不明')}
+- 性別: {patient_data.get('gender', '不明')}
+"""
+    return f"""
+あなたは芦屋Rいいだ内科クリニックの医療記録作成アシスタントです。
+内科・消化器内科専門の医師の診察音声から、構造化された医療記録を作成してください。
+
+{patient_info}
+
+以下の形式でJSONレスポンスを返してください：
+
+{{
+    "patient_id": "患者ID",
+    "consultation_date": "診察日時（YYYY-MM-DD HH:MM形式）",
+    "chief_complaint": "主訴",
+    "present_illness": "現病歴",
+    "physical_examination": "身体所見",
+    "diagnosis": "診断",
+    "prescription": "処方・治療",
+    "guidance": "生活指導・注意事項",
+    "next_appointment": "次回予約",
+    "notes": "備考"
+}}
+
+専門用語について：
+- 消化器内科：胃炎、胃潰瘍、逆流性食道炎、過敏性腸症候群、炎症性腸疾患など
+- 内科一般：高血圧、糖尿病、脂質異常症、甲状腺疾患など
+- 検査：胃カメラ、大腸カメラ、ピロリ菌検査、血液検査など
+
+音声から診察内容を正確に抽出し、医療記録として適切な日本語で記録してください。
+"""
+
+def measure(builder, patients: list, iterations: int) -> tuple:
+    """
+    プロンプト生成からワークフローリクエスト本文のJSONエンコードまでの1リクエストあたりの時間と本文サイズ
+    """
+    start = time.perf_counter()
+    for i in range(iterations):
+        _, data = main.build_workflow_request(builder(patients[i % len(patients)]), "file-id", "key")
+        body = json.dumps(data).encode("utf-8")
+    elapsed = time.perf_counter() - start
+    return elapsed / iterations * 1_000_000, len(body)
+
+def main_(args) -> None:
+    patients = [{"name": f"患者{i}", "id": f"P-{i:05d}", "age": str(20 + i % 60), "gender": "男性" if i % 2 else "女性"} for i in range(args.patients)]
+    main.get_prompt_template()
+
+    print(f"{'builder':<12} {'us/request':>11} {'body bytes':>11}")
+    for name in ("legacy", "inline", "context"):
+        main.dify_settings = DifySettings(prompt_mode="inline" if name == "legacy" else name)
+        builder = legacy_prompt if name == "legacy" else main.create_medical_record_prompt
+        per_request, size = measure(builder, patients, args.iterations)
+        print(f"{name:<12} {per_request:11.2f} {size:11d}")
+    main.dify_settings = DifySettings()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100_000)
+    parser.add_argument("--patients", type=int, default=100)
+    main_(parser.parse_args())
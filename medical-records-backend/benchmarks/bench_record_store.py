@@ -0,0 +1,70 @@
+"""
+医療記録ストアの負荷テスト
+記録数を1k〜1Mまで増やしながら、保存・ID検索・患者ID検索のレイテンシを計測する
+
+実行: python -m benchmarks.bench_record_store [--max-records 1000000] [--samples 200]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from app.storage import SQLiteRecordStore
+from benchmarks.bench_dify_client import percentile
+
+def synthetic_record(index: int) -> dict:
+    day = index % 365
+    return {
+        "patient_id": f"P-{index % 5000:05d}",
+        "consultation_date": f"2025-{day // 31 % 12 + 1:02d}-{day % 28 + 1:02d} {9 + index % 9:02d}:00",
+        "chief_complaint": "腹痛、下痢症状",
+        "present_illness": "3日前から腹痛と下痢が続いている。食欲不振もあり。",
+        "physical_examination": "腹部：軽度圧痛あり、腸音亢進",
+        "diagnosis": "急性胃腸炎の疑い",
+        "prescription": "整腸剤、止痢剤を処方",
+        "guidance": "水分補給を心がけ、消化の良い食事を摂取してください",
+        "next_appointment": "1週間後",
+        "notes": None,
+    }
+
+async def measure(label: str, samples: int, operation) -> None:
+    timings = []
+    for i in range(samples):
+        start = time.perf_counter()
+        await operation(i)
+        timings.append(time.perf_counter() - start)
+    print(f"  {label:<18} p50={percentile(timings, 50) * 1000:7.3f}ms  p99={percentile(timings, 99) * 1000:7.3f}ms")
+
+async def amain(args) -> None:
+    sizes = [size for size in (1_000, 10_000, 100_000, 1_000_000) if size <= args.max_records]
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteRecordStore(os.path.join(directory, "records.sqlite3"))
+        await store.start()
+        total = 0
+        for size in sizes:
+            while total < size:
+                batch = [synthetic_record(total + i) for i in range(min(10_000, size - total))]
+                await store.save_many(batch)
+                total += len(batch)
+
+            print(f"records={total}")
+            await measure("save", args.samples, lambda i: store.save(synthetic_record(total + i)))
+            total += args.samples
+            await measure("get by id", args.samples, lambda i: store.get(random.randint(1, total)))
+            await measure("find by patient", args.samples, lambda i: store.find_by_patient(f"P-{random.randint(0, 4999):05d}", limit=20))
+
+            start = time.perf_counter()
+            await asyncio.gather(*(store.save(synthetic_record(total + i)) for i in range(args.samples)))
+            total += args.samples
+            elapsed = time.perf_counter() - start
+            print(f"  {'concurrent save':<18} {args.samples / elapsed:9.0f} records/s (batched commits)")
+        await store.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-records", type=int, default=1_000_000)
+    parser.add_argument("--samples", type=int, default=200)
+    asyncio.run(amain(parser.parse_args()))
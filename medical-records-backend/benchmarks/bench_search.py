@@ -0,0 +1,96 @@
+"""
+全文検索のベンチマーク
+語彙の異なる記録を1k〜1M件保存し、検索語の種類（頻出語・希少語・複数語・1文字）と患者ID・診察日の絞り込み別に検索レイテンシを計測する
+
+実行: python -m benchmarks.bench_search [--max-records 1000000] [--samples 100] [--target-ms 50]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from app.storage import SQLiteRecordStore
+from benchmarks.bench_dify_client import percentile
+
+COMPLAINTS = ["腹痛", "下痢", "胸やけ", "頭痛", "発熱", "咳嗽", "倦怠感", "便秘", "嘔気", "めまい", "動悸", "食欲不振"]
+DIAGNOSES = [
+    "急性胃腸炎の疑い", "逆流性食道炎", "過敏性腸症候群", "高血圧症", "2型糖尿病", "脂質異常症",
+    "慢性胃炎", "胃潰瘍", "甲状腺機能低下症", "感冒", "潰瘍性大腸炎", "ピロリ菌感染症",
+]
+PRESCRIPTIONS = ["整腸剤", "止痢剤", "PPI", "H2ブロッカー", "降圧薬", "メトホルミン", "スタチン", "解熱鎮痛剤", "去痰薬", "緩下剤"]
+EXAMS = ["胃カメラ", "大腸カメラ", "血液検査", "腹部エコー", "ピロリ菌検査"]
+RARE_TERM = "好酸球性食道炎"
+
+def synthetic_record(index: int, rng: random.Random) -> dict:
+    day = index % 365
+    complaints = rng.sample(COMPLAINTS, 2)
+    diagnosis = RARE_TERM if index % 10_000 == 0 else rng.choice(DIAGNOSES)
+    return {
+        "patient_id": f"P-{index % 5000:05d}",
+        "consultation_date": f"2025-{day // 31 % 12 + 1:02d}-{day % 28 + 1:02d} {9 + index % 9:02d}:00",
+        "chief_complaint": "、".join(complaints),
+        "present_illness": f"{rng.randint(1, 14)}日前から{complaints[0]}が続いている。{rng.choice(COMPLAINTS)}もあり。",
+        "physical_examination": "腹部：軽度圧痛あり",
+        "diagnosis": diagnosis,
+        "prescription": "、".join(rng.sample(PRESCRIPTIONS, 2)) + "を処方",
+        "guidance": "水分補給を心がけてください",
+        "next_appointment": "1週間後",
+        "notes": f"{rng.choice(EXAMS)}を予定" if index % 3 == 0 else None,
+    }
+
+QUERIES = {
+    "frequent term": lambda rng: {"query": rng.choice(COMPLAINTS)},
+    "rare term": lambda rng: {"query": RARE_TERM},
+    "two terms": lambda rng: {"query": f"{rng.choice(COMPLAINTS)} {rng.choice(PRESCRIPTIONS)}"},
+    "single char": lambda rng: {"query": "胃"},
+    "patient filter": lambda rng: {"query": rng.choice(COMPLAINTS), "patient_id": f"P-{rng.randint(0, 4999):05d}"},
+    "date range": lambda rng: {"query": rng.choice(DIAGNOSES), "date_from": "2025-03-01", "date_to": "2025-04-01"},
+    "page 2": None,
+}
+
+async def measure(store: SQLiteRecordStore, label: str, samples: int, rng: random.Random, target_ms: float) -> bool:
+    timings = []
+    for _ in range(samples):
+        if label == "page 2":
+            _, cursor = await store.search(rng.choice(COMPLAINTS), limit=50)
+            params = {"query": rng.choice(COMPLAINTS), "cursor": cursor}
+        else:
+            params = QUERIES[label](rng)
+        start = time.perf_counter()
+        await store.search(params.pop("query"), limit=50, **params)
+        timings.append(time.perf_counter() - start)
+    p99 = percentile(timings, 99) * 1000
+    ok = p99 < target_ms
+    print(f"  {label:<15} p50={percentile(timings, 50) * 1000:7.2f}ms  p95={percentile(timings, 95) * 1000:7.2f}ms  "
+          f"p99={p99:7.2f}ms  {'OK' if ok else 'SLOW'}")
+    return ok
+
+async def amain(args) -> None:
+    rng = random.Random(0)
+    sizes = [size for size in (1_000, 10_000, 100_000, 1_000_000) if size <= args.max_records]
+    all_ok = True
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteRecordStore(os.path.join(directory, "records.sqlite3"))
+        await store.start()
+        total = 0
+        for size in sizes:
+            start = time.perf_counter()
+            while total < size:
+                batch = [synthetic_record(total + i, rng) for i in range(min(10_000, size - total))]
+                await store.save_many(batch)
+                total += len(batch)
+            print(f"records={total} (indexed in {time.perf_counter() - start:.1f}s)")
+            for label in QUERIES:
+                all_ok &= await measure(store, label, args.samples, rng, args.target_ms)
+        await store.close()
+    print(f"target p99 < {args.target_ms:.0f}ms: {'met' if all_ok else 'NOT met'}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-records", type=int, default=1_000_000)
+    parser.add_argument("--samples", type=int, default=100)
+    parser.add_argument("--target-ms", type=float, default=50.0)
+    asyncio.run(amain(parser.parse_args()))
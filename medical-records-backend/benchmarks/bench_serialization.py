@@ -0,0 +1,107 @@
+"""
+レスポンスシリアライズのマイクロベンチマーク
+音声処理結果（1件）・記録一覧の1ページ（500件）・大量出力（10,000件）について、
+旧経路（jsonable_encoder + 標準json）・jsonable_encoder + orjson・orjson直接・Pydanticのシリアライズを比較する
+
+実行: python -m benchmarks.bench_serialization [--repeat 5]
+"""
+
+import argparse
+import json
+import time
+import warnings
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.main import DifyResponse, MedicalRecord, TimedJSONResponse
+
+RECORD_LIST_ADAPTER = TypeAdapter(list[MedicalRecord])
+
+def sample_record(index: int) -> dict:
+    return {
+        "id": index,
+        "patient_id": f"P-{index % 5000:05d}",
+        "consultation_date": f"2025-{index % 12 + 1:02d}-{index % 28 + 1:02d} 10:00",
+        "chief_complaint": "腹痛、下痢症状",
+        "present_illness": "3日前から腹痛と下痢が続いている。食欲不振もあり。",
+        "physical_examination": "腹部：軽度圧痛あり、腸音亢進",
+        "diagnosis": "急性胃腸炎の疑い",
+        "prescription": "整腸剤、止痢剤を処方",
+        "guidance": "水分補給を心がけ、消化の良い食事を摂取してください",
+        "next_appointment": "1週間後",
+        "notes": None,
+        "prompt_version": "v1",
+        "created_at": "2025-06-01T10:00:00.000000",
+    }
+
+def stdlib_render(content) -> bytes:
+    """
+    旧経路（jsonable_encoder の後に starlette の JSONResponse と同じ設定で json.dumps）
+    """
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def encoder_orjson_render(content) -> bytes:
+    """
+    dictを返すハンドラの経路（jsonable_encoder の後に TimedJSONResponse で orjson）
+    """
+    return TimedJSONResponse(jsonable_encoder(content)).body
+
+def direct_orjson_render(content) -> bytes:
+    """
+    TimedJSONResponse を直接返すハンドラの経路
+    """
+    return TimedJSONResponse(content).body
+
+def pydantic_render(content) -> bytes:
+    """
+    Pydanticモデルで検証してからRustのシリアライザでJSON化
+    """
+    if "records" in content:
+        return RECORD_LIST_ADAPTER.dump_json(RECORD_LIST_ADAPTER.validate_python(content["records"]))
+    return DifyResponse.model_validate(content).model_dump_json().encode("utf-8")
+
+def measure(render, content, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        iterations = max(1, 20_000 // max(1, len(content.get("records", [0]))))
+        start = time.perf_counter()
+        for _ in range(iterations):
+            render(content)
+        best = min(best, (time.perf_counter() - start) / iterations)
+    return best
+
+def main_(args) -> None:
+    payloads = {
+        "audio result": {"success": True, "medical_record": sample_record(1), "confidence_score": 0.85, "processing_time": 2.3},
+        "page (500)": {"success": True, "records": [sample_record(i) for i in range(500)], "count": 500, "next_cursor": "abc", "has_more": True},
+        "bulk (10000)": {"success": True, "records": [sample_record(i) for i in range(10_000)], "count": 10_000, "next_cursor": None, "has_more": False},
+    }
+    renderers = {
+        "stdlib": stdlib_render,
+        "encoder+orjson": encoder_orjson_render,
+        "orjson direct": direct_orjson_render,
+        "pydantic": pydantic_render,
+    }
+    for content in payloads.values():
+        assert orjson.loads(direct_orjson_render(content)) == json.loads(stdlib_render(content))
+
+    print(f"{'payload':<14} {'bytes':>9} " + " ".join(f"{name:>15}" for name in renderers) + f" {'speedup':>8}")
+    for name, content in payloads.items():
+        timings = {renderer: measure(render, content, args.repeat) for renderer, render in renderers.items()}
+        size = len(direct_orjson_render(content))
+        columns = " ".join(f"{timings[renderer] * 1_000_000:13.1f}us" for renderer in renderers)
+        print(f"{name:<14} {size:9d} {columns} {timings['stdlib'] / timings['orjson direct']:7.1f}x")
+
+    record = MedicalRecord(**sample_record(1))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        legacy = measure(lambda _: record.dict(), {}, args.repeat)
+    current = measure(lambda _: record.model_dump(), {}, args.repeat)
+    print(f"MedicalRecord.dict() {legacy * 1_000_000:.2f}us -> model_dump() {current * 1_000_000:.2f}us")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    main_(parser.parse_args())
@@ -0,0 +1,183 @@
+"""
+起動時間（コールドスタート）のベンチマーク
+新しいPythonプロセスで app.main を import する時間と、uvicorn を起動してから最初の /healthz が成功するまでの時間、
+その直後の最初の /api/process-audio のレイテンシを、起動モード（eager・lazy・lazy+ウォームアップ）毎に計測する
+DifyはスタブをベンチマークのプロセスでHTTPサーバーとして起動し、音声前処理は無効にして接続のコストのみを比較する
+--output で結果をJSONに保存し、--baseline で前回結果と比較して起動時間の劣化を検出できる
+
+実行: python -m benchmarks.bench_startup [--runs 5] [--output startup.json] [--baseline startup.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from app.audio import synthesize_wav
+from benchmarks.bench_workers import BACKEND_DIR
+from benchmarks.dify_stub import _free_port, create_stub_app, run_stub_server
+
+IMPORT_SCRIPT = "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+
+# 起動時に読み込まないモジュール（初回利用時に読み込む）
+LAZY_MODULES = ("numpy", "httpx", "h2", "xml.sax", "concurrent.futures.process", "pyarrow")
+LAZY_MODULES_SCRIPT = f"import sys, app.main; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+
+SCENARIOS = {
+    "eager": {"STARTUP_MODE": "eager", "DIFY_WARMUP": "false"},
+    "lazy": {"STARTUP_MODE": "lazy", "DIFY_WARMUP": "false"},
+    "lazy+warmup": {"STARTUP_MODE": "lazy", "DIFY_WARMUP": "true"},
+}
+
+def app_env(directory: str, stub_url: str, **overrides) -> dict:
+    """
+    計測用の環境変数（一時ディレクトリの記録DB、Difyスタブ、音声前処理なし）
+    """
+    return {
+        **os.environ,
+        "MEDICAL_RECORDS_DB_PATH": os.path.join(directory, "records.sqlite3"),
+        "DIFY_API_URL": stub_url,
+        "DIFY_API_KEY": "bench",
+        "DIFY_APP_ID": "bench",
+        "AUDIO_PREPROCESS_ENABLED": "false",
+        "AUDIO_CACHE_ENABLED": "false",
+        **overrides,
+    }
+
+def measure_import(env: dict) -> float:
+    """
+    新しいプロセスで app.main の import にかかる時間（秒）
+    """
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+def imported_lazy_modules(env: dict) -> list:
+    """
+    app.main の import 後に読み込まれている LAZY_MODULES
+    """
+    output = subprocess.run([sys.executable, "-c", LAZY_MODULES_SCRIPT], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True)
+    line = output.stdout.strip().splitlines()[-1] if output.stdout.strip() else ""
+    return [module for module in line.split(",") if module]
+
+@contextmanager
+def started_server(env: dict, timeout: float = 60):
+    """
+    uvicorn を起動し、起動から最初の /healthz 成功までの時間（秒）とベースURLを返す
+    """
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(base_url=base_url, timeout=5) as client:
+            while True:
+                try:
+                    if client.get("/healthz").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.perf_counter() - start > timeout or process.poll() is not None:
+                    raise RuntimeError("API server did not start")
+                time.sleep(0.005)
+        yield time.perf_counter() - start, base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+def measure_cold_start(env: dict, audio: bytes) -> tuple:
+    """
+    （起動から最初の /healthz までの時間, 最初の /api/process-audio のレイテンシ）（秒）
+    """
+    with started_server(env) as (cold_start, base_url):
+        start = time.perf_counter()
+        response = httpx.post(f"{base_url}/api/process-audio", files={"audio_file": ("first.wav", audio, "audio/wav")}, timeout=60)
+        response.raise_for_status()
+        return cold_start, time.perf_counter() - start
+
+def run_suite(args) -> dict:
+    audio = synthesize_wav(1.0, sample_rate=16000)
+    stub = create_stub_app(latency=args.workflow_latency)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, run_stub_server(app=stub) as stub_url:
+        base_env = app_env(directory, stub_url)
+        imports = [measure_import(base_env) for _ in range(args.runs)]
+        lazy_modules = imported_lazy_modules(base_env)
+        for name, overrides in SCENARIOS.items():
+            env = app_env(directory, stub_url, **overrides)
+            warmups_before = stub.state.parameters_calls
+            cold_starts, first_requests = zip(*(measure_cold_start(env, audio) for _ in range(args.runs)))
+            results[name] = {
+                "cold_start_ms": round(statistics.median(cold_starts) * 1000, 1),
+                "first_request_ms": round(statistics.median(first_requests) * 1000, 1),
+                "warmup_calls": stub.state.parameters_calls - warmups_before,
+            }
+    return {
+        "runs": args.runs,
+        "import_ms": round(statistics.median(imports) * 1000, 1),
+        "imported_lazy_modules": lazy_modules,
+        "scenarios": results,
+    }
+
+def compare_with_baseline(report: dict, baseline_path: str, max_regression: float) -> list:
+    """
+    前回結果と比較し、import 時間・起動時間の増加がmax_regressionを超えた項目を返す
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    pairs = [("import", baseline["import_ms"], report["import_ms"])]
+    for name, result in report["scenarios"].items():
+        previous = baseline["scenarios"].get(name)
+        if previous is not None:
+            pairs.append((f"{name} cold start", previous["cold_start_ms"], result["cold_start_ms"]))
+    regressions = []
+    for name, previous, current in pairs:
+        change = current / previous - 1 if previous else 0.0
+        print(f"  {name:<24} {change:+7.1%}")
+        if change > max_regression:
+            regressions.append(name)
+    return regressions
+
+def print_report(report: dict) -> None:
+    print(f"import app.main: {report['import_ms']:.1f} ms (median of {report['runs']})")
+    print(f"modules loaded at import: {', '.join(report['imported_lazy_modules']) or 'none of ' + ', '.join(LAZY_MODULES)}")
+    print(f"{'mode':<14} {'first /healthz ms':>18} {'first request ms':>17} {'warm-ups':>9}")
+    for name, result in report["scenarios"].items():
+        print(f"{name:<14} {result['cold_start_ms']:18.1f} {result['first_request_ms']:17.1f} {result['warmup_calls']:9d}")
+
+def main_(args) -> int:
+    report = run_suite(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        print(f"baseline: {args.baseline}")
+        regressions = compare_with_baseline(report, args.baseline, args.max_regression)
+        if regressions:
+            print(f"regressions over {args.max_regression:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5, help="各計測の繰り返し回数（中央値を出力）")
+    parser.add_argument("--workflow-latency", type=float, default=0.05, help="スタブの /workflows/run の応答遅延（秒）")
+    parser.add_argument("--output", default=None, help="結果を保存するJSONファイル")
+    parser.add_argument("--baseline", default=None, help="比較対象の前回結果JSONファイル")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="許容する起動時間の増加の割合")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    sys.exit(main_(parse_args()))
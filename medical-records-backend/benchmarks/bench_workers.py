@@ -0,0 +1,136 @@
+"""
+マルチワーカー構成の負荷試験
+共有バックエンド（SQLiteの記録・ジョブ・キャッシュ）で uvicorn --workers N を起動し、
+記録の一覧取得と保存を混ぜた負荷をかけてワーカー数ごとのスループットとレイテンシを比較する
+
+実行: python -m benchmarks.bench_workers [--workers 1,2,4] [--duration 10] [--clients 4] [--concurrency 16]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from benchmarks.bench_dify_client import percentile
+from benchmarks.dify_stub import _free_port
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), "..")
+
+def shared_backend_env(directory: str) -> dict:
+    """
+    全ワーカーで状態を共有するための環境変数
+    """
+    return {
+        "MEDICAL_RECORDS_DB_PATH": os.path.join(directory, "records.sqlite3"),
+        "JOB_STORE_BACKEND": "sqlite",
+        "JOB_STORE_PATH": os.path.join(directory, "jobs.sqlite3"),
+        "AUDIO_CACHE_BACKEND": "sqlite",
+        "AUDIO_CACHE_PATH": os.path.join(directory, "audio_cache.sqlite3"),
+        "JOB_POLL_INTERVAL": "0.05",
+        "DIFY_API_KEY": "",
+        "DIFY_APP_ID": "",
+    }
+
+@contextmanager
+def run_app_server(workers: int, directory: str):
+    """
+    uvicorn --workers N でAPIを別プロセス起動し、ベースURLを返す
+    """
+    port = _free_port()
+    env = {**os.environ, **shared_backend_env(directory)}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                if httpx.get(f"{base_url}/healthz").status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if time.time() > deadline or process.poll() is not None:
+                raise RuntimeError("API server did not start")
+            time.sleep(0.1)
+        # 全ワーカーの起動（スキーマ作成）を待つ
+        time.sleep(0.5 * workers)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+def sample_record(i: int) -> dict:
+    return {
+        "patient_id": f"P-{i % 500:05d}",
+        "consultation_date": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d} 10:00",
+        "chief_complaint": "腹痛",
+        "present_illness": "3日前から腹痛と下痢が続いている",
+        "physical_examination": "腹部：軽度圧痛あり",
+        "diagnosis": "急性胃腸炎の疑い",
+        "prescription": "整腸剤",
+        "guidance": "水分補給を指導",
+    }
+
+async def client_loop(base_url: str, duration: float, concurrency: int, write_ratio: float) -> list:
+    latencies = []
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        async def one(worker: int):
+            i = worker
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                if random.random() < write_ratio:
+                    response = await client.post("/api/save-record", json=sample_record(i))
+                else:
+                    response = await client.get("/api/records", params={"limit": 50})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+                i += concurrency
+
+        await asyncio.gather(*(one(w) for w in range(concurrency)))
+    return latencies
+
+def client_process(args: tuple) -> list:
+    return asyncio.run(client_loop(*args))
+
+def run_load(base_url: str, args) -> list:
+    """
+    複数の負荷生成プロセスから同時に負荷をかけ、全リクエストのレイテンシを返す
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(args.clients) as pool:
+        results = pool.map(client_process, [(base_url, args.duration, args.concurrency, args.write_ratio)] * args.clients)
+    return [latency for latencies in results for latency in latencies]
+
+def main_(args) -> None:
+    print(f"cpu_count={os.cpu_count()} clients={args.clients} concurrency/client={args.concurrency} write_ratio={args.write_ratio}")
+    print(f"{'workers':>7} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for workers in (int(w) for w in args.workers.split(",")):
+        with tempfile.TemporaryDirectory() as directory, run_app_server(workers, directory) as base_url:
+            for i in range(200):
+                httpx.post(f"{base_url}/api/save-record", json=sample_record(i)).raise_for_status()
+            latencies = run_load(base_url, args)
+        print(f"{workers:7d} {len(latencies):9d} {len(latencies) / args.duration:8.0f} "
+              f"{percentile(latencies, 50) * 1000:8.1f} {percentile(latencies, 95) * 1000:8.1f} {percentile(latencies, 99) * 1000:8.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--clients", type=int, default=4, help="負荷生成プロセス数")
+    parser.add_argument("--concurrency", type=int, default=16, help="負荷生成プロセスあたりの同時リクエスト数")
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    main_(parser.parse_args())
@@ -0,0 +1,139 @@
+"""
+ベンチマーク・テスト用のローカルDifyスタブサーバー
+/files/upload と /workflows/run を固定レイテンシで応答する
+stub.state で障害（エラー応答・遅延応答）を注入できる
+"""
+
+import asyncio
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STREAM_FIXTURE = os.path.join(os.path.dirname(__file__), "..", "fixtures", "dify_workflow_stream.txt")
+
+STRUCTURED_OUTPUT = {
+    "subjective": "3日前から腹痛と下痢が続いている",
+    "objective": "腹部：軽度圧痛あり、腸音亢進",
+    "assessment": "急性胃腸炎の疑い",
+    "plan": "整腸剤、止痢剤を処方。水分補給を指導",
+}
+
+def create_stub_app(latency: float = 0.0, upload_latency: float = None) -> FastAPI:
+    """
+    指定レイテンシで応答するDifyスタブアプリを作成（upload_latency未指定時はアップロードもlatency）
+    """
+    stub = FastAPI()
+    stub.state.latency = latency
+    stub.state.upload_latency = upload_latency
+    stub.state.calls = {"upload": 0, "workflow": 0}
+    # 起動時の接続ウォームアップ（GET /parameters）の回数
+    stub.state.parameters_calls = 0
+    stub.state.upload_bytes = 0
+    # 本文の受信を始めたアップロード数（録音中の先行アップロードの検証用）
+    stub.state.uploads_started = 0
+    # 帯域制限: アップロード本文をこの速度（バイト/秒）で受信する（Noneで無制限）
+    stub.state.upload_bandwidth = None
+    stub.state.prompts = []
+    # 応答内容の差し替え: output_factory(request_body) が返すstructured_outputを使う
+    stub.state.output_factory = None
+    # 同時に処理中のワークフロー数（並行数制限の検証用）
+    stub.state.in_flight = 0
+    stub.state.max_in_flight = 0
+    # 障害注入: 次のfailures回（またはfailure_rateの確率）でfailure_statusを返す
+    stub.state.failures = 0
+    stub.state.failure_rate = 0.0
+    stub.state.failure_status = 503
+    # 遅延注入: 次のslow_calls回はslow_latency秒待ってから応答する
+    stub.state.slow_calls = 0
+    stub.state.slow_latency = 0.0
+
+    async def inject_faults(operation: str):
+        stub.state.calls[operation] += 1
+        if stub.state.slow_calls > 0:
+            stub.state.slow_calls -= 1
+            await asyncio.sleep(stub.state.slow_latency)
+        if stub.state.failures > 0 or random.random() < stub.state.failure_rate:
+            stub.state.failures = max(0, stub.state.failures - 1)
+            return JSONResponse({"code": "injected_fault", "message": "injected fault"}, status_code=stub.state.failure_status)
+        return None
+
+    @stub.get("/parameters")
+    async def parameters():
+        stub.state.parameters_calls += 1
+        return {"user_input_form": [], "file_upload": {"enabled": True}}
+
+    @stub.post("/files/upload")
+    async def upload(request: Request):
+        stub.state.uploads_started += 1
+        async for chunk in request.stream():
+            stub.state.upload_bytes += len(chunk)
+            if stub.state.upload_bandwidth:
+                await asyncio.sleep(len(chunk) / stub.state.upload_bandwidth)
+        fault = await inject_faults("upload")
+        if fault is not None:
+            return fault
+        await asyncio.sleep(stub.state.latency if stub.state.upload_latency is None else stub.state.upload_latency)
+        return {"id": str(uuid.uuid4()), "name": "audio.wav"}
+
+    @stub.post("/workflows/run")
+    async def run_workflow(request: Request):
+        body = await request.json()
+        fault = await inject_faults("workflow")
+        if fault is not None:
+            return fault
+        stub.state.prompts.append(body.get("inputs", {}).get("prompt"))
+        if body.get("response_mode") == "streaming":
+            return StreamingResponse(stream_fixture(stub.state.latency), media_type="text/event-stream")
+        stub.state.in_flight += 1
+        stub.state.max_in_flight = max(stub.state.max_in_flight, stub.state.in_flight)
+        try:
+            await asyncio.sleep(stub.state.latency)
+        finally:
+            stub.state.in_flight -= 1
+        return {
+            "workflow_run_id": str(uuid.uuid4()),
+            "data": {"status": "succeeded", "outputs": {"structured_output": stub.state.output_factory(body) if stub.state.output_factory else STRUCTURED_OUTPUT}},
+        }
+
+    return stub
+
+async def stream_fixture(latency: float):
+    """
+    記録済みのイベントストリームを、総所要時間がlatencyになるよう分割して送信
+    """
+    with open(STREAM_FIXTURE, encoding="utf-8") as f:
+        messages = [m + "\n\n" for m in f.read().split("\n\n") if m]
+    for message in messages:
+        await asyncio.sleep(latency / len(messages))
+        yield message
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+@contextmanager
+def run_stub_server(latency: float = 0.0, app: FastAPI = None):
+    """
+    スタブサーバーを別スレッドで起動し、ベースURLを返す
+    """
+    port = _free_port()
+    config = uvicorn.Config(app or create_stub_app(latency), host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
@@ -0,0 +1,13 @@
+"""
+gunicorn の設定（gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker app.main:app）
+ワーカーが異常終了してアプリの終了処理が走らなかった場合も、そのワーカーの live 系ゲージを集計から外す
+マスタープロセスでメトリクスのファイルを作らないよう、app は import しない
+"""
+
+import os
+
+from prometheus_client import multiprocess
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Test script for admission control on the processing endpoints
+Checks the concurrency limit, bounded wait queue with deadline, per-client token buckets and the 429/503 responses with Retry-After
+"""
+
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.admission import AdmissionController, AdmissionRejected
+from app.settings import DifySettings
+from benchmarks.bench_admission import configured_admission, main_, parse_args
+
+async def try_acquire(controller: AdmissionController, client: str):
+    try:
+        return await controller.acquire(client)
+    except AdmissionRejected as e:
+        return e
+
+def test_concurrency_limit_and_wait_queue():
+    """Requests beyond the limit wait in arrival order, overflow is shed and waiting past the deadline times out"""
+    async def scenario():
+        controller = AdmissionController(max_concurrency=2, queue_size=2, queue_timeout=0.2)
+        held = [await controller.acquire("a"), await controller.acquire("b")]
+        waiting = [asyncio.create_task(controller.acquire(f"w{i}")) for i in range(2)]
+        await asyncio.sleep(0)
+        assert controller.active == 2 and controller.queued == 2
+
+        overflow = await try_acquire(controller, "c")
+        assert isinstance(overflow, AdmissionRejected) and overflow.reason == "queue_full" and overflow.retry_after > 0
+
+        controller.release(held[0])
+        await asyncio.wait_for(waiting[0], 0.1)
+        assert not waiting[1].done()
+        assert controller.active == 2 and controller.queued == 1
+
+        timed_out = await asyncio.gather(waiting[1], return_exceptions=True)
+        assert isinstance(timed_out[0], AdmissionRejected) and timed_out[0].reason == "queue_timeout"
+        assert controller.queued == 0
+
+        controller.release(held[1])
+        controller.release(waiting[0].result())
+        return controller.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot["active"] == 0 and snapshot["queued"] == 0
+    assert snapshot["total_admitted"] == 3
+    assert snapshot["total_rejected"] == {"rate_limited": 0, "queue_full": 1, "queue_timeout": 1}
+    print("✅ Concurrency limit, FIFO queue, shedding and queue deadline work")
+
+def test_weighted_requests_take_their_concurrency():
+    """A request charged for several slots waits until they are all free and later requests queue behind it"""
+    async def scenario():
+        controller = AdmissionController(max_concurrency=4, queue_size=4, queue_timeout=1.0)
+        batch = await controller.acquire("batch", cost=3)
+        big = asyncio.create_task(controller.acquire("big", cost=2))
+        small = asyncio.create_task(controller.acquire("small"))
+        await asyncio.sleep(0)
+        # 1枠空いているが、先に並んだ2枠の待ち手を追い越さない
+        assert controller.active == 3 and controller.queued == 2
+
+        controller.release(batch, cost=3)
+        await asyncio.wait_for(asyncio.gather(big, small), 0.1)
+        assert controller.active == 3 and controller.queued == 0
+        controller.release(big.result(), cost=2)
+        controller.release(small.result())
+
+        # 上限を超える枠は上限までに抑える
+        capped = await controller.acquire("huge", cost=10)
+        assert controller.active == 4
+        controller.release(capped, cost=10)
+        return controller.active
+
+    assert asyncio.run(scenario()) == 0
+    print("✅ Weighted requests take and return their concurrency in FIFO order")
+
+def test_token_bucket_per_client():
+    """Each client gets its own bucket, per-client overrides apply and shed requests do not consume tokens"""
+    async def scenario():
+        controller = AdmissionController(
+            max_concurrency=0, rate_per_minute=6, burst=2, client_rates={"x-clinic-id:large": 600}
+        )
+        results = [await try_acquire(controller, "x-clinic-id:small") for _ in range(3)]
+        assert all(isinstance(r, float) for r in results[:2])
+        assert isinstance(results[2], AdmissionRejected) and results[2].reason == "rate_limited"
+        assert 9 < results[2].retry_after <= 10
+        assert isinstance(await try_acquire(controller, "x-clinic-id:other"), float)
+
+        large = [await try_acquire(controller, "x-clinic-id:large") for _ in range(3)]
+        assert isinstance(large[2], AdmissionRejected) and large[2].retry_after <= 0.1
+        await asyncio.sleep(0.15)
+        assert isinstance(await try_acquire(controller, "x-clinic-id:large"), float)
+
+        shed = AdmissionController(max_concurrency=1, queue_size=0, rate_per_minute=6, burst=1)
+        await shed.acquire("held")
+        assert (await try_acquire(shed, "client")).reason == "queue_full"
+        shed.release(None)
+        assert isinstance(await try_acquire(shed, "client"), float)
+
+    asyncio.run(scenario())
+    print("✅ Token buckets are per client with overrides and refunds")
+
+def test_endpoint_rejections_have_retry_after():
+    """The processing endpoint answers 429/503 with Retry-After and CORS headers before reading the upload"""
+    main.dify_settings = DifySettings()
+    controller = main.admission_controller
+    upload = {"audio_file": ("test.wav", b"RIFF0000WAVE", "audio/wav")}
+    cors = {"Origin": "http://localhost:5173"}
+    with TestClient(main.app) as client:
+        with configured_admission(max_concurrency=1, queue_size=0, rate_per_minute=0):
+            held = asyncio.run(controller.acquire("holder"))
+            busy = client.post("/api/process-audio", files=upload, headers=cors)
+            controller.release(held)
+            admitted = client.post("/api/process-audio", files=upload, headers=cors)
+        with configured_admission(max_concurrency=0, rate_per_minute=1, burst=1):
+            first = client.post("/api/process-audio", files=upload, headers={**cors, "X-Clinic-ID": "test-endpoint"})
+            limited = client.post("/api/process-audio", files=upload, headers={**cors, "X-Clinic-ID": "test-endpoint"})
+            other = client.post("/api/process-audio", files=upload, headers={**cors, "X-Clinic-ID": "test-endpoint-2"})
+        records = client.get("/api/records")
+        health = client.get("/healthz").json()
+        metrics = client.get("/metrics").text
+
+    assert busy.status_code == 503 and busy.headers["retry-after"].isdigit()
+    assert busy.headers["access-control-allow-origin"] == cors["Origin"]
+    assert "Retry-After" in busy.headers["access-control-expose-headers"]
+    assert admitted.status_code == 200 and first.status_code == 200 and other.status_code == 200
+    assert limited.status_code == 429 and 55 <= int(limited.headers["retry-after"]) <= 60
+    assert records.status_code == 200
+    assert health["admission"]["active"] == 0
+    assert 'medical_records_admission_decisions_total{outcome="rate_limited"}' in metrics
+    assert "medical_records_admission_in_flight" in metrics
+    print("✅ Rejected requests get 429/503 with Retry-After")
+
+def test_batch_is_charged_for_its_concurrency():
+    """The batch endpoint needs as many free slots as it runs Dify calls in parallel"""
+    main.dify_settings = DifySettings()
+    controller = main.admission_controller
+    cost = main.ADMISSION_PATH_COSTS["/api/process-audio/batch"]
+    files = [("audio_files", (f"{i}.wav", b"RIFF0000WAVE", "audio/wav")) for i in range(2)]
+    with TestClient(main.app) as client:
+        with configured_admission(max_concurrency=cost, queue_size=0, rate_per_minute=0):
+            held = asyncio.run(controller.acquire("holder"))
+            busy = client.post("/api/process-audio/batch", files=files, params={"save": False})
+            single = client.post("/api/process-audio", files={"audio_file": ("test.wav", b"RIFF0000WAVE", "audio/wav")})
+            controller.release(held)
+            admitted = client.post("/api/process-audio/batch", files=files, params={"save": False})
+            active = controller.active
+
+    assert cost > 1
+    assert busy.status_code == 503 and busy.headers["retry-after"].isdigit()
+    assert single.status_code == 200
+    assert admitted.status_code == 200 and admitted.text.count('"status":"succeeded"') == 2
+    assert active == 0
+    print(f"✅ Batch requests take {cost} admission slots")
+
+def test_load_test_sheds_noisy_clinic():
+    """The local load test keeps Dify concurrency under the limit and only rate-limits the noisy clinic"""
+    report = main_(parse_args([
+        "--noisy-requests", "8", "--quiet-clinics", "1", "--quiet-requests", "3", "--duration", "1",
+        "--upload-latency", "0.01", "--workflow-latency", "0.1", "--max-concurrency", "2", "--burst", "4"
+    ]))
+    assert main.admission_controller.max_concurrency == main.ADMISSION_MAX_CONCURRENCY
+    disabled, enabled = report["disabled"], report["enabled"]
+    assert disabled["clinics"]["noisy"]["200"] == 8 and disabled["max_in_flight"] > 2
+    assert enabled["max_in_flight"] <= 2 and enabled["dify_max_in_flight"] <= 2
+    assert enabled["clinics"]["noisy"]["200"] == 4 and enabled["clinics"]["noisy"]["429"] == 4
+    assert enabled["clinics"]["quiet-0"]["200"] == 3
+    assert all(counts["missing_retry_after"] == 0 for counts in enabled["clinics"].values())
+    print("✅ Load test sheds only the noisy clinic")
+
+if __name__ == "__main__":
+    print("🚀 Starting Admission Control Test")
+    print("=" * 50)
+    test_concurrency_limit_and_wait_queue()
+    test_weighted_requests_take_their_concurrency()
+    test_token_bucket_per_client()
+    test_endpoint_rejections_have_retry_after()
+    test_batch_is_charged_for_its_concurrency()
+    test_load_test_sheds_noisy_clinic()
+    print("=" * 50)
+    print("🎉 All tests passed!")
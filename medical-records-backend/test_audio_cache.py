@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Test script for the audio hash cache
+Checks TTL expiry and LRU eviction of the memory and SQLite backends, the prompt-dependent record key,
+the hit/miss counters and that a repeated upload skips both Dify calls
+"""
+
+import asyncio
+import os
+import tempfile
+import threading
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.audio import synthesize_wav
+from app.cache import AudioResultCache, MemoryCacheBackend, SQLiteCacheBackend
+from app.settings import DifySettings
+from benchmarks.dify_stub import create_stub_app, run_stub_server
+
+async def check_backend(backend) -> None:
+    """TTL expiry, LRU eviction at max_entries and delete for a backend with max_entries=2"""
+    await backend.set("expiring", "value", 0.05)
+    assert await backend.get("expiring") == "value"
+    await asyncio.sleep(0.06)
+    assert await backend.get("expiring") is None
+
+    await backend.set("a", {"n": 1}, 60)
+    await asyncio.sleep(0.01)
+    await backend.set("b", {"n": 2}, 60)
+    await asyncio.sleep(0.01)
+    assert await backend.get("a") == {"n": 1}
+    await asyncio.sleep(0.01)
+    await backend.set("c", {"n": 3}, 60)
+    assert await backend.get("b") is None
+    assert await backend.get("a") == {"n": 1} and await backend.get("c") == {"n": 3}
+    assert await backend.count() == 2
+
+    await backend.delete("a")
+    assert await backend.get("a") is None and await backend.count() == 1
+
+def test_memory_backend_ttl_and_lru():
+    """The memory backend expires entries and evicts the least recently used one"""
+    asyncio.run(check_backend(MemoryCacheBackend(max_entries=2)))
+    print("✅ Memory backend honours TTL and LRU eviction")
+
+def test_sqlite_backend_ttl_lru_and_persistence():
+    """The SQLite backend behaves like the memory backend and keeps entries across reopen"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache.sqlite3")
+        asyncio.run(check_backend(SQLiteCacheBackend(path, max_entries=2)))
+        assert asyncio.run(SQLiteCacheBackend(path, max_entries=2).get("c")) == {"n": 3}
+    print("✅ SQLite backend honours TTL, LRU eviction and survives reopen")
+
+def test_sqlite_backend_does_not_block_event_loop():
+    """A lookup waiting on a locked SQLite file (busy_timeout) leaves the event loop free"""
+    async def scenario(path):
+        backend = SQLiteCacheBackend(path)
+        await backend.set("key", "value", 60)
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_write_lock():
+            # 別のワーカーが書き込み中の状態を再現する
+            blocker = SQLiteCacheBackend(path)
+            blocker._conn.execute("BEGIN IMMEDIATE")
+            locked.set()
+            release.wait()
+            blocker._conn.execute("ROLLBACK")
+
+        holder = threading.Thread(target=hold_write_lock)
+        holder.start()
+        locked.wait()
+        write = asyncio.create_task(backend.set("other", "value", 60))
+        ticks = 0
+        while ticks < 20:
+            await asyncio.sleep(0.01)
+            ticks += 1
+        done_while_locked = write.done()
+        release.set()
+        await write
+        holder.join()
+        return ticks, done_while_locked, await backend.get("other")
+
+    with tempfile.TemporaryDirectory() as directory:
+        ticks, done_while_locked, value = asyncio.run(scenario(os.path.join(directory, "cache.sqlite3")))
+    assert ticks == 20 and not done_while_locked and value == "value"
+    print("✅ SQLite cache waits for locks off the event loop")
+
+def test_record_key_includes_prompt_and_counts_hits():
+    """Records are cached per prompt, file IDs can be invalidated and hits/misses are counted"""
+    async def scenario():
+        cache = AudioResultCache(MemoryCacheBackend())
+        await cache.set_record("hash", "prompt-a", {"diagnosis": "A"})
+        await cache.set_file_id("hash", "file-1")
+        assert await cache.get_record("hash", "prompt-a") == {"diagnosis": "A"}
+        assert await cache.get_record("hash", "prompt-b") is None
+        assert await cache.get_file_id("hash") == "file-1"
+        await cache.invalidate_file_id("hash")
+        assert await cache.get_file_id("hash") is None
+        return await cache.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["hits"] == {"file_id": 1, "record": 1}
+    assert stats["misses"] == {"file_id": 1, "record": 1}
+    assert stats["entries"] == 1
+    print("✅ Record key includes the prompt and hits/misses are counted")
+
+def test_repeated_upload_skips_dify():
+    """A second identical upload is served from the cache and an expired file ID is re-uploaded"""
+    audio = synthesize_wav(2.0, sample_rate=16000)
+    stub = create_stub_app()
+    saved_cache = main.audio_cache
+    main.audio_cache = AudioResultCache(MemoryCacheBackend())
+
+    def post(client, patient_id):
+        return client.post("/api/process-audio", files={"audio_file": ("same.wav", audio, "audio/wav")}, data={"patient_id": patient_id})
+
+    try:
+        with run_stub_server(app=stub) as api_url:
+            main.dify_settings = DifySettings(api_url=api_url, api_key="key", app_id="app", http2=False)
+            with TestClient(main.app) as client:
+                first = post(client, "P-1")
+                after_first = dict(stub.state.calls)
+                second = post(client, "P-1")
+                after_second = dict(stub.state.calls)
+
+                # 別の患者（プロンプト）では記録はミスするが、fileIDは再利用し、失効していれば再アップロードする
+                stub.state.failures = 1
+                stub.state.failure_status = 404
+                third = post(client, "P-2")
+                after_third = dict(stub.state.calls)
+                stats = client.get("/api/cache/stats").json()
+    finally:
+        main.audio_cache = saved_cache
+        main.dify_settings = DifySettings()
+
+    assert first.status_code == second.status_code == third.status_code == 200
+    assert after_first == {"upload": 1, "workflow": 1}
+    assert after_second == after_first
+    assert second.json()["medical_record"] == first.json()["medical_record"]
+    assert after_third == {"upload": 2, "workflow": 3}
+    assert third.json()["medical_record"]["diagnosis"] == first.json()["medical_record"]["diagnosis"]
+    assert stats["hits"]["record"] == 1 and stats["hits"]["file_id"] == 1
+    print("✅ Repeated upload skips both Dify calls and expired file IDs are re-uploaded")
+
+if __name__ == "__main__":
+    print("🚀 Starting Audio Cache Test")
+    print("=" * 50)
+    test_memory_backend_ttl_and_lru()
+    test_sqlite_backend_ttl_lru_and_persistence()
+    test_sqlite_backend_does_not_block_event_loop()
+    test_record_key_includes_prompt_and_counts_hits()
+    test_repeated_upload_skips_dify()
+    print("=" * 50)
+    print("🎉 All tests passed!")
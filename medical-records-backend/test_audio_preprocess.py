@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Test script for server-side audio preprocessing before Dify upload
+Covers downmix/resample/silence trimming and the upload path against the local Dify stub
+"""
+
+import asyncio
+import os
+import tempfile
+import tracemalloc
+import wave
+
+import numpy as np
+
+from app import main
+from app.audio import (
+    FRAME_SECONDS, TARGET_SAMPLE_RATE, StreamingResampler, frame_rms, lowpass_taps, preprocess_wav_file, read_wav, silence_bounds,
+    split_wav_file, synthesize_wav, to_pcm16
+)
+from app.settings import DifySettings
+from benchmarks.dify_stub import create_stub_app, run_stub_server
+
+def write_temp(data: bytes, suffix: str = ".wav") -> str:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as f:
+        f.write(data)
+        return f.name
+
+def test_downmix_resample_and_trim():
+    """44.1kHz stereo with 2s of leading/trailing silence becomes trimmed 16kHz mono"""
+    input_path = write_temp(synthesize_wav(10.0, sample_rate=44100, channels=2, leading_silence=2.0, trailing_silence=2.0))
+    output_path = input_path + ".out"
+    try:
+        info = preprocess_wav_file(input_path, output_path)
+        with wave.open(output_path, "rb") as wav_file:
+            assert wav_file.getnchannels() == 1
+            assert wav_file.getframerate() == TARGET_SAMPLE_RATE
+            assert wav_file.getsampwidth() == 2
+        ratio = os.path.getsize(input_path) / os.path.getsize(output_path)
+    finally:
+        os.unlink(input_path)
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+    assert info["format"] == "wav"
+    assert abs(info["input_seconds"] - 14.0) < 0.01
+    assert 10.0 <= info["output_seconds"] <= 10.5
+    assert ratio > 7
+    print(f"✅ Preprocessed {info['input_seconds']:.1f}s -> {info['output_seconds']:.1f}s, {ratio:.1f}x smaller")
+
+def test_resample_preserves_pitch():
+    """The dominant 220Hz tone survives resampling"""
+    input_path = write_temp(synthesize_wav(4.0, sample_rate=48000))
+    output_path = input_path + ".out"
+    try:
+        preprocess_wav_file(input_path, output_path, trim=False)
+        samples, sample_rate = read_wav(output_path)
+    finally:
+        os.unlink(input_path)
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+    spectrum = np.abs(np.fft.rfft(samples[:, 0]))
+    peak = np.fft.rfftfreq(len(samples), 1 / sample_rate)[np.argmax(spectrum)]
+    assert abs(peak - 220) < 2
+    print(f"✅ Dominant frequency after resampling: {peak:.1f}Hz")
+
+def test_block_resampling_matches_whole_signal():
+    """Resampling block by block gives the same samples as filtering and interpolating the whole signal at once"""
+    signal = np.random.default_rng(1).standard_normal(3 * 44100 + 17).astype(np.float32)
+    filtered = np.convolve(signal, lowpass_taps(0.9 * TARGET_SAMPLE_RATE / 44100), mode="same")
+    positions = np.arange(int(round(len(signal) / 44100 * TARGET_SAMPLE_RATE)), dtype=np.float64) * (44100 / TARGET_SAMPLE_RATE)
+    expected = np.interp(positions, np.arange(len(filtered)), filtered)
+    for block in (7, 1000, 1 << 16):
+        resampler = StreamingResampler(44100)
+        output = np.concatenate([resampler.process(signal[i:i + block]) for i in range(0, len(signal), block)] + [resampler.flush()])
+        assert len(output) == len(expected)
+        assert np.max(np.abs(output - expected)) < 1e-5
+    print("✅ Block resampling matches whole-signal resampling")
+
+def test_preprocessed_file_matches_whole_signal():
+    """Block-wise preprocessing writes the same samples as downmixing, resampling and trimming the whole recording in memory"""
+    input_path = write_temp(synthesize_wav(6.0, sample_rate=44100, channels=2, leading_silence=1.0, trailing_silence=1.0))
+    output_path = input_path + ".out"
+    try:
+        preprocess_wav_file(input_path, output_path, block_frames=1000)
+        samples, sample_rate = read_wav(input_path)
+        with wave.open(output_path, "rb") as wav_file:
+            output = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype="<i2").astype(np.int32)
+    finally:
+        os.unlink(input_path)
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+
+    mono = samples.mean(axis=1, dtype=np.float32)
+    filtered = np.convolve(mono, lowpass_taps(0.9 * TARGET_SAMPLE_RATE / sample_rate), mode="same")
+    positions = np.arange(int(round(len(mono) / sample_rate * TARGET_SAMPLE_RATE)), dtype=np.float64) * (sample_rate / TARGET_SAMPLE_RATE)
+    resampled = np.interp(positions, np.arange(len(filtered)), filtered).astype(np.float32)
+    frame = int(TARGET_SAMPLE_RATE * FRAME_SECONDS)
+    start, end = silence_bounds(frame_rms(resampled, frame), frame, len(resampled), TARGET_SAMPLE_RATE)
+    expected = to_pcm16(resampled[start:end]).astype(np.int32)
+    assert 0 < start and end < len(resampled)
+    assert len(output) == len(expected)
+    # 16bitへの丸めの違い（1LSB）のみ許容する
+    assert np.max(np.abs(output - expected)) <= 1
+    print("✅ Block-wise preprocessing matches whole-signal processing")
+
+def test_silent_recording_is_not_trimmed_to_nothing():
+    """A recording that is silent throughout is kept whole instead of becoming empty audio or an empty segment"""
+    input_path = write_temp(synthesize_wav(0.0, sample_rate=16000, leading_silence=3.0))
+    output_path = input_path + ".out"
+    try:
+        info = preprocess_wav_file(input_path, output_path)
+        with tempfile.TemporaryDirectory() as directory:
+            segments = [read_wav(path)[0] for path in split_wav_file(input_path, directory, 1.0)]
+    finally:
+        os.unlink(input_path)
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+    assert info["output_seconds"] == 3.0
+    assert len(segments) > 1 and all(len(segment) > 0 for segment in segments)
+    assert sum(len(segment) for segment in segments) == 3 * TARGET_SAMPLE_RATE
+    print(f"✅ Silent recording kept whole ({len(segments)} non-empty segments)")
+
+def test_preprocess_memory_is_bounded():
+    """Peak memory while preprocessing stays a small fraction of the recording and the output is block-size independent"""
+    wav_bytes = synthesize_wav(120.0, sample_rate=44100, channels=2, leading_silence=2.0)
+    input_path = write_temp(wav_bytes)
+    outputs = []
+    try:
+        tracemalloc.start()
+        try:
+            info = preprocess_wav_file(input_path, input_path + ".out")
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        preprocess_wav_file(input_path, input_path + ".small", block_frames=4096)
+        for suffix in (".out", ".small"):
+            with open(input_path + suffix, "rb") as f:
+                outputs.append(f.read())
+    finally:
+        for path in (input_path, input_path + ".out", input_path + ".small"):
+            if os.path.exists(path):
+                os.unlink(path)
+    assert 120.0 <= info["output_seconds"] <= 120.5
+    assert peak < len(wav_bytes) / 5
+    assert outputs[0] == outputs[1]
+    print(f"✅ Preprocessed {len(wav_bytes) / 1e6:.0f}MB with a {peak / 1e6:.1f}MB peak")
+
+def test_non_wav_is_left_alone():
+    """Compressed or unknown input is not preprocessed"""
+    input_path = write_temp(b"\x1aE\xdf\xa3" + b"\0" * 1024, suffix=".webm")
+    try:
+        assert preprocess_wav_file(input_path, input_path + ".out") is None
+        assert not asyncio.run(main.is_wav_audio(input_path))
+    finally:
+        os.unlink(input_path)
+    print("✅ Non-WAV audio is uploaded unchanged")
+
+def test_upload_sends_preprocessed_audio():
+    """get_or_upload_file_id uploads the smaller preprocessed file via the process pool"""
+    main.get_dify_breaker().record_success()
+    main.dify_settings = DifySettings(http2=False)
+    wav_bytes = synthesize_wav(6.0, sample_rate=44100, channels=2, leading_silence=1.0)
+    audio_path = write_temp(wav_bytes)
+    stub = create_stub_app()
+
+    async def scenario():
+        with run_stub_server(app=stub) as api_url:
+            try:
+                return await main.get_or_upload_file_id(audio_path, None, "key", api_url)
+            finally:
+                await main.get_dify_client().aclose()
+
+    try:
+        file_id, from_cache = asyncio.run(scenario())
+    finally:
+        os.unlink(audio_path)
+        main.dify_settings = DifySettings()
+        if main.audio_preprocess_pool is not None:
+            main.audio_preprocess_pool.shutdown()
+            main.audio_preprocess_pool = None
+    assert file_id and not from_cache
+    assert stub.state.upload_bytes < len(wav_bytes) / 5
+    print(f"✅ Uploaded {stub.state.upload_bytes} bytes instead of {len(wav_bytes)}")
+
+if __name__ == "__main__":
+    print("🚀 Starting Audio Preprocessing Test")
+    print("=" * 50)
+    test_downmix_resample_and_trim()
+    test_resample_preserves_pitch()
+    test_block_resampling_matches_whole_signal()
+    test_preprocessed_file_matches_whole_signal()
+    test_silent_recording_is_not_trimmed_to_nothing()
+    test_preprocess_memory_is_bounded()
+    test_non_wav_is_left_alone()
+    test_upload_sends_preprocessed_audio()
+    print("=" * 50)
+    print("🎉 All tests passed!")
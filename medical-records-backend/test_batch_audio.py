@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test script for the batch audio endpoint
+Uploads several recordings to /api/process-audio/batch against the local Dify stub and checks the NDJSON stream and bulk save
+"""
+
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.settings import DifySettings
+from benchmarks.dify_stub import create_stub_app, run_stub_server
+
+def audio_files(count: int) -> list:
+    # 音声キャッシュに当たらないようファイル毎に内容を変える
+    return [("audio_files", (f"recording_{i}.wav", b"RIFF" + bytes([i]) * 1024, "audio/wav")) for i in range(count)]
+
+@contextmanager
+def temp_record_store():
+    """Use a record store in a temporary directory and restore the original store afterwards"""
+    store = main.record_store
+    with tempfile.TemporaryDirectory() as directory:
+        main.record_store = main.SQLiteRecordStore(os.path.join(directory, "records.sqlite3"))
+        try:
+            yield
+        finally:
+            main.record_store = store
+
+def test_batch_streams_results_and_saves_in_bulk():
+    """Items stream back as NDJSON with bounded concurrency, then all records are saved in one batch"""
+    main.get_dify_breaker().record_success()
+    saved_settings = main.AUDIO_BATCH_CONCURRENCY, main.dify_settings
+    main.AUDIO_BATCH_CONCURRENCY = 2
+    stub = create_stub_app(latency=0.1)
+    metadata = [{"patient_id": f"P-{i:03d}", "patient_name": f"患者{i}", "patient_age": 40 + i} for i in range(5)]
+
+    try:
+        with temp_record_store(), run_stub_server(app=stub) as api_url:
+            main.dify_settings = DifySettings(api_url=api_url, api_key="key", app_id="app", http2=False)
+            with TestClient(main.app) as client:
+                with client.stream("POST", "/api/process-audio/batch", files=audio_files(5), data={"metadata": json.dumps(metadata)}) as response:
+                    assert response.status_code == 200
+                    assert response.headers["content-type"] == "application/x-ndjson"
+                    lines = [json.loads(line) for line in response.iter_lines() if line]
+                saved = client.get("/api/records", params={"include_total": True}).json()
+    finally:
+        main.AUDIO_BATCH_CONCURRENCY, main.dify_settings = saved_settings
+
+    items, summary = lines[:-1], lines[-1]
+    assert [item["type"] for item in items] == ["item"] * 5
+    assert sorted(item["index"] for item in items) == list(range(5))
+    assert all(item["status"] == "succeeded" for item in items)
+    assert {item["filename"] for item in items} == {f"recording_{i}.wav" for i in range(5)}
+    assert stub.state.calls["workflow"] == 5
+    assert stub.state.max_in_flight == 2
+    assert any("患者3" in prompt and "43" in prompt for prompt in stub.state.prompts)
+    assert summary["type"] == "summary"
+    assert summary["succeeded"] == 5 and summary["failed"] == 0
+    assert all(isinstance(record_id, int) for record_id in summary["record_ids"])
+    assert saved["total"] == 5
+    print(f"✅ 5 recordings streamed as NDJSON (max {stub.state.max_in_flight} in flight) and saved in bulk")
+
+def test_batch_without_save_and_metadata_validation():
+    """save=false skips persistence and mismatched metadata is rejected before processing"""
+    # Dify未設定（モック応答）で処理する
+    settings = main.dify_settings
+    main.dify_settings = DifySettings()
+    try:
+        with temp_record_store(), TestClient(main.app) as client:
+            response = client.post("/api/process-audio/batch", files=audio_files(2), data={"metadata": json.dumps([{"patient_id": "P-1"}])})
+            assert response.status_code == 400
+
+            response = client.post("/api/process-audio/batch?save=false", files=audio_files(3))
+            lines = [json.loads(line) for line in response.text.splitlines() if line]
+            total = client.get("/api/records", params={"include_total": True}).json()["total"]
+    finally:
+        main.dify_settings = settings
+
+    assert response.status_code == 200
+    assert len(lines) == 4
+    assert lines[-1]["succeeded"] == 3
+    assert lines[-1]["record_ids"] == [None, None, None]
+    assert total == 0
+    print("✅ save=false skips persistence and metadata count is validated")
+
+def test_batch_rejects_too_many_files():
+    """More files than AUDIO_BATCH_MAX_FILES are rejected"""
+    max_files = main.AUDIO_BATCH_MAX_FILES
+    main.AUDIO_BATCH_MAX_FILES = 2
+    try:
+        with TestClient(main.app) as client:
+            response = client.post("/api/process-audio/batch", files=audio_files(3))
+    finally:
+        main.AUDIO_BATCH_MAX_FILES = max_files
+    assert response.status_code == 400
+    print("✅ Batch size limit enforced")
+
+if __name__ == "__main__":
+    print("🚀 Starting Batch Audio Test")
+    print("=" * 50)
+    test_batch_streams_results_and_saves_in_bulk()
+    test_batch_without_save_and_metadata_validation()
+    test_batch_rejects_too_many_files()
+    print("=" * 50)
+    print("🎉 All tests passed!")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Test script for bulk export from /api/records/export
+Checks the CSV BOM and quoting, NDJSON and Parquet round trips, the date filter including the whole date_to day,
+batched reads and the 400/501 responses
+"""
+
+import asyncio
+import csv
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.export import EXPORT_FIELDS, stream_csv
+from app.storage import SQLiteRecordStore
+
+# Parquet出力はオプション（poetry install -E parquet）
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+RECORDS = [
+    {"patient_id": "P-001", "consultation_date": "2025-01-10 09:00", "chief_complaint": "腹痛, 下痢", "diagnosis": "急性胃腸炎"},
+    {"patient_id": "P-002", "consultation_date": "2025-01-11 23:30", "chief_complaint": '"胸やけ"', "diagnosis": "逆流性食道炎",
+     "notes": "1行目\n2行目"},
+    {"patient_id": "P-003", "consultation_date": "2025-01-12 08:00", "chief_complaint": "咳", "diagnosis": "感冒", "notes": None},
+]
+
+def test_csv_quoting_and_bom():
+    """CSV starts with a BOM and quotes commas, quotes and newlines so the rows round-trip"""
+    async def batches():
+        yield [dict(record, id=i + 1) for i, record in enumerate(RECORDS[:2])]
+        yield [dict(RECORDS[2], id=3)]
+
+    async def collect():
+        return b"".join([chunk async for chunk in stream_csv(batches())])
+
+    body = asyncio.run(collect()).decode("utf-8")
+    assert body.startswith("\ufeff")
+    rows = list(csv.DictReader(io.StringIO(body[1:])))
+    assert list(rows[0]) == EXPORT_FIELDS
+    assert [row["chief_complaint"] for row in rows] == ["腹痛, 下痢", '"胸やけ"', "咳"]
+    assert rows[1]["notes"] == "1行目\n2行目" and rows[2]["notes"] == ""
+    print("✅ CSV has a BOM and quotes special characters")
+
+def test_export_endpoint_formats_and_filters():
+    """Every format exports the same filtered rows, date_to includes the whole day and bad formats are rejected"""
+    formats = ("csv", "ndjson", "parquet") if HAS_PYARROW else ("csv", "ndjson")
+    store, batch_size = main.record_store, main.RECORDS_EXPORT_BATCH_SIZE
+    main.RECORDS_EXPORT_BATCH_SIZE = 1
+    with tempfile.TemporaryDirectory() as directory:
+        main.record_store = SQLiteRecordStore(os.path.join(directory, "records.sqlite3"))
+        try:
+            with TestClient(main.app) as client:
+                client.portal.call(main.record_store.save_many, RECORDS)
+                params = {"date_from": "2025-01-11", "date_to": "2025-01-11"}
+                responses = {fmt: client.get("/api/records/export", params={**params, "format": fmt}) for fmt in formats}
+                everything = client.get("/api/records/export", params={"format": "ndjson"})
+                unsupported = client.get("/api/records/export", params={"format": "xml"})
+                pyarrow_module = sys.modules.get("pyarrow")
+                sys.modules["pyarrow"] = None
+                try:
+                    without_pyarrow = client.get("/api/records/export", params={"format": "parquet"})
+                finally:
+                    if pyarrow_module is None:
+                        del sys.modules["pyarrow"]
+                    else:
+                        sys.modules["pyarrow"] = pyarrow_module
+        finally:
+            main.record_store, main.RECORDS_EXPORT_BATCH_SIZE = store, batch_size
+
+    for fmt, response in responses.items():
+        assert response.status_code == 200, fmt
+        assert response.headers["content-type"].startswith(main.EXPORT_MEDIA_TYPES[fmt].split(";")[0])
+        assert response.headers["content-disposition"].endswith(f'.{fmt}"')
+    csv_rows = list(csv.DictReader(io.StringIO(responses["csv"].content.decode("utf-8")[1:])))
+    ndjson_rows = [json.loads(line) for line in responses["ndjson"].text.splitlines()]
+    assert [row["patient_id"] for row in csv_rows] == ["P-002"]
+    assert list(ndjson_rows[0]) == EXPORT_FIELDS
+    if HAS_PYARROW:
+        import pyarrow.parquet as pq
+
+        assert pq.read_table(io.BytesIO(responses["parquet"].content)).to_pylist() == ndjson_rows
+    assert ndjson_rows[0]["consultation_date"] == "2025-01-11 23:30" and ndjson_rows[0]["notes"] == "1行目\n2行目"
+    assert [json.loads(line)["id"] for line in everything.text.splitlines()] == [1, 2, 3]
+    assert unsupported.status_code == 400
+    assert without_pyarrow.status_code == 501 and "pyarrow" in without_pyarrow.json()["detail"]
+    print("✅ CSV, NDJSON and Parquet exports agree and honour the date filter")
+
+if __name__ == "__main__":
+    print("🚀 Starting Bulk Export Test")
+    print("=" * 50)
+    test_csv_quoting_and_bom()
+    test_export_endpoint_formats_and_filters()
+    print("=" * 50)
+    print("🎉 All tests passed!")
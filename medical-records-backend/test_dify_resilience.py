@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Test script for the Dify circuit breaker, retry budget and hedged uploads
+Runs against the fault-injecting local Dify stub (no real Dify API needed)
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+from app import main
+from app.resilience import CircuitBreaker, CircuitOpenError, RetryBudget, call_with_resilience
+from app.settings import DifySettings
+from benchmarks.dify_stub import create_stub_app, run_stub_server
+
+def reset_resilience(failure_threshold: int = 3, recovery_timeout: float = 30.0, **settings):
+    main.dify_settings = DifySettings(retry_base_delay=0.01, retry_max_delay=0.05, http2=False, **settings)
+    main.dify_breaker = CircuitBreaker("dify", failure_threshold=failure_threshold, recovery_timeout=recovery_timeout)
+    main.dify_retry_budget = RetryBudget(ratio=0.2, min_per_second=1.0)
+
+def write_audio() -> str:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
+        f.write(b"RIFF" + b"\0" * 4096)
+        return f.name
+
+async def run_with_stub(stub, coroutine_factory):
+    with run_stub_server(app=stub) as api_url:
+        try:
+            return await coroutine_factory(api_url)
+        finally:
+            await main.get_dify_client().aclose()
+
+def test_retry_recovers_from_transient_errors():
+    """Two injected 503s are retried and the upload succeeds"""
+    reset_resilience()
+    stub = create_stub_app()
+    stub.state.failures = 2
+    audio_path = write_audio()
+    try:
+        file_id = asyncio.run(run_with_stub(stub, lambda url: main.upload_file_to_dify(audio_path, "key", url)))
+    finally:
+        os.unlink(audio_path)
+    assert file_id
+    assert stub.state.calls["upload"] == 3
+    assert main.dify_breaker.state == "closed"
+    print("✅ Transient 503s are retried with backoff")
+
+def test_client_errors_are_not_retried():
+    """A 400 from Dify is returned immediately and does not trip the breaker"""
+    reset_resilience()
+    stub = create_stub_app()
+    stub.state.failures = 1
+    stub.state.failure_status = 400
+    audio_path = write_audio()
+    try:
+        asyncio.run(run_with_stub(stub, lambda url: main.upload_file_to_dify(audio_path, "key", url)))
+        raise AssertionError("expected DifyAPIError")
+    except main.DifyAPIError as e:
+        assert e.status_code == 400
+    finally:
+        os.unlink(audio_path)
+    assert stub.state.calls["upload"] == 1
+    assert main.dify_breaker.consecutive_failures == 0
+    print("✅ Client errors are not retried")
+
+def test_workflow_retries_only_unsent_errors():
+    """A workflow 503 is retried, but a read timeout (Dify may still be running it) is not run again"""
+    import httpx
+
+    reset_resilience()
+    stub = create_stub_app()
+    stub.state.failures = 1
+    result = asyncio.run(run_with_stub(stub, lambda url: main.send_workflow_to_dify("prompt", "file-id", "key", url, "app")))
+    assert result["diagnosis"] and stub.state.calls["workflow"] == 2
+
+    reset_resilience(read_timeout=0.1)
+    stub = create_stub_app()
+    stub.state.slow_calls = 3
+    stub.state.slow_latency = 0.5
+    try:
+        asyncio.run(run_with_stub(stub, lambda url: main.send_workflow_to_dify("prompt", "file-id", "key", url, "app")))
+        raise AssertionError("expected ReadTimeout")
+    except httpx.ReadTimeout:
+        pass
+    assert stub.state.calls["workflow"] == 1
+    assert main.dify_breaker.consecutive_failures == 1
+    print("✅ Workflow read timeouts are not retried")
+
+def test_breaker_opens_and_fails_fast():
+    """After an outage the breaker opens and callers fall back without waiting"""
+    reset_resilience(failure_threshold=3, retry_max_attempts=1)
+    stub = create_stub_app()
+    stub.state.failure_rate = 1.0
+    audio_path = write_audio()
+
+    async def scenario(api_url):
+        main.dify_settings = main.dify_settings.model_copy(update={"api_url": api_url, "api_key": "key", "app_id": "app"})
+        main.audio_cache = None
+        for _ in range(3):
+            await main.process_with_dify_agent(audio_path, {"id": "P-1"})
+        calls_before = stub.state.calls["upload"]
+        start = time.perf_counter()
+        result = await main.process_with_dify_agent(audio_path, {"id": "P-1"})
+        return calls_before, time.perf_counter() - start, result
+
+    try:
+        calls_before, elapsed, result = asyncio.run(run_with_stub(stub, scenario))
+    finally:
+        os.unlink(audio_path)
+        main.audio_cache = main.create_audio_cache()
+        main.dify_settings = DifySettings()
+    assert main.dify_breaker.state == "open"
+    assert stub.state.calls["upload"] == calls_before
+    assert elapsed < 0.1
+    assert result["medical_record"]["patient_id"] == "P-1"
+    print(f"✅ Open circuit fails fast ({elapsed * 1000:.1f}ms) and falls back to mock response")
+
+def test_breaker_half_open_recovers():
+    """After the recovery timeout a single trial call closes the breaker again"""
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0.05)
+    breaker.before_call()
+    breaker.record_failure()
+    try:
+        breaker.before_call()
+        raise AssertionError("expected CircuitOpenError")
+    except CircuitOpenError:
+        pass
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    breaker.record_success()
+    assert breaker.state == "closed"
+    print("✅ Half-open trial call closes the breaker")
+
+def test_cancelled_half_open_probe_is_released():
+    """A half-open probe that is cancelled or abandoned re-opens the breaker instead of rejecting calls forever"""
+    async def scenario():
+        breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0.05)
+        budget = RetryBudget()
+        breaker.record_failure()
+        await asyncio.sleep(0.06)
+        probe = asyncio.create_task(call_with_resilience(lambda: asyncio.sleep(10), breaker, budget, lambda e: True))
+        await asyncio.sleep(0.01)
+        assert breaker.state == "half_open"
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        assert breaker.state == "open"
+        await asyncio.sleep(0.06)
+        assert await call_with_resilience(lambda: asyncio.sleep(0, "ok"), breaker, budget, lambda e: True) == "ok"
+        return breaker.state
+
+    assert asyncio.run(scenario()) == "closed"
+
+    async def stream_scenario(api_url):
+        main.dify_breaker.record_failure()
+        await asyncio.sleep(0.06)
+        events = main.stream_workflow_from_dify("prompt", "file-id", "key", api_url, "app")
+        await events.__anext__()
+        assert main.dify_breaker.state == "half_open"
+        await events.aclose()
+        return main.dify_breaker.state
+
+    reset_resilience(failure_threshold=1, recovery_timeout=0.05)
+    try:
+        assert asyncio.run(run_with_stub(create_stub_app(latency=0.05), stream_scenario)) == "open"
+    finally:
+        reset_resilience()
+    print("✅ Cancelled half-open probes release the probe slot")
+
+def test_retry_budget_limits_retry_storms():
+    """The global budget stops granting retries once the window allowance is used"""
+    budget = RetryBudget(ratio=0.1, min_per_second=0.5, window=10.0)
+    for _ in range(20):
+        budget.record_call()
+    granted = sum(budget.try_acquire() for _ in range(50))
+    assert granted == 7
+    print("✅ Retry budget caps retries to min + ratio * calls")
+
+def test_hedged_upload_beats_slow_attempt():
+    """With hedging enabled a slow first upload is overtaken by the second attempt"""
+    reset_resilience(upload_hedge_delay=0.05)
+    stub = create_stub_app()
+    stub.state.slow_calls = 1
+    stub.state.slow_latency = 1.0
+    audio_path = write_audio()
+
+    async def scenario(api_url):
+        start = time.perf_counter()
+        file_id = await main.upload_file_to_dify(audio_path, "key", api_url)
+        return file_id, time.perf_counter() - start
+
+    try:
+        file_id, elapsed = asyncio.run(run_with_stub(stub, scenario))
+    finally:
+        os.unlink(audio_path)
+        reset_resilience()
+    assert file_id
+    assert stub.state.calls["upload"] == 2
+    assert elapsed < 0.5
+    print(f"✅ Hedged upload finished in {elapsed * 1000:.0f}ms despite a 1s slow attempt")
+
+def test_healthz_reports_breaker_state():
+    """/healthz exposes the breaker state"""
+    from fastapi.testclient import TestClient
+
+    reset_resilience(failure_threshold=1)
+    main.dify_breaker.record_failure()
+    with TestClient(main.app) as client:
+        body = client.get("/healthz").json()
+    assert body["dify_circuit"]["state"] == "open"
+    reset_resilience()
+    print("✅ /healthz reports circuit state")
+
+if __name__ == "__main__":
+    print("🚀 Starting Dify Resilience Test")
+    print("=" * 50)
+    test_retry_recovers_from_transient_errors()
+    test_client_errors_are_not_retried()
+    test_workflow_retries_only_unsent_errors()
+    test_breaker_opens_and_fails_fast()
+    test_breaker_half_open_recovers()
+    test_cancelled_half_open_probe_is_released()
+    test_retry_budget_limits_retry_storms()
+    test_hedged_upload_beats_slow_attempt()
+    test_healthz_reports_breaker_state()
+    print("=" * 50)
+    print("🎉 All tests passed!")
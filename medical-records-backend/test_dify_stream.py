@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Test script for the Dify streaming parser
+Replays the recorded event stream in fixtures/ through the SSE parser and the /api/process-audio/stream endpoint
+"""
+
+import asyncio
+import json
+import os
+
+from app.dify_stream import iter_sse_events, StructuredOutputTracker
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "dify_workflow_stream.txt")
+
+async def replay_fixture(chunk_size: int):
+    """Feed the fixture as arbitrarily split network chunks and re-join them into lines"""
+    with open(FIXTURE_PATH, encoding="utf-8") as f:
+        raw = f.read()
+
+    async def lines():
+        buffer = ""
+        for i in range(0, len(raw), chunk_size):
+            buffer += raw[i:i + chunk_size]
+            while "\n" in buffer:
+                line, buffer = buffer.split("\n", 1)
+                yield line
+        if buffer:
+            yield buffer
+
+    return [event async for event in iter_sse_events(lines())]
+
+def test_parser_reads_all_events():
+    """Every data event in the fixture is parsed regardless of chunk boundaries"""
+    for chunk_size in (1, 7, 64, 100000):
+        events = asyncio.run(replay_fixture(chunk_size))
+        kinds = [e["event"] for e in events]
+        assert kinds[0] == "workflow_started"
+        assert kinds[-1] == "workflow_finished"
+        assert "ping" not in kinds
+        assert kinds.count("node_started") == 2
+    print("✅ SSE parser handles arbitrary chunk boundaries")
+
+def test_tracker_emits_partial_fields_before_finish():
+    """Structured fields are available from text chunks before the workflow finishes"""
+    events = asyncio.run(replay_fixture(64))
+    tracker = StructuredOutputTracker()
+    first_seen = {}
+    for index, event in enumerate(events):
+        for field in tracker.feed(event):
+            first_seen.setdefault(field, index)
+
+    finished_index = len(events) - 1
+    assert set(first_seen) == {"subjective", "objective", "assessment", "plan"}
+    assert all(index < finished_index for index in first_seen.values())
+    assert tracker.fields["assessment"] == "急性胃腸炎の疑い"
+    assert tracker.outputs["structured_output"] == tracker.fields
+    print("✅ Partial structured_output fields are emitted incrementally")
+
+def test_stream_endpoint_with_stub():
+    """The SSE endpoint forwards progress, partial fields and the final record"""
+    from fastapi.testclient import TestClient
+    from app import main
+    from app.settings import DifySettings
+    from benchmarks.dify_stub import run_stub_server
+
+    with run_stub_server(latency=0.05) as api_url:
+        main.dify_settings = DifySettings(api_url=api_url, api_key="test-key", app_id="test-app", http2=False)
+        with TestClient(main.app) as client:
+            response = client.post(
+                "/api/process-audio/stream",
+                files={"audio_file": ("test_audio.wav", b"RIFF" + b"\0" * 1024, "audio/wav")},
+                data={"patient_id": "P-2025-001"}
+            )
+
+    assert response.status_code == 200
+    messages = [m for m in response.text.split("\n\n") if m]
+    events = [(m.split("\n")[0][len("event: "):], json.loads(m.split("\n")[1][len("data: "):])) for m in messages]
+    names = [name for name, _ in events]
+    assert names.index("progress") < names.index("partial") < names.index("result")
+    result = events[-1][1]
+    assert result["medical_record"]["diagnosis"] == "急性胃腸炎の疑い"
+    print("✅ /api/process-audio/stream forwards progress, partial fields and result")
+
+if __name__ == "__main__":
+    print("🚀 Starting Dify Streaming Test")
+    print("=" * 50)
+    test_parser_reads_all_events()
+    test_tracker_emits_partial_fields_before_finish()
+    test_stream_endpoint_with_stub()
+    print("=" * 50)
+    print("🎉 All tests passed!")
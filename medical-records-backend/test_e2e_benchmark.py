@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Test script for the end-to-end benchmark suite
+Runs every scenario once against the in-process app and Dify stub and checks the report and baseline comparison
+"""
+
+import json
+import os
+import tempfile
+import wave
+
+from app import main
+from benchmarks.bench_e2e import compare_with_baseline, main_, parse_args, write_wav_fixtures
+
+def test_wav_fixtures_have_requested_lengths():
+    """Fixtures are valid WAV files of the requested durations (plus 1s of padding)"""
+    with tempfile.TemporaryDirectory() as directory:
+        fixtures = write_wav_fixtures(directory, [1.0, 2.5], sample_rate=16000)
+        lengths = {}
+        for label, path in fixtures.items():
+            with wave.open(path) as wav_file:
+                lengths[label] = wav_file.getnframes() / wav_file.getframerate()
+    assert lengths == {"1s": 2.0, "2.5s": 3.5}
+    print("✅ WAV fixtures generated with requested durations")
+
+def test_suite_reports_every_endpoint():
+    """A small run covers every endpoint without errors and writes a JSON report"""
+    store, cache, settings = main.record_store, main.audio_cache, main.dify_settings
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "results.json")
+        args = parse_args([
+            "--requests", "2", "--concurrency", "2", "--durations", "1", "--batch-size", "2",
+            "--upload-latency", "0.01", "--workflow-latency", "0.01", "--output", output
+        ])
+        exit_code = main_(args)
+        with open(output, encoding="utf-8") as f:
+            report = json.load(f)
+    assert exit_code == 0
+    assert main.record_store is store and main.audio_cache is cache and main.dify_settings is settings
+    endpoints = [result["endpoint"] for result in report["results"]]
+    assert len(endpoints) == 7
+    assert any(endpoint.startswith("GET /api/records/search") for endpoint in endpoints)
+    for result in report["results"]:
+        assert result["errors"] == 0
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+        assert result["throughput_rps"] > 0 and result["peak_rss_mb"] > 0
+    print(f"✅ Benchmark suite reported {len(endpoints)} endpoints")
+
+def test_baseline_comparison_flags_regressions():
+    """Endpoints whose p95 grows or throughput drops beyond the threshold are reported"""
+    baseline = {"results": [
+        {"endpoint": "A", "p95_ms": 100.0, "throughput_rps": 10.0},
+        {"endpoint": "B", "p95_ms": 100.0, "throughput_rps": 10.0},
+        {"endpoint": "C", "p95_ms": 100.0, "throughput_rps": 10.0},
+    ]}
+    current = [
+        {"endpoint": "A", "p95_ms": 110.0, "throughput_rps": 9.5},
+        {"endpoint": "B", "p95_ms": 150.0, "throughput_rps": 10.0},
+        {"endpoint": "C", "p95_ms": 100.0, "throughput_rps": 5.0},
+    ]
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(baseline, f)
+    try:
+        assert compare_with_baseline(current, f.name, 0.2) == ["B", "C"]
+    finally:
+        os.unlink(f.name)
+    print("✅ Baseline comparison flags regressions")
+
+if __name__ == "__main__":
+    print("🚀 Starting End-to-End Benchmark Test")
+    print("=" * 50)
+    test_wav_fixtures_have_requested_lengths()
+    test_suite_reports_every_endpoint()
+    test_baseline_comparison_flags_regressions()
+    print("=" * 50)
+    print("🎉 All tests passed!")
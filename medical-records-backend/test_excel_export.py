@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Test script for the streaming Excel export
+Checks the xlsx package written by StreamingXlsxWriter and the /api/export-to-excel endpoint with filters
+"""
+
+import asyncio
+import io
+import os
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.export import stream_xlsx
+from app.sheets import SHEET_HEADER
+
+NS = {"x": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+
+def read_sheet(data: bytes) -> list:
+    """Read every row of the first worksheet as a list of cell values"""
+    with zipfile.ZipFile(io.BytesIO(data)) as package:
+        assert package.testzip() is None
+        root = ET.fromstring(package.read("xl/worksheets/sheet1.xml"))
+    rows = []
+    for row in root.iterfind("x:sheetData/x:row", NS):
+        values = []
+        for cell in row.iterfind("x:c", NS):
+            if cell.get("t") == "inlineStr":
+                values.append(cell.find("x:is/x:t", NS).text)
+            else:
+                values.append(int(cell.find("x:v", NS).text))
+        rows.append(values)
+    return rows
+
+async def collect(batches) -> list:
+    return [chunk async for chunk in stream_xlsx(batches)]
+
+def test_writer_escapes_and_streams():
+    """Cells are XML-escaped, control characters removed and output is produced batch by batch"""
+    pulled = []
+
+    async def batches():
+        for b in range(20):
+            pulled.append(b)
+            yield [{"id": b * 500 + i, "patient_id": f"P-{i}", "chief_complaint": "腹痛 <&> \x01 " + os.urandom(200).hex(), "notes": None} for i in range(500)]
+
+    chunks = asyncio.run(collect(batches()))
+    data = b"".join(chunks)
+    rows = read_sheet(data)
+    assert rows[0] == SHEET_HEADER
+    assert len(rows) == 10_001
+    assert rows[1][:2] == [0, "P-0"]
+    assert rows[1][2].startswith("腹痛 <&>  ")
+    assert len([chunk for chunk in chunks if chunk]) > 5
+    print(f"✅ Writer escapes cells and streamed {len(chunks)} chunks for {len(rows) - 1} rows")
+
+def test_export_to_excel_endpoint_with_filters():
+    """POST /api/export-to-excel streams an xlsx attachment and applies patient and date filters"""
+    directory = tempfile.mkdtemp()
+    main.record_store = main.SQLiteRecordStore(os.path.join(directory, "records.sqlite3"))
+    with TestClient(main.app) as client:
+        for i in range(6):
+            client.post("/api/save-record", json={
+                "patient_id": f"P-{i % 2}",
+                "consultation_date": "2025-06-01 10:00",
+                "chief_complaint": f"主訴{i}",
+                "present_illness": "", "physical_examination": "", "diagnosis": "急性胃腸炎の疑い",
+                "prescription": "", "guidance": "", "next_appointment": ""
+            }).raise_for_status()
+        response = client.post("/api/export-to-excel", params={"patient_id": "P-1"})
+        empty = client.post("/api/export-to-excel", params={"date_to": "2000-01-01"})
+        export = client.get("/api/records/export", params={"format": "xlsx"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    assert response.headers["content-disposition"].endswith('.xlsx"')
+    rows = read_sheet(response.content)
+    assert [row[3] for row in rows[1:]] == ["主訴1", "主訴3", "主訴5"]
+    assert {row[1] for row in rows[1:]} == {"P-1"}
+    assert read_sheet(empty.content) == [SHEET_HEADER]
+    assert len(read_sheet(export.content)) == 7
+    print("✅ /api/export-to-excel streams filtered records")
+
+if __name__ == "__main__":
+    print("🚀 Starting Excel Export Test")
+    print("=" * 50)
+    test_writer_escapes_and_streams()
+    test_export_to_excel_endpoint_with_filters()
+    print("=" * 50)
+    print("🎉 All tests passed!")
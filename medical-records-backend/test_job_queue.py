@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Test script for job mode on /api/process-audio with the single-worker in-memory job store
+Checks the 202 on submission, the 429 backpressure when the queue is full and the /api/jobs/{id}/result states
+"""
+
+import asyncio
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.jobs import MemoryJobStore
+
+def upload(patient_id: str) -> dict:
+    return {
+        "params": {"mode": "job"},
+        "files": {"audio_file": ("test.wav", b"RIFF" + b"\0" * 1024, "audio/wav")},
+        "data": {"patient_id": patient_id},
+    }
+
+def wait_for_status(client: TestClient, job_id: str, statuses: tuple) -> dict:
+    for _ in range(200):
+        job = client.get(f"/api/jobs/{job_id}").json()
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not reach {statuses}")
+
+def test_queue_backpressure_and_result_states():
+    """A full queue answers 429, unfinished jobs answer 202 and failed jobs 500 with the error"""
+    queue = main.audio_job_queue
+    saved = queue.handler, queue.concurrency, queue.maxsize
+    release = threading.Event()
+
+    async def blocking_handler(payload: dict) -> dict:
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        await main.remove_file(payload["audio_path"])
+        if payload["patient_data"]["id"] == "P-fail":
+            raise RuntimeError("Dify unavailable")
+        return await main.fallback_mock_response(payload["patient_data"])
+
+    queue.handler, queue.concurrency, queue.maxsize = blocking_handler, 1, 1
+    try:
+        assert isinstance(queue.store, MemoryJobStore)
+        with TestClient(main.app) as client:
+            running = client.post("/api/process-audio", **upload("P-fail"))
+            assert running.status_code == 202 and running.json()["status"] == "queued"
+            running_id = running.json()["job_id"]
+            wait_for_status(client, running_id, ("running",))
+
+            queued = client.post("/api/process-audio", **upload("P-ok"))
+            rejected = client.post("/api/process-audio", **upload("P-rejected"))
+            queued_id = queued.json()["job_id"]
+            pending = [client.get(f"/api/jobs/{job_id}/result") for job_id in (running_id, queued_id)]
+            depth = client.get("/metrics").text
+
+            release.set()
+            wait_for_status(client, queued_id, ("succeeded", "failed"))
+            failed = client.get(f"/api/jobs/{running_id}/result")
+            succeeded = client.get(f"/api/jobs/{queued_id}/result")
+            missing = client.get("/api/jobs/unknown/result")
+    finally:
+        release.set()
+        queue.handler, queue.concurrency, queue.maxsize = saved
+
+    assert queued.status_code == 202
+    assert rejected.status_code == 429 and "上限" in rejected.json()["detail"]
+    assert [r.status_code for r in pending] == [202, 202]
+    assert [r.json()["status"] for r in pending] == ["running", "queued"]
+    assert "medical_records_job_queue_depth" in depth
+    assert failed.status_code == 500 and "Dify unavailable" in failed.json()["detail"]
+    assert succeeded.status_code == 200 and succeeded.json()["medical_record"]["patient_id"] == "P-ok"
+    assert missing.status_code == 404
+    print("✅ Job queue applies backpressure and reports 202/500/200 results")
+
+if __name__ == "__main__":
+    print("🚀 Starting Job Queue Test")
+    print("=" * 50)
+    test_queue_backpressure_and_result_states()
+    print("=" * 50)
+    print("🎉 All tests passed!")
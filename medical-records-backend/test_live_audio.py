@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Test script for the live recording WebSocket endpoint
+Streams audio chunks over /api/process-audio/live against the local Dify stub and checks spooling, early upload and errors
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app import main
+from app.audio import synthesize_wav
+from app.live import LiveAudioSpool, LiveChunkStream, SpoolFullError
+from app.settings import DifySettings
+from benchmarks.bench_admission import configured_admission
+from benchmarks.dify_stub import create_stub_app, run_stub_server
+
+LIVE_URL = "/api/process-audio/live"
+
+def chunks_of(data: bytes, size: int) -> list:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+@contextmanager
+def dify_stub():
+    """Run the stub with the Dify settings pointed at it and the audio cache disabled"""
+    stub = create_stub_app(latency=0.05)
+    cache = main.audio_cache
+    main.audio_cache = None
+    try:
+        with run_stub_server(app=stub) as api_url:
+            main.dify_settings = DifySettings(api_url=api_url, api_key="key", app_id="app", http2=False)
+            yield stub
+    finally:
+        main.audio_cache = cache
+        main.dify_settings = DifySettings()
+
+def expect_close(ws) -> tuple:
+    """Read the error message and the close code sent by the server"""
+    error = ws.receive_json()
+    try:
+        ws.receive_json()
+    except WebSocketDisconnect as e:
+        return error, e.code
+    raise AssertionError("connection was not closed")
+
+def test_spool_rolls_over_and_hashes():
+    """The spool keeps small recordings in memory, moves large ones to disk and hashes while receiving"""
+    data = os.urandom(300_000)
+
+    async def run():
+        spool = LiveAudioSpool(max_bytes=400_000, memory_bytes=100_000, suffix=".webm")
+        for chunk in chunks_of(data, 64_000):
+            await spool.append(chunk)
+        await spool.finish()
+        path = spool.path
+        with open(path, "rb") as f:
+            assert f.read() == data
+        assert spool.hexdigest() == hashlib.sha256(data).hexdigest()
+        try:
+            await spool.append(data)
+            raise AssertionError("limit not enforced")
+        except SpoolFullError:
+            pass
+        await spool.discard()
+        return path
+
+    path = asyncio.run(run())
+    assert path.endswith(".webm") and not os.path.exists(path)
+    print("✅ Spool rolls over to disk, hashes incrementally and enforces the size limit")
+
+def test_chunk_stream_abandon_releases_feeder():
+    """A failed early upload never blocks the receive loop"""
+    async def run():
+        stream = LiveChunkStream(maxsize=1)
+        await stream.feed(b"a")
+        blocked = asyncio.create_task(stream.feed(b"b"))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        stream.abandon()
+        await asyncio.wait_for(blocked, 1)
+        await asyncio.wait_for(stream.feed(b"c"), 1)
+        await asyncio.wait_for(stream.close(), 1)
+
+    asyncio.run(run())
+    print("✅ Abandoned chunk stream releases waiting feeders")
+
+def test_early_upload_overlaps_recording():
+    """With early_upload the Dify upload starts while chunks are still arriving"""
+    audio = os.urandom(200_000)
+    with dify_stub() as stub, TestClient(main.app) as client:
+        with client.websocket_connect(LIVE_URL) as ws:
+            ws.send_json({"type": "start", "patient_id": "P-1", "filename": "recording.webm", "content_type": "audio/webm", "early_upload": True})
+            assert ws.receive_json() == {"type": "ready", "early_upload": True, "max_bytes": main.MAX_AUDIO_UPLOAD_BYTES}
+            parts = chunks_of(audio, 50_000)
+            for part in parts[:-1]:
+                ws.send_bytes(part)
+                ws.receive_json()
+            deadline = time.time() + 5
+            while stub.state.uploads_started == 0 and time.time() < deadline:
+                time.sleep(0.01)
+            assert stub.state.uploads_started == 1 and stub.state.calls["upload"] == 0
+            ws.send_bytes(parts[-1])
+            assert ws.receive_json() == {"type": "ack", "bytes": len(audio)}
+            ws.send_json({"type": "stop"})
+            result = ws.receive_json()
+
+    assert result["type"] == "result" and result["early_upload"] is True
+    assert result["recording_bytes"] == len(audio)
+    assert result["medical_record"]["diagnosis"] == "急性胃腸炎の疑い"
+    assert stub.state.calls == {"upload": 1, "workflow": 1}
+    assert stub.state.upload_bytes > len(audio)
+    print("✅ Early upload streams chunks to Dify during the recording")
+
+def test_spooled_wav_is_preprocessed_after_stop():
+    """Without early upload a recording spooled to disk goes through the normal preprocessing path"""
+    audio = synthesize_wav(5.0, sample_rate=44100, channels=2)
+    main.LIVE_AUDIO_MEMORY_BYTES = 100_000
+    try:
+        with dify_stub() as stub, TestClient(main.app) as client:
+            with client.websocket_connect(LIVE_URL) as ws:
+                ws.send_json({"type": "start", "filename": "recording.wav", "content_type": "audio/wav"})
+                assert ws.receive_json()["early_upload"] is False
+                for part in chunks_of(audio, 64_000):
+                    ws.send_bytes(part)
+                    ws.receive_json()
+                ws.send_json({"type": "stop"})
+                result = ws.receive_json()
+    finally:
+        main.LIVE_AUDIO_MEMORY_BYTES = 8 * 1024 * 1024
+
+    assert result["early_upload"] is False
+    assert result["medical_record"]["diagnosis"] == "急性胃腸炎の疑い"
+    assert stub.state.calls["upload"] == 1
+    assert stub.state.upload_bytes < len(audio) / 4
+    print(f"✅ Spooled WAV preprocessed after stop ({len(audio)} -> {stub.state.upload_bytes} bytes uploaded)")
+
+def test_long_wav_stops_early_upload():
+    """A live WAV recording that becomes long enough to be segmented is not uploaded a second time as a whole"""
+    audio = synthesize_wav(4.0, sample_rate=16000)
+    threshold = main.AUDIO_SEGMENT_THRESHOLD_SECONDS, main.AUDIO_SEGMENT_TARGET_SECONDS
+    main.AUDIO_SEGMENT_THRESHOLD_SECONDS, main.AUDIO_SEGMENT_TARGET_SECONDS = 2.0, 1.0
+    try:
+        with dify_stub() as stub, TestClient(main.app) as client:
+            with client.websocket_connect(LIVE_URL) as ws:
+                ws.send_json({"type": "start", "filename": "recording.wav", "content_type": "audio/wav", "early_upload": True})
+                assert ws.receive_json()["early_upload"] is True
+                for part in chunks_of(audio, 16_000):
+                    ws.send_bytes(part)
+                    ws.receive_json()
+                ws.send_json({"type": "stop"})
+                result = ws.receive_json()
+    finally:
+        main.AUDIO_SEGMENT_THRESHOLD_SECONDS, main.AUDIO_SEGMENT_TARGET_SECONDS = threshold
+        if main.audio_preprocess_pool is not None:
+            main.audio_preprocess_pool.shutdown()
+            main.audio_preprocess_pool = None
+
+    assert result["type"] == "result" and result["early_upload"] is False
+    assert stub.state.calls["upload"] == stub.state.calls["workflow"] > 1
+    # 中止した先行アップロードは途中までしか送られない（録音全体を2回送っていない）
+    assert stub.state.upload_bytes < len(audio) * 2
+    print(f"✅ Early upload stopped for a long WAV, {stub.state.calls['upload']} segments uploaded once")
+
+def test_protocol_errors_close_the_session():
+    """Missing start, oversized recordings and empty recordings are rejected with close codes"""
+    with TestClient(main.app) as client:
+        with client.websocket_connect(LIVE_URL) as ws:
+            ws.send_bytes(b"RIFF")
+            error, code = expect_close(ws)
+        assert error["type"] == "error" and code == 1008
+
+        with client.websocket_connect(LIVE_URL) as ws:
+            ws.send_json({"type": "start", "filename": "notes.txt", "content_type": "text/plain"})
+            error, code = expect_close(ws)
+        assert error["detail"] == "音声ファイルのみアップロード可能です" and code == 1008
+
+        with client.websocket_connect(LIVE_URL) as ws:
+            ws.send_json({"type": "start"})
+            ws.receive_json()
+            ws.send_json({"type": "stop"})
+            error, code = expect_close(ws)
+        assert code == 1008
+
+        main.MAX_AUDIO_UPLOAD_BYTES = 1000
+        try:
+            with client.websocket_connect(LIVE_URL) as ws:
+                ws.send_json({"type": "start"})
+                ws.receive_json()
+                ws.send_bytes(b"\0" * 600)
+                ws.receive_json()
+                ws.send_bytes(b"\0" * 600)
+                error, code = expect_close(ws)
+        finally:
+            main.MAX_AUDIO_UPLOAD_BYTES = 512 * 1024 * 1024
+        assert code == 1009
+    print("✅ Protocol errors close the session with 1008/1009")
+
+def test_fallback_without_dify():
+    """Without Dify settings the live endpoint returns the fallback record"""
+    main.dify_settings = DifySettings()
+    with TestClient(main.app) as client:
+        with client.websocket_connect(LIVE_URL) as ws:
+            ws.send_json({"type": "start", "patient_name": "山田太郎", "early_upload": True})
+            assert ws.receive_json()["early_upload"] is False
+            ws.send_bytes(b"\x1aE\xdf\xa3" + b"\0" * 1000)
+            ws.receive_json()
+            ws.send_json({"type": "stop"})
+            result = ws.receive_json()
+    assert result["success"] is True and result["medical_record"]["chief_complaint"]
+    print("✅ Fallback record returned when Dify is not configured")
+
+def record_and_stop(ws) -> None:
+    """Send a short recording and the stop message"""
+    ws.send_json({"type": "start", "patient_name": "山田太郎"})
+    ws.receive_json()
+    ws.send_bytes(b"\x1aE\xdf\xa3" + b"\0" * 1000)
+    ws.receive_json()
+    ws.send_json({"type": "stop"})
+
+def test_processing_after_stop_is_admission_controlled():
+    """When every processing slot is busy the session is shed after stop with retry_after, otherwise it takes a slot"""
+    main.dify_settings = DifySettings()
+    controller = main.admission_controller
+    with TestClient(main.app) as client:
+        with configured_admission(max_concurrency=1, queue_size=0, rate_per_minute=0):
+            held = asyncio.run(controller.acquire("holder"))
+            rejected_before = controller.total_rejected["queue_full"]
+            with client.websocket_connect(LIVE_URL) as ws:
+                record_and_stop(ws)
+                error, code = expect_close(ws)
+            rejected = controller.total_rejected["queue_full"] - rejected_before
+            controller.release(held)
+
+            admitted_before = controller.total_admitted
+            with client.websocket_connect(LIVE_URL) as ws:
+                record_and_stop(ws)
+                result = ws.receive_json()
+            admitted = controller.total_admitted - admitted_before
+            active = controller.active
+
+    assert error["type"] == "error" and error["retry_after"] >= 1 and code == 1013
+    assert rejected == 1
+    assert result["type"] == "result" and admitted == 1 and active == 0
+    print("✅ Live processing after stop is shed with retry_after when all slots are busy")
+
+if __name__ == "__main__":
+    print("🚀 Starting Live Audio Test")
+    print("=" * 50)
+    test_spool_rolls_over_and_hashes()
+    test_chunk_stream_abandon_releases_feeder()
+    test_early_upload_overlaps_recording()
+    test_spooled_wav_is_preprocessed_after_stop()
+    test_long_wav_stops_early_upload()
+    test_protocol_errors_close_the_session()
+    test_fallback_without_dify()
+    test_processing_after_stop_is_admission_controlled()
+    print("=" * 50)
+    print("🎉 All tests passed!")
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Test script for multi-worker deployments with shared SQLite job, cache and record backends
+Simulates several worker processes in-process and runs a real `uvicorn --workers 2` server
+Also checks that exited workers' live gauges leave the multiprocess metrics aggregate
+"""
+
+import asyncio
+import os
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import httpx
+
+from app.cache import SQLiteCacheBackend
+from app.jobs import JobQueue, QueueFullError, SQLiteJobStore
+from benchmarks.bench_workers import BACKEND_DIR, run_app_server, sample_record
+
+def test_job_submitted_on_one_worker_runs_on_another():
+    """A job submitted through worker A is executed by worker B and visible from both"""
+    async def handler(payload):
+        return {"echo": payload["value"], "pid": "B"}
+
+    async def scenario(path):
+        store_a, store_b = SQLiteJobStore(path), SQLiteJobStore(path)
+        await store_a.start()
+        await store_b.start()
+        queue_a = JobQueue(handler, concurrency=0, kind="test", store=store_a, poll_interval=0.01)
+        queue_b = JobQueue(handler, concurrency=1, kind="test", store=store_b, poll_interval=0.01)
+        await queue_a.start()
+        await queue_b.start()
+        job_id = await queue_a.submit({"value": 42})
+        for _ in range(200):
+            job = await queue_a.get(job_id)
+            if job["status"] == "succeeded":
+                break
+            await asyncio.sleep(0.01)
+        seen_by_b = await queue_b.get(job_id)
+        for queue in (queue_a, queue_b):
+            await queue.stop()
+        for store in (store_a, store_b):
+            await store.close()
+        return job, seen_by_b
+
+    with tempfile.TemporaryDirectory() as directory:
+        job, seen_by_b = asyncio.run(scenario(os.path.join(directory, "jobs.sqlite3")))
+    assert job["status"] == "succeeded"
+    assert job["result"] == {"echo": 42, "pid": "B"}
+    assert seen_by_b["status"] == "succeeded"
+    print("✅ Job submitted on worker A ran on worker B")
+
+def test_each_job_runs_exactly_once():
+    """Workers competing for the same store never run a job twice"""
+    executed = []
+
+    async def handler(payload):
+        executed.append(payload["n"])
+        await asyncio.sleep(0.001)
+        return payload["n"]
+
+    async def scenario(path):
+        stores = [SQLiteJobStore(path) for _ in range(3)]
+        queues = []
+        for store in stores:
+            await store.start()
+            queue = JobQueue(handler, concurrency=3, maxsize=1000, kind="test", store=store, poll_interval=0.01)
+            await queue.start()
+            queues.append(queue)
+        job_ids = [await queues[n % 3].submit({"n": n}) for n in range(60)]
+        for _ in range(500):
+            jobs = [await queues[0].get(job_id) for job_id in job_ids]
+            if all(job["status"] == "succeeded" for job in jobs):
+                break
+            await asyncio.sleep(0.01)
+        for queue in queues:
+            await queue.stop()
+        for store in stores:
+            await store.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(scenario(os.path.join(directory, "jobs.sqlite3")))
+    assert sorted(executed) == list(range(60))
+    print("✅ 60 jobs across 3 workers executed exactly once")
+
+def test_queue_limit_is_shared():
+    """The queue size limit counts jobs queued by every worker"""
+    async def scenario(path):
+        store_a, store_b = SQLiteJobStore(path), SQLiteJobStore(path)
+        await store_a.start()
+        await store_b.start()
+        queue_a = JobQueue(lambda p: None, concurrency=0, maxsize=2, kind="test", store=store_a)
+        queue_b = JobQueue(lambda p: None, concurrency=0, maxsize=2, kind="test", store=store_b)
+        await queue_a.start()
+        await queue_b.start()
+        await queue_a.submit({})
+        await queue_b.submit({})
+        try:
+            await queue_a.submit({})
+            raise AssertionError("expected QueueFullError")
+        except QueueFullError:
+            pass
+        full = await queue_b.is_full()
+        await store_a.close()
+        await store_b.close()
+        return full
+
+    with tempfile.TemporaryDirectory() as directory:
+        assert asyncio.run(scenario(os.path.join(directory, "jobs.sqlite3")))
+    print("✅ Queue limit enforced across workers")
+
+def test_sqlite_cache_shared_between_connections():
+    """Two cache connections on the same file see each other's entries"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache.sqlite3")
+        cache_a, cache_b = SQLiteCacheBackend(path), SQLiteCacheBackend(path)
+        asyncio.run(cache_a.set("file_id:abc", "file-1", ttl=60))
+        assert asyncio.run(cache_b.get("file_id:abc")) == "file-1"
+    print("✅ SQLite cache shared between workers")
+
+def test_uvicorn_two_workers_share_state():
+    """With two uvicorn workers every saved record and job is visible on every request"""
+    with tempfile.TemporaryDirectory() as directory, run_app_server(2, directory) as base_url:
+        with httpx.Client(base_url=base_url) as client:
+            for i in range(20):
+                client.post("/api/save-record", json=sample_record(i)).raise_for_status()
+            totals = {client.get("/api/records", params={"include_total": True, "limit": 1}).json()["total"] for _ in range(10)}
+
+            job_ids = []
+            for i in range(6):
+                response = client.post(
+                    "/api/process-audio",
+                    params={"mode": "job"},
+                    files={"audio_file": ("test.wav", b"RIFF" + b"\0" * 1024, "audio/wav")},
+                    data={"patient_id": f"P-{i}"}
+                )
+                job_ids.append(response.json()["job_id"])
+            statuses = {}
+            deadline = time.time() + 20
+            while time.time() < deadline and len(statuses) < len(job_ids):
+                for job_id in job_ids:
+                    response = client.get(f"/api/jobs/{job_id}")
+                    assert response.status_code == 200
+                    if response.json()["status"] == "succeeded":
+                        statuses[job_id] = response.json()["result"]["medical_record"]["patient_id"]
+                time.sleep(0.1)
+    assert totals == {20}
+    assert sorted(statuses.values()) == [f"P-{i}" for i in range(6)]
+    print("✅ Records and jobs consistent across 2 uvicorn workers")
+
+# ワーカーを模したプロセス：ゲージを設定し、終了処理（lifespan）を走らせるかどうかを選んで終了する
+WORKER_SCRIPT = """
+import os, sys
+from fastapi.testclient import TestClient
+from app.metrics import ADMISSION_IN_FLIGHT
+import app.main
+if sys.argv[1] == "graceful":
+    with TestClient(app.main.app):
+        ADMISSION_IN_FLIGHT.set(5)
+else:
+    ADMISSION_IN_FLIGHT.set(3)
+print(os.getpid())
+"""
+
+def test_exited_worker_gauges_leave_the_aggregate():
+    """Live gauges of a gracefully stopped worker and of a crashed worker reported via gunicorn child_exit are dropped"""
+    from prometheus_client import CollectorRegistry, multiprocess
+
+    def in_flight_samples(directory):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=directory)
+        return [
+            sample.value for metric in registry.collect() for sample in metric.samples
+            if sample.name == "medical_records_admission_in_flight"
+        ]
+
+    def run_worker(directory, mode):
+        env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": directory, "ENV_FILE": os.devnull}
+        with tempfile.TemporaryDirectory() as data_dir:
+            env["MEDICAL_RECORDS_DB_PATH"] = os.path.join(data_dir, "records.sqlite3")
+            env["JOB_STORE_PATH"] = os.path.join(data_dir, "jobs.sqlite3")
+            output = subprocess.run(
+                [sys.executable, "-c", WORKER_SCRIPT, mode], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+            )
+        return int(output.stdout.strip().splitlines()[-1])
+
+    saved = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    with tempfile.TemporaryDirectory() as directory:
+        run_worker(directory, "graceful")
+        assert in_flight_samples(directory) == []
+        crashed_pid = run_worker(directory, "crash")
+        assert in_flight_samples(directory) == [3.0]
+        hooks = runpy.run_path(os.path.join(BACKEND_DIR, "gunicorn.conf.py"))
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = directory
+        try:
+            hooks["child_exit"](None, SimpleNamespace(pid=crashed_pid))
+        finally:
+            if saved is None:
+                os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+            else:
+                os.environ["PROMETHEUS_MULTIPROC_DIR"] = saved
+        assert in_flight_samples(directory) == []
+    print("✅ Exited workers' live gauges leave the aggregate")
+
+if __name__ == "__main__":
+    print("🚀 Starting Multi-Worker Test")
+    print("=" * 50)
+    test_job_submitted_on_one_worker_runs_on_another()
+    test_each_job_runs_exactly_once()
+    test_queue_limit_is_shared()
+    test_sqlite_cache_shared_between_connections()
+    test_uvicorn_two_workers_share_state()
+    test_exited_worker_gauges_leave_the_aggregate()
+    print("=" * 50)
+    print("🎉 All tests passed!")
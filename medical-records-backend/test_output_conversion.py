@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Test script for the Dify output to medical record conversion
+Checks SOAP and record-shaped structured output, field extraction from free text, size caps and batch conversion
+"""
+
+from app.record_output import PLACEHOLDERS, RecordOutputConverter, extract_labeled_fields, record_fields_for
+from benchmarks.bench_output_conversion import sample_outputs
+
+def test_structured_output_shapes():
+    """SOAP keys fill their record fields, record keys win over SOAP and nested values are flattened"""
+    converter = RecordOutputConverter()
+    record = converter.convert({"structured_output": {
+        "subjective": "腹痛",
+        "assessment": "急性胃腸炎の疑い",
+        "plan": ["整腸剤を処方", "水分補給"],
+        "guidance": "消化の良い食事",
+        "next_appointment": 7,
+    }})
+    assert record["chief_complaint"] == record["present_illness"] == "腹痛"
+    assert record["diagnosis"] == "急性胃腸炎の疑い"
+    assert record["prescription"] == "整腸剤を処方\n水分補給"
+    assert record["guidance"] == "消化の良い食事"
+    assert record["next_appointment"] == "7"
+    assert record["physical_examination"] == PLACEHOLDERS["physical_examination"]
+
+    nested = converter.convert({"plan": {"medication": "PPI", "days": 14}, "objective": {"bp": [120, 80]}})
+    assert nested["prescription"] == "medication: PPI\ndays: 14"
+    assert nested["physical_examination"] == PLACEHOLDERS["physical_examination"]
+    assert record_fields_for("plan") == ["prescription", "guidance"] and record_fields_for("diagnosis") == ["diagnosis"]
+    print("✅ Structured output shapes map to record fields")
+
+def test_free_text_is_parsed_not_dumped():
+    """Labeled and JSON text are split into fields and raw responses never land in notes"""
+    labeled = extract_labeled_fields("## 主訴\n頭痛\n【現病歴】昨日から\n続いている\n診断：緊張型頭痛\nP: 鎮痛剤\n次回予約：必要時")
+    assert labeled == {
+        "chief_complaint": "頭痛",
+        "present_illness": "昨日から\n続いている",
+        "diagnosis": "緊張型頭痛",
+        "plan": "鎮痛剤",
+        "next_appointment": "必要時",
+    }
+
+    converter = RecordOutputConverter(max_field_chars=100)
+    fenced = converter.convert({"text": '説明です\n```json\n{"chief_complaint": "胸やけ", "diagnosis": "逆流性食道炎"}\n```'})
+    assert fenced["chief_complaint"] == "胸やけ" and fenced["diagnosis"] == "逆流性食道炎"
+
+    free_text = "患者は3日前から咳嗽と発熱を訴えている。" * 50
+    record = converter.convert({"text": free_text, "workflow_run_id": "abc"})
+    assert record["present_illness"] == free_text[:99] + "…"
+    assert free_text not in record["notes"] and "abc" not in str(record)
+    assert max(len(value) for value in record.values()) <= 100
+    print("✅ Free text parsed into fields and capped")
+
+def test_convert_many_matches_convert():
+    """Batch conversion gives the same records as converting one by one, including invalid items"""
+    converter = RecordOutputConverter()
+    outputs = sample_outputs(8) + [{"assessment": True, "plan": {"x": 1}}, None, "S: 咳\nA: 感冒"]
+    single = [converter.convert(output) for output in outputs]
+    batch = converter.convert_many(outputs)
+    assert batch == single
+    assert batch[-1]["chief_complaint"] == "咳" and batch[-1]["diagnosis"] == "感冒"
+    assert batch[-2]["notes"] == "Difyの出力から項目を抽出できませんでした"
+    print(f"✅ convert_many matches convert for {len(outputs)} outputs")
+
+if __name__ == "__main__":
+    print("🚀 Starting Output Conversion Test")
+    print("=" * 50)
+    test_structured_output_shapes()
+    test_free_text_is_parsed_not_dumped()
+    test_convert_many_matches_convert()
+    print("=" * 50)
+    print("🎉 All tests passed!")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test script for versioned prompt templates and prompt_version on saved records
+"""
+
+import asyncio
+import os
+import tempfile
+
+from app import main
+from app.prompts import load_prompt_template
+from app.settings import DifySettings
+from app.storage import SQLiteRecordStore
+
+PATIENT = {"name": "山田太郎", "id": "P-001", "age": "45", "gender": "男性"}
+
+def test_template_loads_static_part_once():
+    """The static instructions and vocabulary come from prompts/v1 and are shared by every prompt"""
+    template = load_prompt_template(main.PROMPT_TEMPLATE_DIR, "v1")
+    prompt = template.render(PATIENT)
+    assert template.version == "v1"
+    assert prompt.startswith(template.static_prompt)
+    assert "芦屋Rいいだ内科クリニック" in template.static_prompt
+    assert "ピロリ菌検査" in template.static_prompt
+    assert "- 氏名: 山田太郎" in prompt
+    assert "- 患者ID: P-001" in prompt
+    print(f"✅ Static prompt loaded ({len(template.static_prompt)} chars)")
+
+def test_patient_context_is_memoized():
+    """The patient block is rendered once per distinct patient and missing values become 不明"""
+    template = load_prompt_template(main.PROMPT_TEMPLATE_DIR, "v1")
+    for _ in range(5):
+        template.render_context(PATIENT)
+    info = template.cache_info()
+    assert info.misses == 1 and info.hits == 4
+    context = template.render_context({"name": None, "id": "P-002", "age": None, "gender": None})
+    assert "- 氏名: 不明" in context
+    assert template.render_context(None) == ""
+    print("✅ Patient context block memoized")
+
+def test_context_mode_sends_only_patient_block():
+    """In context mode only the patient block and the template version are sent to Dify"""
+    main.dify_settings = DifySettings(prompt_mode="context")
+    try:
+        prompt = main.create_medical_record_prompt(PATIENT)
+        _, data = main.build_workflow_request(prompt, "file-1", "key")
+        context_key = main.record_cache_key(prompt)
+    finally:
+        main.dify_settings = DifySettings()
+    inline_prompt = main.create_medical_record_prompt(PATIENT)
+    _, inline_data = main.build_workflow_request(inline_prompt, "file-1", "key")
+    assert data["inputs"]["prompt"] == main.get_prompt_template().render_context(PATIENT)
+    assert data["inputs"]["prompt_version"] == "v1"
+    assert "prompt_version" not in inline_data["inputs"]
+    assert len(prompt.encode()) * 5 < len(inline_prompt.encode())
+    assert context_key != main.record_cache_key(inline_prompt)
+    print(f"✅ Context mode sends {len(prompt.encode())} bytes instead of {len(inline_prompt.encode())}")
+
+def test_prompt_version_saved_with_record():
+    """Generated records carry prompt_version and it survives saving and loading"""
+    result = asyncio.run(main.fallback_mock_response(PATIENT))
+    record = main.MedicalRecord(**{**result["medical_record"], "prompt_version": "v1"})
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteRecordStore(os.path.join(directory, "records.sqlite3"))
+
+        async def scenario():
+            await store.start()
+            saved = await store.save(record.model_dump())
+            loaded = await store.get(saved["id"])
+            await store.close()
+            return loaded
+
+        loaded = asyncio.run(scenario())
+    assert loaded["prompt_version"] == "v1"
+    print("✅ prompt_version stored with the record")
+
+if __name__ == "__main__":
+    print("🚀 Starting Prompt Template Test")
+    print("=" * 50)
+    test_template_loads_static_part_once()
+    test_patient_context_is_memoized()
+    test_context_mode_sends_only_patient_block()
+    test_prompt_version_saved_with_record()
+    print("=" * 50)
+    print("🎉 All tests passed!")
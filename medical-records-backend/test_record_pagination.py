@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Test script for keyset pagination on /api/records
+Walks every page for both sort columns and orders with tied sort values, and checks the fields projection,
+the date filter and the 400 responses for bad parameters
+"""
+
+import os
+import tempfile
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.storage import SQLiteRecordStore
+
+# 並び替え値が同じ記録（同時刻の作成・同日時の診察）を含める
+RECORDS = [
+    {"patient_id": "P-001", "consultation_date": "2025-01-10 09:00", "created_at": "2025-01-10T09:30:00", "diagnosis": "急性胃腸炎"},
+    {"patient_id": "P-002", "consultation_date": "2025-01-12 08:00", "created_at": "2025-01-10T09:30:00", "diagnosis": "逆流性食道炎"},
+    {"patient_id": "P-001", "consultation_date": "2025-01-10 09:00", "created_at": "2025-01-11T10:00:00", "diagnosis": "急性胃腸炎"},
+    {"patient_id": "P-003", "consultation_date": "2025-01-11 10:00", "created_at": "2025-01-10T09:30:00", "diagnosis": "感冒"},
+    {"patient_id": "P-002", "consultation_date": "2025-01-12 08:00", "created_at": "2025-01-12T08:30:00", "diagnosis": "逆流性食道炎"},
+    {"patient_id": "P-003", "consultation_date": "2025-01-11 10:00", "created_at": "2025-01-11T10:00:00", "diagnosis": "感冒"},
+    {"patient_id": "P-001", "consultation_date": "2025-01-10 09:00", "created_at": "2025-01-12T08:30:00", "diagnosis": "急性胃腸炎"},
+]
+
+def walk_pages(client: TestClient, **params) -> list:
+    """Follows next_cursor until the last page and returns every row"""
+    rows, cursor = [], None
+    for _ in range(len(RECORDS) + 1):
+        response = client.get("/api/records", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, response.text
+        body = response.json()
+        assert body["count"] == len(body["records"]) and body["has_more"] == (body["next_cursor"] is not None)
+        rows.extend(body["records"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return rows
+    raise AssertionError("pagination did not terminate")
+
+def test_keyset_pagination():
+    """Every sort column and order returns each record exactly once in (sort value, id) order"""
+    store = main.record_store
+    with tempfile.TemporaryDirectory() as directory:
+        main.record_store = SQLiteRecordStore(os.path.join(directory, "records.sqlite3"))
+        try:
+            with TestClient(main.app) as client:
+                # 作成日時を指定して保存し、同時刻の記録を作る（ストアはアプリのイベントループで動かす）
+                client.portal.call(main.record_store.save_many, RECORDS)
+                pages = {
+                    (sort, order): walk_pages(client, sort=sort, order=order, limit=2)
+                    for sort in ("created_at", "consultation_date") for order in ("asc", "desc")
+                }
+                projected = walk_pages(client, sort="consultation_date", order="asc", limit=3, fields="diagnosis")
+                filtered = client.get("/api/records", params={"date_from": "2025-01-11", "date_to": "2025-01-12", "include_total": True}).json()
+                patient = client.get("/api/records", params={"patient_id": "P-001", "include_total": True, "limit": 1}).json()
+                errors = {
+                    name: client.get("/api/records", params=params)
+                    for name, params in {
+                        "cursor": {"cursor": "not-a-cursor"},
+                        "sort": {"sort": "diagnosis"},
+                        "order": {"order": "sideways"},
+                        "field": {"fields": "diagnosis,password"},
+                    }.items()
+                }
+        finally:
+            main.record_store = store
+
+    for (sort, order), rows in pages.items():
+        expected = sorted(
+            ((record[sort], i + 1) for i, record in enumerate(RECORDS)),
+            reverse=order == "desc"
+        )
+        assert [row["id"] for row in rows] == [record_id for _, record_id in expected], (sort, order)
+        assert [row[sort] for row in rows] == [value for value, _ in expected]
+    assert [row["id"] for row in projected] == [row["id"] for row in pages[("consultation_date", "asc")]]
+    assert all(set(row) == {"id", "diagnosis"} for row in projected)
+    assert filtered["total"] == 4 and {row["consultation_date"][:10] for row in filtered["records"]} == {"2025-01-11", "2025-01-12"}
+    assert patient["total"] == 3 and patient["count"] == 1 and patient["has_more"]
+    for name, response in errors.items():
+        assert response.status_code == 400, name
+        assert "検索条件が正しくありません" in response.json()["detail"]
+    print("✅ Keyset pagination is stable for both sort columns, both orders and tied values")
+
+if __name__ == "__main__":
+    print("🚀 Starting Record Pagination Test")
+    print("=" * 50)
+    test_keyset_pagination()
+    print("=" * 50)
+    print("🎉 All tests passed!")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test script for full-text search over saved medical records
+Checks bi-gram matching of Japanese text, patient/date filters, pagination, index backfill and /api/records/search
+"""
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.search import build_match_query, tokenize_for_index
+from app.storage import SQLiteRecordStore
+
+RECORDS = [
+    {"patient_id": "P-001", "consultation_date": "2025-01-10 10:00", "chief_complaint": "腹痛、下痢", "present_illness": "3日前から続く",
+     "diagnosis": "急性胃腸炎の疑い", "prescription": "整腸剤を処方", "notes": None},
+    {"patient_id": "P-002", "consultation_date": "2025-02-10 10:00", "chief_complaint": "胸やけ", "present_illness": "食後に増悪",
+     "diagnosis": "逆流性食道炎", "prescription": "ＰＰＩを処方", "notes": "胃カメラを予定"},
+    {"patient_id": "P-001", "consultation_date": "2025-03-10 10:00", "chief_complaint": "腹痛", "present_illness": "改善傾向",
+     "diagnosis": "急性胃腸炎", "prescription": "整腸剤を継続", "notes": None},
+]
+
+def ids(result: tuple) -> list:
+    return [row["id"] for row in result[0]]
+
+def test_bigram_tokenization():
+    """Japanese text is indexed as bi-grams and queries become phrase matches"""
+    assert tokenize_for_index("急性胃腸炎、ＰＰＩ") == "急性 性胃 胃腸 腸炎 pp pi"
+    assert build_match_query("胃腸炎 整腸剤").startswith("{chief_complaint present_illness diagnosis prescription notes} : (")
+    assert '"胃腸 腸炎" AND "整腸 腸剤"' in build_match_query("胃腸炎 整腸剤")
+    assert build_match_query("、 ") is None
+    print("✅ Text tokenized into bi-grams")
+
+def test_search_filters_and_pagination():
+    """Search matches substrings across fields, honours patient/date filters and pages newest first"""
+    async def scenario(path):
+        store = SQLiteRecordStore(path)
+        await store.start()
+        await store.save_many(RECORDS)
+        results = {
+            "腹痛": ids(await store.search("腹痛")),
+            "胃腸炎": ids(await store.search("胃腸炎")),
+            "ppi": ids(await store.search("ppi")),
+            "胃": ids(await store.search("胃")),
+            "腹痛 整腸剤 継続": ids(await store.search("腹痛 整腸剤 継続")),
+            "痛下": ids(await store.search("痛下")),
+            "patient": ids(await store.search("胃", patient_id="P-002")),
+            "date": ids(await store.search("腹痛", date_from="2025-01-01", date_to="2025-02-01")),
+        }
+        first = await store.search("腹痛", limit=1)
+        second = await store.search("腹痛", limit=1, cursor=first[1])
+        selected = await store.search("食道炎", fields=["diagnosis"])
+        await store.close()
+        return results, first, second, selected
+
+    with tempfile.TemporaryDirectory() as directory:
+        results, first, second, selected = asyncio.run(scenario(os.path.join(directory, "records.sqlite3")))
+    assert results["腹痛"] == [3, 1]
+    assert results["胃腸炎"] == [3, 1]
+    assert results["ppi"] == [2]
+    assert results["胃"] == [3, 2, 1]
+    assert results["腹痛 整腸剤 継続"] == [3]
+    assert results["痛下"] == []
+    assert results["patient"] == [2]
+    assert results["date"] == [1]
+    assert ids(first) == [3] and ids(second) == [1] and second[1] is None
+    assert selected[0] == [{"id": 2, "diagnosis": "逆流性食道炎"}]
+    print("✅ Search filters by patient/date and pages newest first")
+
+def test_existing_records_are_backfilled():
+    """Records saved before the index existed are indexed when the store starts"""
+    async def scenario(path):
+        store = SQLiteRecordStore(path)
+        await store.start()
+        await store.save_many(RECORDS)
+        await store.close()
+        conn = sqlite3.connect(path)
+        conn.execute("DROP TABLE medical_records_fts")
+        conn.close()
+
+        store = SQLiteRecordStore(path)
+        await store.start()
+        found = ids(await store.search("食道炎"))
+        await store.save(RECORDS[1])
+        found_after_save = ids(await store.search("食道炎"))
+        await store.close()
+        return found, found_after_save
+
+    with tempfile.TemporaryDirectory() as directory:
+        found, found_after_save = asyncio.run(scenario(os.path.join(directory, "records.sqlite3")))
+    assert found == [2]
+    assert found_after_save == [4, 2]
+    print("✅ Existing records backfilled into the search index")
+
+def test_search_endpoint():
+    """Records saved through /api/save-record are searchable immediately"""
+    store = main.record_store
+    with tempfile.TemporaryDirectory() as directory:
+        main.record_store = main.SQLiteRecordStore(os.path.join(directory, "records.sqlite3"))
+        try:
+            with TestClient(main.app) as client:
+                for record in RECORDS:
+                    client.post("/api/save-record", json={**record, "physical_examination": "", "guidance": ""}).raise_for_status()
+                body = client.get("/api/records/search", params={"q": "胃腸炎", "patient_id": "P-001", "date_to": "2025-02-01"}).json()
+                empty = client.get("/api/records/search", params={"q": "、"})
+        finally:
+            main.record_store = store
+    assert body["success"] is True
+    assert [record["diagnosis"] for record in body["records"]] == ["急性胃腸炎の疑い"]
+    assert empty.status_code == 400
+    print("✅ /api/records/search finds newly saved records")
+
+if __name__ == "__main__":
+    print("🚀 Starting Record Search Test")
+    print("=" * 50)
+    test_bigram_tokenization()
+    test_search_filters_and_pagination()
+    test_existing_records_are_backfilled()
+    test_search_endpoint()
+    print("=" * 50)
+    print("🎉 All tests passed!")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test script for the SQLite medical record store
+Checks unique increasing IDs under concurrent saves, that one bad record only fails its own caller,
+and that records survive closing and reopening the database file
+"""
+
+import asyncio
+import os
+import tempfile
+
+from app.storage import SQLiteRecordStore
+
+def sample_record(index: int) -> dict:
+    return {
+        "patient_id": f"P-{index:04d}",
+        "consultation_date": "2025-06-01 10:00",
+        "chief_complaint": f"主訴{index}",
+        "diagnosis": "急性胃腸炎の疑い",
+        "notes": None
+    }
+
+def test_concurrent_saves_get_unique_increasing_ids():
+    """Concurrent saves are committed together and get unique IDs in the order they were requested"""
+    async def scenario(path):
+        store = SQLiteRecordStore(path, batch_size=50)
+        await store.start()
+        try:
+            saved = await asyncio.gather(*(store.save(sample_record(i)) for i in range(200)))
+            later = await store.save(sample_record(200))
+            count = await store.count()
+        finally:
+            await store.close()
+        return saved, later, count
+
+    with tempfile.TemporaryDirectory() as directory:
+        saved, later, count = asyncio.run(scenario(os.path.join(directory, "records.sqlite3")))
+    ids = [row["id"] for row in saved]
+    assert len(set(ids)) == 200 and ids == sorted(ids)
+    assert [row["patient_id"] for row in saved] == [f"P-{i:04d}" for i in range(200)]
+    assert later["id"] > ids[-1] and count == 201
+    print("✅ 200 concurrent saves got unique, increasing IDs")
+
+def test_bad_record_only_fails_its_caller():
+    """When a combined batch fails, the other callers' records are still saved"""
+    async def scenario(path):
+        # 保存要求がまとめられるよう、書き込み前に少し待たせる
+        store = SQLiteRecordStore(path, batch_interval=0.05)
+        await store.start()
+        try:
+            bad = dict(sample_record(1), notes={"not": "a column value"})
+            results = await asyncio.gather(
+                store.save(sample_record(0)), store.save(bad), store.save_many([sample_record(2), sample_record(3)]),
+                return_exceptions=True
+            )
+            rows = await store.get_many([1, 2, 3, 4])
+        finally:
+            await store.close()
+        return results, rows
+
+    with tempfile.TemporaryDirectory() as directory:
+        results, rows = asyncio.run(scenario(os.path.join(directory, "records.sqlite3")))
+    assert isinstance(results[1], Exception)
+    assert results[0]["patient_id"] == "P-0000"
+    assert [row["patient_id"] for row in results[2]] == ["P-0002", "P-0003"]
+    assert sorted(row["patient_id"] for row in rows) == ["P-0000", "P-0002", "P-0003"]
+    print("✅ A bad record fails only its own save")
+
+def test_records_persist_across_reopen():
+    """Records and IDs survive closing and reopening the same database file"""
+    async def scenario(path):
+        store = SQLiteRecordStore(path)
+        await store.start()
+        first = await store.save_many([sample_record(i) for i in range(3)])
+        await store.close()
+
+        reopened = SQLiteRecordStore(path)
+        await reopened.start()
+        try:
+            rows = await reopened.get_many([row["id"] for row in first])
+            after = await reopened.save(sample_record(3))
+        finally:
+            await reopened.close()
+        return first, rows, after
+
+    with tempfile.TemporaryDirectory() as directory:
+        first, rows, after = asyncio.run(scenario(os.path.join(directory, "records.sqlite3")))
+    assert [(row["id"], row["chief_complaint"]) for row in rows] == [(row["id"], row["chief_complaint"]) for row in first]
+    assert after["id"] > max(row["id"] for row in first)
+    print("✅ Records persist across close and reopen")
+
+if __name__ == "__main__":
+    print("🚀 Starting Record Store Test")
+    print("=" * 50)
+    test_concurrent_saves_get_unique_increasing_ids()
+    test_bad_record_only_fails_its_caller()
+    test_records_persist_across_reopen()
+    print("=" * 50)
+    print("🎉 All tests passed!")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Test script for the orjson response fast path
+Checks that TimedJSONResponse output matches the stdlib encoding and that record endpoints use it
+"""
+
+import json
+import os
+import tempfile
+import warnings
+
+from fastapi.testclient import TestClient
+from pydantic.warnings import PydanticDeprecatedSince20
+
+from app import main
+from benchmarks.bench_serialization import sample_record, stdlib_render
+
+def test_orjson_matches_stdlib_output():
+    """orjson output decodes to the same document as the previous stdlib encoding and keeps Japanese unescaped"""
+    content = {"success": True, "records": [sample_record(i) for i in range(3)], "count": 3, "next_cursor": None}
+    body = main.TimedJSONResponse(content).body
+    assert json.loads(body) == json.loads(stdlib_render(content))
+    assert "急性胃腸炎の疑い".encode("utf-8") in body
+    assert main.TimedJSONResponse({1: "a"}).body == b'{"1":"a"}'
+    print("✅ orjson output matches stdlib encoding")
+
+def test_record_endpoints_without_deprecated_dict():
+    """Saving and listing records works without Pydantic v1 .dict() deprecation warnings"""
+    directory = tempfile.mkdtemp()
+    main.record_store = main.SQLiteRecordStore(os.path.join(directory, "records.sqlite3"))
+    record = {key: value for key, value in sample_record(1).items() if key not in ("id", "created_at")}
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", PydanticDeprecatedSince20)
+        with TestClient(main.app) as client:
+            client.post("/api/save-record", json=record).raise_for_status()
+            response = client.get("/api/records")
+            search = client.get("/api/records/search", params={"q": "胃腸炎"})
+    assert response.headers["content-type"] == "application/json"
+    assert response.json()["records"][0]["diagnosis"] == "急性胃腸炎の疑い"
+    assert search.json()["count"] == 1
+    print("✅ Record endpoints serialize with orjson and model_dump")
+
+if __name__ == "__main__":
+    print("🚀 Starting Response Serialization Test")
+    print("=" * 50)
+    test_orjson_matches_stdlib_output()
+    test_record_endpoints_without_deprecated_dict()
+    print("=" * 50)
+    print("🎉 All tests passed!")
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Test script for the chunked long-recording pipeline
+Splits long synthetic WAV files at silences, processes segments against the local Dify stub and checks the merge
+"""
+
+import asyncio
+import os
+import re
+import tempfile
+import time
+
+import numpy as np
+
+from app import main
+from app.audio import FRAME_SECONDS, TARGET_SAMPLE_RATE, find_split_points, read_wav, split_wav_file, synthesize_wav
+from app.merge import merge_medical_records
+from app.settings import DifySettings
+from app.wav import wav_duration
+from benchmarks.dify_stub import create_stub_app, run_stub_server
+
+def write_temp(data: bytes) -> str:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
+        f.write(data)
+        return f.name
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_split_points_fall_in_silence():
+    """Split points land in pauses, never in the middle of speech"""
+    input_path = write_temp(synthesize_wav(600.0, sample_rate=TARGET_SAMPLE_RATE))
+    try:
+        samples, sample_rate = read_wav(input_path)
+    finally:
+        os.unlink(input_path)
+    audio = samples[:, 0]
+    points = find_split_points(audio, sample_rate, segment_seconds=120.0)
+    frame = int(sample_rate * FRAME_SECONDS)
+    assert len(points) == 4
+    for point in points:
+        assert np.sqrt(np.mean(np.square(audio[point - frame:point + frame]))) < 0.01
+    lengths = np.diff([0] + points + [len(audio)]) / sample_rate
+    assert lengths.min() >= 90 and lengths.max() <= 150
+    print(f"✅ {len(points)} split points in silence, segment lengths {lengths.min():.0f}-{lengths.max():.0f}s")
+
+def test_split_wav_file_covers_recording():
+    """Segments are written in order and together cover the whole (trimmed) recording"""
+    input_path = write_temp(synthesize_wav(400.0, sample_rate=44100, channels=2, leading_silence=3.0))
+    output_dir = tempfile.mkdtemp()
+    try:
+        paths = split_wav_file(input_path, output_dir, segment_seconds=120.0)
+        durations = [wav_duration(path) for path in paths]
+        segments = [read_file(path) for path in paths]
+        # 小さいブロックで処理しても同じ区間が書き出される
+        small_block_paths = split_wav_file(input_path, output_dir, segment_seconds=120.0, block_frames=4096)
+        small_block_segments = [read_file(path) for path in small_block_paths]
+        leftovers = sorted(os.listdir(output_dir))
+    finally:
+        os.unlink(input_path)
+        for name in os.listdir(output_dir):
+            os.unlink(os.path.join(output_dir, name))
+        os.rmdir(output_dir)
+    assert [os.path.basename(p) for p in paths] == ["segment_000.wav", "segment_001.wav", "segment_002.wav"]
+    assert 400.0 <= sum(durations) <= 401.0
+    assert small_block_segments == segments
+    assert leftovers == ["segment_000.wav", "segment_001.wav", "segment_002.wav"]
+    print(f"✅ Split into {len(paths)} segments totalling {sum(durations):.1f}s")
+
+def test_merge_is_deterministic():
+    """Placeholders are dropped, duplicates collapsed and text joined in recording order"""
+    segments = [
+        {
+            "patient_id": "AUTO-GENERATED", "consultation_date": "2025-01-01 10:00",
+            "chief_complaint": "腹痛", "present_illness": "3日前から腹痛",
+            "physical_examination": "身体所見を確認してください", "diagnosis": "診断を確認してください",
+            "prescription": "処方内容を確認してください", "guidance": "指導内容を確認してください",
+            "next_appointment": "次回予約を確認してください", "notes": "Dify AI処理完了",
+        },
+        {
+            "patient_id": "P-001", "consultation_date": "2025-01-01 10:05",
+            "chief_complaint": "腹痛", "present_illness": "下痢も伴う",
+            "physical_examination": "腹部軽度圧痛", "diagnosis": "急性胃腸炎の疑い",
+            "prescription": "整腸剤", "guidance": "水分補給",
+            "next_appointment": "1週間後", "notes": "Dify AI処理完了",
+        },
+    ]
+    merged = merge_medical_records(segments)
+    assert merged == merge_medical_records([dict(s) for s in segments])
+    assert merged["patient_id"] == "P-001"
+    assert merged["consultation_date"] == "2025-01-01 10:00"
+    assert merged["chief_complaint"] == "腹痛"
+    assert merged["present_illness"] == "3日前から腹痛\n下痢も伴う"
+    assert merged["physical_examination"] == "腹部軽度圧痛"
+    assert merged["next_appointment"] == "1週間後"
+    assert merged["notes"] == "Dify AI処理完了\n（2区間の処理結果を統合）"
+    assert main.MedicalRecord(**merged)
+    print("✅ Segment records merge deterministically")
+
+def test_long_recording_processed_in_parallel():
+    """A 12 minute recording is split, processed with bounded concurrency and merged in order"""
+    main.get_dify_breaker().record_success()
+    concurrency = main.AUDIO_SEGMENT_CONCURRENCY
+    main.AUDIO_SEGMENT_CONCURRENCY = 2
+    stub = create_stub_app(latency=0.1)
+
+    def output_for_segment(body):
+        index = re.search(r"第(\d+)/\d+区間", body["inputs"]["prompt"]).group(1)
+        return {"subjective": f"区間{index}の主訴", "objective": "所見", "assessment": "診断", "plan": "処方"}
+
+    stub.state.output_factory = output_for_segment
+    audio_path = write_temp(synthesize_wav(720.0, sample_rate=TARGET_SAMPLE_RATE))
+
+    async def scenario():
+        with run_stub_server(app=stub) as api_url:
+            main.dify_settings = DifySettings(api_url=api_url, api_key="key", app_id="app", http2=False)
+            try:
+                return await main.process_with_dify_agent(audio_path, {"id": "P-1"})
+            finally:
+                await main.get_dify_client().aclose()
+
+    cache = main.audio_cache
+    main.audio_cache = None
+    try:
+        result = asyncio.run(scenario())
+    finally:
+        os.unlink(audio_path)
+        main.audio_cache = cache
+        main.AUDIO_SEGMENT_CONCURRENCY = concurrency
+        main.dify_settings = DifySettings()
+        if main.audio_preprocess_pool is not None:
+            main.audio_preprocess_pool.shutdown()
+            main.audio_preprocess_pool = None
+    record = result["medical_record"]
+    assert stub.state.calls["upload"] == 6
+    assert stub.state.calls["workflow"] == 6
+    assert stub.state.max_in_flight == 2
+    assert record["chief_complaint"].split("\n") == [f"区間{i}の主訴" for i in range(1, 7)]
+    assert record["diagnosis"] == "診断"
+    print(f"✅ 12 minute recording processed as 6 segments (max {stub.state.max_in_flight} in flight)")
+
+def test_failed_segment_cancels_the_others():
+    """When one segment fails the in-flight segments are cancelled and queued segments never start"""
+    main.get_dify_breaker().record_success()
+    concurrency = main.AUDIO_SEGMENT_CONCURRENCY
+    main.AUDIO_SEGMENT_CONCURRENCY = 2
+    stub = create_stub_app(latency=0.05, upload_latency=0.5)
+    # 最初のアップロードを再試行されないエラーで失敗させ、もう1区間はアップロード中のままにする
+    stub.state.failures = 1
+    stub.state.failure_status = 400
+    audio_path = write_temp(synthesize_wav(360.0, sample_rate=TARGET_SAMPLE_RATE))
+
+    async def scenario():
+        with run_stub_server(app=stub) as api_url:
+            try:
+                start = time.perf_counter()
+                try:
+                    await main.process_segmented_audio(audio_path, "prompt", "key", api_url, "app")
+                    raise AssertionError("expected DifyAPIError")
+                except main.DifyAPIError as e:
+                    assert e.status_code == 400
+                elapsed = time.perf_counter() - start
+                await asyncio.sleep(0.6)
+                return elapsed
+            finally:
+                await main.get_dify_client().aclose()
+
+    main.dify_settings = DifySettings(http2=False)
+    try:
+        elapsed = asyncio.run(scenario())
+    finally:
+        os.unlink(audio_path)
+        main.AUDIO_SEGMENT_CONCURRENCY = concurrency
+        main.dify_settings = DifySettings()
+        if main.audio_preprocess_pool is not None:
+            main.audio_preprocess_pool.shutdown()
+            main.audio_preprocess_pool = None
+    assert stub.state.uploads_started == 2
+    assert stub.state.calls["workflow"] == 0
+    assert elapsed < 0.5
+    print(f"✅ Failed segment cancels the in-flight segment and skips the queued one ({elapsed * 1000:.0f}ms)")
+
+if __name__ == "__main__":
+    print("🚀 Starting Segmented Audio Test")
+    print("=" * 50)
+    test_split_points_fall_in_silence()
+    test_split_wav_file_covers_recording()
+    test_merge_is_deterministic()
+    test_long_recording_processed_in_parallel()
+    test_failed_segment_cancels_the_others()
+    print("=" * 50)
+    print("🎉 All tests passed!")
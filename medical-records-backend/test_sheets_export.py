@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Test script for the Google Sheets exporter
+Runs the exporter and /api/export-to-sheets against the in-process FakeSheetsWriter
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from app.sheets import FakeSheetsWriter, RetryableSheetsError, SheetsExporter, SHEET_HEADER
+
+def sample_record(index: int) -> dict:
+    return {
+        "patient_id": f"P-{index:04d}",
+        "consultation_date": "2025-06-01 10:00",
+        "chief_complaint": "腹痛、下痢症状",
+        "present_illness": "3日前から腹痛と下痢が続いている。",
+        "physical_examination": "腹部：軽度圧痛あり",
+        "diagnosis": "急性胃腸炎の疑い",
+        "prescription": "整腸剤を処方",
+        "guidance": "水分補給を心がけてください",
+        "next_appointment": "1週間後",
+        "notes": None
+    }
+
+def test_exporter_chunks_and_retries():
+    """Rows are written in chunks and rate-limit errors are retried"""
+    writer = FakeSheetsWriter(failures=[RetryableSheetsError("429", retry_after=0), RetryableSheetsError("503")])
+    exporter = SheetsExporter(writer, chunk_size=4, base_delay=0.001)
+
+    async def batches():
+        yield [dict(sample_record(i), id=i) for i in range(1, 8)]
+        yield [dict(sample_record(i), id=i) for i in range(8, 11)]
+
+    result = asyncio.run(exporter.export(batches()))
+    assert result == {"exported_count": 10, "last_id": 10}
+    assert writer.rows[0] == SHEET_HEADER
+    assert [row[0] for row in writer.rows[1:]] == list(range(1, 11))
+    assert writer.calls == 3 + 2
+    print("✅ Exporter writes chunked rows and retries transient errors")
+
+def test_incremental_export_endpoint():
+    """Incremental export only writes records created since the previous export"""
+    from fastapi.testclient import TestClient
+    from app import main
+
+    def wait_for(client, job_id):
+        for _ in range(100):
+            job = client.get(f"/api/jobs/{job_id}").json()
+            if job["status"] in ("succeeded", "failed"):
+                return job
+            time.sleep(0.02)
+        raise AssertionError("export job did not finish")
+
+    saved = main.record_store, main.sheets_writer
+    writer = FakeSheetsWriter()
+    with tempfile.TemporaryDirectory() as directory:
+        main.record_store = main.SQLiteRecordStore(os.path.join(directory, "records.sqlite3"))
+        main.sheets_writer = writer
+        try:
+            with TestClient(main.app) as client:
+                for i in range(3):
+                    client.post("/api/save-record", json=sample_record(i))
+                first = wait_for(client, client.post("/api/export-to-sheets?incremental=true").json()["job_id"])
+                assert first["result"]["exported_count"] == 3
+
+                for i in range(3, 5):
+                    client.post("/api/save-record", json=sample_record(i))
+                second = wait_for(client, client.post("/api/export-to-sheets?incremental=true").json()["job_id"])
+                assert second["result"]["exported_count"] == 2
+
+                selected = client.post("/api/export-to-sheets", json=[1, 5]).json()
+                assert selected["exported_count"] == 2
+        finally:
+            main.record_store, main.sheets_writer = saved
+
+    assert len(writer.rows) == 1 + 3 + 2 + 2
+    print("✅ Incremental export writes only new records")
+
+def test_interrupted_export_keeps_progress():
+    """A failed export keeps the watermark of the chunks already written, and the mock export only counts records"""
+    from app import main
+    from app.storage import SQLiteRecordStore
+
+    async def scenario(path):
+        store = SQLiteRecordStore(path)
+        await store.start()
+        await store.save_many([sample_record(i) for i in range(5)])
+        main.record_store = store
+        main.sheets_writer = None
+        mock = await main.run_sheets_export()
+
+        writer = FakeSheetsWriter(failures=[None, RetryableSheetsError("503")])
+        main.sheets_writer = writer
+        try:
+            await main.run_sheets_export(incremental=True)
+            raise AssertionError("expected RetryableSheetsError")
+        except RetryableSheetsError:
+            pass
+        watermark = await store.get_state(main.SHEETS_EXPORT_STATE_KEY)
+        resumed = await main.run_sheets_export(incremental=True)
+        await store.close()
+        return mock, watermark, resumed, writer.rows
+
+    saved = main.record_store, main.sheets_writer, main.GOOGLE_SHEETS_CHUNK_SIZE, main.GOOGLE_SHEETS_MAX_RETRIES
+    main.GOOGLE_SHEETS_CHUNK_SIZE, main.GOOGLE_SHEETS_MAX_RETRIES = 2, 0
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            mock, watermark, resumed, rows = asyncio.run(scenario(os.path.join(directory, "records.sqlite3")))
+    finally:
+        main.record_store, main.sheets_writer, main.GOOGLE_SHEETS_CHUNK_SIZE, main.GOOGLE_SHEETS_MAX_RETRIES = saved
+    assert mock["exported_count"] == 5
+    assert watermark == "2"
+    assert resumed["exported_count"] == 3
+    assert [row[0] for row in rows[1:]] == [1, 2, 3, 4, 5]
+    print("✅ Interrupted export resumes after the last written chunk without duplicates")
+
+def test_writer_is_created_off_the_event_loop():
+    """The Google Sheets writer is created in a worker thread on first use, and GOOGLE_SHEETS_CREDENTIALS_PATH is accepted"""
+    from app import main
+    from benchmarks.bench_workers import BACKEND_DIR
+
+    created = []
+
+    class RecordingSheetsWriter(FakeSheetsWriter):
+        def __init__(self, spreadsheet_id: str, sheet_name: str, credentials_file: str):
+            super().__init__()
+            created.append((threading.current_thread(), credentials_file))
+
+    async def scenario():
+        first = await main.get_sheets_writer()
+        return first, await main.get_sheets_writer(), threading.current_thread()
+
+    saved = main.sheets_writer, main.GoogleSheetsWriter, main.GOOGLE_SHEETS_SPREADSHEET_ID, main.GOOGLE_SHEETS_CREDENTIALS_FILE
+    main.sheets_writer, main.GoogleSheetsWriter = None, RecordingSheetsWriter
+    main.GOOGLE_SHEETS_SPREADSHEET_ID, main.GOOGLE_SHEETS_CREDENTIALS_FILE = "sheet-id", "credentials.json"
+    try:
+        first, second, loop_thread = asyncio.run(scenario())
+    finally:
+        main.sheets_writer, main.GoogleSheetsWriter, main.GOOGLE_SHEETS_SPREADSHEET_ID, main.GOOGLE_SHEETS_CREDENTIALS_FILE = saved
+    assert isinstance(first, RecordingSheetsWriter) and second is first
+    assert len(created) == 1 and created[0][0] is not loop_thread and created[0][1] == "credentials.json"
+
+    # セットアップ手順の GOOGLE_SHEETS_CREDENTIALS_PATH でも認証ファイルを指定できる
+    names = ("GOOGLE_SHEETS_CREDENTIALS_FILE", "GOOGLE_SHEETS_CREDENTIALS_PATH", "GOOGLE_APPLICATION_CREDENTIALS")
+    env = {key: value for key, value in os.environ.items() if key not in names}
+    env.update(ENV_FILE=os.devnull, GOOGLE_SHEETS_CREDENTIALS_PATH="/secrets/sheets.json")
+    output = subprocess.run(
+        [sys.executable, "-c", "from app import main; print(main.GOOGLE_SHEETS_CREDENTIALS_FILE)"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    assert output.stdout.strip() == "/secrets/sheets.json"
+    print("✅ Sheets writer is created off the event loop and the documented credentials variable is accepted")
+
+if __name__ == "__main__":
+    print("🚀 Starting Google Sheets Export Test")
+    print("=" * 50)
+    test_exporter_chunks_and_retries()
+    test_incremental_export_endpoint()
+    test_interrupted_export_keeps_progress()
+    test_writer_is_created_off_the_event_loop()
+    print("=" * 50)
+    print("🎉 All tests passed!")
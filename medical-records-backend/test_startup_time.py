@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Test script for startup time
+Checks that heavy modules are not loaded at import, that the Dify settings are parsed once and validated,
+and runs the cold start benchmark for every startup mode
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from pydantic import ValidationError
+
+from app import main
+from app.settings import DEFAULT_DIFY_API_URL, DifySettings
+from benchmarks.bench_startup import LAZY_MODULES, compare_with_baseline, imported_lazy_modules, main_, parse_args
+from benchmarks.bench_workers import BACKEND_DIR
+
+def test_import_defers_heavy_modules():
+    """Importing app.main does not load numpy, httpx, the process pool or pyarrow"""
+    assert imported_lazy_modules(dict(os.environ)) == []
+    print(f"✅ None of {', '.join(LAZY_MODULES)} are loaded at import")
+
+def test_dify_settings_are_validated_once():
+    """Settings default to unconfigured, normalise the URL, reject bad URLs and are cached"""
+    assert DifySettings.from_env({}) == DifySettings(api_url=DEFAULT_DIFY_API_URL)
+    assert not DifySettings.from_env({"DIFY_API_KEY": "key", "DIFY_APP_ID": ""}).configured
+    settings = DifySettings.from_env({"DIFY_API_URL": " http://dify.local/v1/ ", "DIFY_API_KEY": "key", "DIFY_APP_ID": "app"})
+    assert settings.api_url == "http://dify.local/v1" and settings.configured
+    try:
+        DifySettings(api_url="dify.local/v1")
+        assert False, "invalid URL was accepted"
+    except ValidationError:
+        pass
+
+    saved = main.dify_settings
+    try:
+        main.dify_settings = None
+        first = main.get_dify_settings()
+        assert main.get_dify_settings() is first
+    finally:
+        main.dify_settings = saved
+    print("✅ Dify settings are validated and parsed once")
+
+def test_dify_limits_are_validated():
+    """Pool, timeout, retry and warm-up values are parsed from DIFY_* and out-of-range values are rejected"""
+    settings = DifySettings.from_env({
+        "DIFY_MAX_CONNECTIONS": "50", "DIFY_READ_TIMEOUT": "120", "DIFY_HTTP2": "false",
+        "DIFY_RETRY_MAX_ATTEMPTS": "5", "DIFY_PROMPT_MODE": "context", "DIFY_WARMUP": "true", "DIFY_UPLOAD_HEDGE_DELAY": "",
+    })
+    assert settings.max_connections == 50 and settings.read_timeout == 120.0 and settings.retry_max_attempts == 5
+    assert settings.http2 is False and settings.warmup is True and settings.prompt_mode == "context"
+    assert settings.upload_hedge_delay == 0.0
+    invalid = [
+        {"DIFY_READ_TIMEOUT": "0"},
+        {"DIFY_MAX_CONNECTIONS": "0"},
+        {"DIFY_MAX_CONNECTIONS": "10", "DIFY_MAX_KEEPALIVE_CONNECTIONS": "20"},
+        {"DIFY_RETRY_MAX_ATTEMPTS": "100"},
+        {"DIFY_RETRY_BASE_DELAY": "10", "DIFY_RETRY_MAX_DELAY": "1"},
+        {"DIFY_RETRY_BUDGET_RATIO": "1.5"},
+        {"DIFY_UPLOAD_HEDGE_DELAY": "-1"},
+        {"DIFY_PROMPT_MODE": "full"},
+        {"DIFY_WARMUP": "maybe"},
+        {"DIFY_POOL_TIMEOUT": "ten"},
+    ]
+    for environ in invalid:
+        try:
+            DifySettings.from_env(environ)
+            assert False, f"{environ} was accepted"
+        except ValidationError:
+            pass
+    print("✅ Out-of-range Dify limits are rejected")
+
+def test_dotenv_configures_every_setting():
+    """Keys set only in .env configure non-Dify settings and Dify settings, and environment variables take precedence"""
+    script = (
+        "from app import main; "
+        "print(main.MAX_AUDIO_UPLOAD_BYTES, main.GOOGLE_SHEETS_SPREADSHEET_ID, main.ADMISSION_BURST, main.get_dify_settings().read_timeout)"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        env_file = os.path.join(directory, ".env")
+        with open(env_file, "w", encoding="utf-8") as f:
+            f.write("MAX_AUDIO_UPLOAD_BYTES=12345\nGOOGLE_SHEETS_SPREADSHEET_ID=sheet-from-dotenv\nADMISSION_BURST=3\nDIFY_READ_TIMEOUT=7\n")
+        env = {key: value for key, value in os.environ.items() if key not in ("MAX_AUDIO_UPLOAD_BYTES", "GOOGLE_SHEETS_SPREADSHEET_ID", "DIFY_READ_TIMEOUT")}
+        env.update(ENV_FILE=env_file, ADMISSION_BURST="20")
+        output = subprocess.run([sys.executable, "-c", script], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True)
+    assert output.stdout.split() == ["12345", "sheet-from-dotenv", "20", "7.0"]
+    print("✅ .env values configure every setting and environment variables win")
+
+def test_cold_start_per_mode():
+    """Every startup mode serves /healthz within budget and only lazy+warmup warms the Dify connection"""
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "startup.json")
+        exit_code = main_(parse_args(["--runs", "1", "--output", output]))
+        with open(output, encoding="utf-8") as f:
+            report = json.load(f)
+    assert exit_code == 0
+    assert report["imported_lazy_modules"] == []
+    scenarios = report["scenarios"]
+    assert set(scenarios) == {"eager", "lazy", "lazy+warmup"}
+    for result in scenarios.values():
+        assert 0 < result["cold_start_ms"] < 30000 and 0 < result["first_request_ms"] < 30000
+    assert scenarios["eager"]["warmup_calls"] == 0 and scenarios["lazy"]["warmup_calls"] == 0
+    assert scenarios["lazy+warmup"]["warmup_calls"] >= 1
+    print("✅ Cold start measured for every startup mode")
+
+def test_baseline_comparison_flags_regressions():
+    """Startup time growth beyond the threshold is reported as a regression"""
+    baseline = {"import_ms": 500.0, "scenarios": {"eager": {"cold_start_ms": 1000.0}, "lazy": {"cold_start_ms": 700.0}}}
+    report = {"import_ms": 520.0, "scenarios": {"eager": {"cold_start_ms": 1500.0}, "lazy": {"cold_start_ms": 710.0}, "lazy+warmup": {"cold_start_ms": 900.0}}}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "baseline.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(baseline, f)
+        assert compare_with_baseline(report, path, 0.2) == ["eager cold start"]
+    print("✅ Baseline comparison flags startup regressions")
+
+if __name__ == "__main__":
+    print("🚀 Starting Startup Time Test")
+    print("=" * 50)
+    test_import_defers_heavy_modules()
+    test_dify_settings_are_validated_once()
+    test_dify_limits_are_validated()
+    test_dotenv_configures_every_setting()
+    test_cold_start_per_mode()
+    test_baseline_comparison_flags_regressions()
+    print("=" * 50)
+    print("🎉 All tests passed!")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Test script for inbound audio uploads
+Checks that oversized bodies are rejected before they are written to disk and that preprocessing reads a
+named upload in place and copies spooled uploads to a single temporary file
+"""
+
+import asyncio
+import os
+import tempfile
+
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+
+from app import main
+from app.audio import synthesize_wav
+from app.settings import DifySettings
+from benchmarks.dify_stub import create_stub_app, run_stub_server
+
+BOUNDARY = "test-boundary"
+
+def multipart_chunks(size: int, chunk_size: int = 64 * 1024):
+    """Yields a multipart body with a WAV part of the given size (sent without Content-Length)"""
+    yield (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="audio_file"; filename="large.wav"\r\n'
+        f"Content-Type: audio/wav\r\n\r\n"
+    ).encode()
+    for offset in range(0, size, chunk_size):
+        yield b"\0" * min(chunk_size, size - offset)
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+def test_oversized_body_is_rejected_before_parsing():
+    """Content-Length over the limit gets 413 without taking an admission slot, and chunked bodies are cut off"""
+    limit = main.UPLOAD_BODY_LIMITS["/api/process-audio"]
+    main.UPLOAD_BODY_LIMITS["/api/process-audio"] = 256 * 1024
+    admitted = main.admission_controller.total_admitted
+    try:
+        with TestClient(main.app) as client:
+            declared = client.post(
+                "/api/process-audio",
+                files={"audio_file": ("large.wav", b"RIFF" + b"\0" * 512 * 1024, "audio/wav")},
+                headers={"Origin": "http://localhost:5173"}
+            )
+            admitted_after_declared = main.admission_controller.total_admitted
+            chunked = client.post(
+                "/api/process-audio",
+                content=multipart_chunks(512 * 1024),
+                headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"}
+            )
+            small = client.post("/api/process-audio", files={"audio_file": ("small.wav", b"RIFF" + b"\0" * 1024, "audio/wav")})
+    finally:
+        main.UPLOAD_BODY_LIMITS["/api/process-audio"] = limit
+    assert declared.status_code == 413 and "上限サイズ" in declared.json()["detail"]
+    assert declared.headers["access-control-allow-origin"] == "http://localhost:5173"
+    assert admitted_after_declared == admitted
+    assert chunked.status_code == 413
+    assert small.status_code == 200
+    print("✅ Oversized uploads rejected before the body is spooled")
+
+def test_named_upload_is_read_in_place():
+    """A named upload file is passed to the worker by path, spooled ones (in memory or unnamed on disk) are copied"""
+    async def scenario():
+        named = UploadFile(tempfile.NamedTemporaryFile(), filename="named.wav")
+        rolled = UploadFile(tempfile.SpooledTemporaryFile(max_size=1024), filename="rolled.wav")
+        small = UploadFile(tempfile.SpooledTemporaryFile(max_size=1024 * 1024), filename="small.wav")
+        results = []
+        try:
+            for upload in (named, rolled, small):
+                await upload.write(b"RIFF" + b"\0" * 4096)
+                await upload.seek(0)
+                path, spooled = await main.audio_input_path(upload)
+                with open(path, "rb") as f:
+                    results.append((len(f.read()), spooled))
+                if spooled:
+                    await main.remove_file(path)
+        finally:
+            for upload in (named, rolled, small):
+                await upload.close()
+        return results
+
+    results = asyncio.run(scenario())
+    assert results == [(4100, False), (4100, True), (4100, True)]
+    print("✅ Named uploads are read in place, spooled uploads are copied")
+
+def test_preprocessed_upload_is_copied_once():
+    """A multi-megabyte WAV is copied to one named temp file for preprocessing, which is removed afterwards"""
+    copies = []
+    spool = main.spool_audio_to_tempfile
+
+    async def counting_spool(audio_file):
+        path = await spool(audio_file)
+        copies.append(path)
+        return path
+
+    audio = synthesize_wav(30.0, sample_rate=44100)
+    stub = create_stub_app()
+    settings = main.dify_settings
+    main.spool_audio_to_tempfile = counting_spool
+    try:
+        with run_stub_server(app=stub) as api_url:
+            main.dify_settings = DifySettings(api_url=api_url, api_key="key", app_id="app", http2=False)
+            with TestClient(main.app) as client:
+                response = client.post("/api/process-audio", files={"audio_file": ("consultation.wav", audio, "audio/wav")})
+    finally:
+        main.spool_audio_to_tempfile = spool
+        main.dify_settings = settings
+    assert response.status_code == 200
+    assert len(copies) == 1 and not os.path.exists(copies[0])
+    assert stub.state.calls["upload"] == 1 and stub.state.upload_bytes < len(audio) / 2
+    print(f"✅ {len(audio) / 1e6:.1f}MB upload preprocessed from a single temp copy")
+
+if __name__ == "__main__":
+    print("🚀 Starting Upload Streaming Test")
+    print("=" * 50)
+    test_oversized_body_is_rejected_before_parsing()
+    test_named_upload_is_read_in_place()
+    test_preprocessed_upload_is_copied_once()
+    print("=" * 50)
+    print("🎉 All tests passed!")
@@ -7,10 +7,10 @@ Tests the full flow: audio + patient data → backend → Dify → medical recor
 import requests
 import json
 import wave
-import struct
-import math
 import os
 
+import numpy as np
+
 def create_test_audio():
     """Create a test WAV file"""
     sample_rate = 44100
@@ -22,12 +22,10 @@ def create_test_audio():
         wav_file.setsampwidth(2)
         wav_file.setframerate(sample_rate)
         
-        frames = []
-        for i in range(int(duration * sample_rate)):
-            value = int(32767 * 0.3 * math.sin(2 * math.pi * frequency * i / sample_rate))
-            frames.append(struct.pack('<h', value))
+        t = np.arange(int(duration * sample_rate)) / sample_rate
+        frames = (32767 * 0.3 * np.sin(2 * np.pi * frequency * t)).astype('<i2')
         
-        wav_file.writeframes(b''.join(frames))
+        wav_file.writeframes(frames.tobytes())
     
     return 'integration_test.wav'
 
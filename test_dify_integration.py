@@ -8,26 +8,26 @@ import requests
 import json
 import io
 import wave
-import struct
 import os
 
+import numpy as np
+
 def create_sample_audio_file():
     """Create a simple WAV file for testing"""
     sample_rate = 44100
     duration = 2  # seconds
     frequency = 440  # Hz (A note)
     
-    frames = []
-    for i in range(int(duration * sample_rate)):
-        value = int(32767 * 0.3 * (i % (sample_rate // frequency)) / (sample_rate // frequency))
-        frames.append(struct.pack('<h', value))
+    period = sample_rate // frequency
+    i = np.arange(int(duration * sample_rate))
+    frames = (32767 * 0.3 * (i % period) / period).astype('<i2')
     
     wav_buffer = io.BytesIO()
     with wave.open(wav_buffer, 'wb') as wav_file:
         wav_file.setnchannels(1)  # mono
         wav_file.setsampwidth(2)  # 16-bit
         wav_file.setframerate(sample_rate)
-        wav_file.writeframes(b''.join(frames))
+        wav_file.writeframes(frames.tobytes())
     
     wav_buffer.seek(0)
     return wav_buffer.getvalue()